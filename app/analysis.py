@@ -0,0 +1,519 @@
+import os
+import time
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+from app import schemas, crud, scoring_plan
+
+
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "64"))
+ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", "300"))
+ANALYSIS_PAGE_SIZE = int(os.getenv("ANALYSIS_PAGE_SIZE", "50000"))
+# Share of the ranked cohort in each of the upper and lower groups.
+DISCRIMINATION_GROUP = 0.27
+# Columns per block when forming the response x question rest scores.
+ITEM_BLOCK_SIZE = 32
+
+
+class AnalysisCache:
+    # Results per (session, analysis), valid while the signature holds: the
+    # surveys' scoring versions and the session's scoresVersion, which every
+    # finished scoring pass bumps. Both are read from Postgres, so rescoring
+    # through any worker is seen. The TTL bounds how long answers added
+    # since the last scoring go unseen.
+
+    def __init__(
+        self, maxsize: int = ANALYSIS_CACHE_SIZE, ttl: float = ANALYSIS_CACHE_TTL
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._results = OrderedDict()
+
+    def get(self, session_id: int, name: str, signature: Tuple):
+        cached = self._results.get((session_id, name))
+        if (
+            cached is None
+            or cached[0] != signature
+            or time.monotonic() - cached[1] > self.ttl
+        ):
+            return None
+        self._results.move_to_end((session_id, name))
+        return cached[2]
+
+    def put(self, session_id: int, name: str, signature: Tuple, result):
+        self._results[(session_id, name)] = (signature, time.monotonic(), result)
+        self._results.move_to_end((session_id, name))
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def invalidate(self, session_id: int):
+        for cache_key in [
+            cache_key for cache_key in self._results if cache_key[0] == session_id
+        ]:
+            del self._results[cache_key]
+
+
+analysis_cache = AnalysisCache()
+
+
+def plans_signature(plans) -> Tuple:
+    return tuple((plan.survey_id, plan.version) for plan in plans)
+
+
+async def analysis_signature(session_id: int, plans) -> Tuple:
+    return plans_signature(plans), await crud.get_session_scores_version(session_id)
+
+
+@dataclass
+class SessionAnswers:
+    # Column arrays of the session's answers; missing option ids are -1.
+    response_ids: np.ndarray
+    question_ids: np.ndarray
+    option_ids: np.ndarray
+    static_option_ids: np.ndarray
+
+
+async def load_session_answers(
+    session_id: int, question_type: schemas.QuestionType
+) -> SessionAnswers:
+    columns = ("responseId", "questionId", "optionId", "staticOptionId")
+    values = {column: [] for column in columns}
+    after_id = 0
+    while True:
+        answers = await crud.list_typed_answers_for_exam_session_page(
+            session_id=session_id,
+            question_type=question_type,
+            after_id=after_id,
+            take=ANALYSIS_PAGE_SIZE,
+        )
+        if not answers:
+            break
+        for answer in answers:
+            for column in columns:
+                value = answer[column]
+                values[column].append(value if value is not None else -1)
+        after_id = answers[-1]["id"]
+
+    return SessionAnswers(
+        *[np.array(values[column], dtype=np.int64) for column in columns]
+    )
+
+
+def _choice_option_table(plans):
+    # Options of every MULTIPLE_CHOICE question, sorted by option id.
+    option_ids = []
+    option_questions = []
+    option_correct = []
+    for plan in plans:
+        choice = np.array(
+            [
+                plan.key.question_types[question_id]
+                == schemas.QuestionType.MULTIPLE_CHOICE
+                for question_id in plan.option_questions.tolist()
+            ],
+            dtype=bool,
+        )
+        option_ids.append(plan.option_ids[choice])
+        option_questions.append(plan.option_questions[choice])
+        option_correct.append(plan.option_correct[choice])
+
+    if not option_ids:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=bool)
+
+    option_ids = np.concatenate(option_ids)
+    order = np.argsort(option_ids)
+    return (
+        option_ids[order],
+        np.concatenate(option_questions)[order],
+        np.concatenate(option_correct)[order],
+    )
+
+
+def _point_biserial(correct: np.ndarray, points: np.ndarray) -> np.ndarray:
+    # Correlation of each item with the rest score (total minus the item),
+    # so an item does not correlate with itself.
+    n_responses, n_items = correct.shape
+    totals = (correct * points).sum(axis=1)
+    result = np.full(n_items, np.nan)
+
+    for start in range(0, n_items, ITEM_BLOCK_SIZE):
+        block = slice(start, start + ITEM_BLOCK_SIZE)
+        item = correct[:, block].astype(np.float64)
+        rest = totals[:, None] - item * points[block]
+
+        item_mean = item.mean(axis=0)
+        rest_mean = rest.mean(axis=0)
+        covariance = (item * rest).mean(axis=0) - item_mean * rest_mean
+        scale = np.sqrt(item_mean * (1 - item_mean)) * rest.std(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result[block] = np.where(scale > 0, covariance / scale, np.nan)
+
+    return result
+
+
+def compute_item_analysis(
+    answer_responses: np.ndarray, answer_options: np.ndarray, plans
+) -> Tuple[int, List[schemas.ItemStatistics]]:
+    key = scoring_plan.merge_answer_keys([plan.key for plan in plans])
+    option_ids, option_questions, option_correct = _choice_option_table(plans)
+    question_ids = np.unique(option_questions)
+    points = np.array(
+        [key.points[question_id] or 0 for question_id in question_ids.tolist()],
+        dtype=np.float64,
+    )
+
+    # Keep the answers that picked an option of a scored question.
+    positions = np.searchsorted(option_ids, answer_options)
+    positions[positions >= len(option_ids)] = 0
+    valid = (
+        option_ids[positions] == answer_options
+        if len(option_ids)
+        else np.zeros(len(answer_options), dtype=bool)
+    )
+    positions = positions[valid]
+    response_ids, rows = np.unique(answer_responses[valid], return_inverse=True)
+    columns = np.searchsorted(question_ids, option_questions[positions])
+
+    n_responses, n_items = len(response_ids), len(question_ids)
+    if not n_responses:
+        return 0, []
+
+    # response x question matrix of the chosen option position, -1 if skipped.
+    choices = np.full((n_responses, n_items), -1, dtype=np.int32)
+    choices[rows, columns] = positions
+    answered = choices >= 0
+    correct = answered & option_correct[np.where(answered, choices, 0)]
+
+    totals = (correct * points).sum(axis=1)
+    ranked = np.argsort(totals, kind="stable")
+    group_size = max(1, int(round(n_responses * DISCRIMINATION_GROUP)))
+    lower, upper = ranked[:group_size], ranked[-group_size:]
+
+    difficulty = correct.mean(axis=0)
+    discrimination = correct[upper].mean(axis=0) - correct[lower].mean(axis=0)
+    point_biserial = _point_biserial(correct, points)
+
+    n_options = len(option_ids)
+    counts = np.bincount(choices[answered], minlength=n_options)
+    upper_counts = np.bincount(choices[upper][answered[upper]], minlength=n_options)
+    lower_counts = np.bincount(choices[lower][answered[lower]], minlength=n_options)
+    answered_counts = answered.sum(axis=0)
+
+    items = []
+    for column, question_id in enumerate(question_ids.tolist()):
+        options = np.flatnonzero(option_questions == question_id)
+        items.append(
+            schemas.ItemStatistics(
+                questionId=question_id,
+                answered=int(answered_counts[column]),
+                difficulty=float(difficulty[column]),
+                discrimination=float(discrimination[column]),
+                pointBiserial=(
+                    None
+                    if np.isnan(point_biserial[column])
+                    else float(point_biserial[column])
+                ),
+                options=[
+                    schemas.DistractorCount(
+                        optionId=int(option_ids[option]),
+                        order=key.option_orders[int(option_ids[option])],
+                        correct=bool(option_correct[option]),
+                        count=int(counts[option]),
+                        upperCount=int(upper_counts[option]),
+                        lowerCount=int(lower_counts[option]),
+                    )
+                    for option in options
+                ],
+            )
+        )
+    return n_responses, items
+
+
+async def get_item_analysis(exam_session) -> schemas.ItemAnalysisReport:
+    survey_ids = [exam_survey.surveyId for exam_survey in exam_session.exam.examSurveys]
+    plans = await scoring_plan.get_scoring_plans(survey_ids)
+    signature = await analysis_signature(exam_session.id, plans)
+
+    report = analysis_cache.get(exam_session.id, "items", signature)
+    if report is None:
+        answers = await load_session_answers(
+            exam_session.id, schemas.QuestionType.MULTIPLE_CHOICE
+        )
+        response_count, items = compute_item_analysis(
+            answers.response_ids, answers.option_ids, plans
+        )
+        report = schemas.ItemAnalysisReport(
+            examSessionId=exam_session.id,
+            responseCount=response_count,
+            items=items,
+        )
+        analysis_cache.put(exam_session.id, "items", signature, report)
+    return report
+
+
+def _expand_impacts(table_ids, indptr, factors, values, answer_keys, answer_valid):
+    # Expands every answer into the CSR row of its key (an option or a static
+    # option) and returns the (answer, factor, value) triples.
+    positions = np.searchsorted(table_ids, answer_keys)
+    positions[positions >= len(table_ids)] = 0
+    if len(table_ids):
+        answer_valid = answer_valid & (table_ids[positions] == answer_keys)
+    else:
+        answer_valid = np.zeros(len(answer_keys), dtype=bool)
+
+    answers = np.flatnonzero(answer_valid)
+    starts = indptr[positions[answers]]
+    counts = indptr[positions[answers] + 1] - starts
+    offsets = np.cumsum(counts) - counts
+    cells = (
+        np.arange(counts.sum(), dtype=np.int64)
+        - np.repeat(offsets, counts)
+        + np.repeat(starts, counts)
+    )
+    return np.repeat(answers, counts), factors[cells], values[cells]
+
+
+def _impact_tables(plans):
+    # PSYCHOLOGY option impacts and static option impacts of all plans as two
+    # CSR tables keyed by sorted option / static option id.
+    option_rows = []
+    static_rows = []
+    for plan in plans:
+        for position, option_id in enumerate(plan.option_ids.tolist()):
+            start, end = plan.impact_indptr[position], plan.impact_indptr[position + 1]
+            option_rows.append(
+                (
+                    option_id,
+                    plan.impact_factors[start:end],
+                    plan.impact_values[start:end],
+                )
+            )
+        for row, static_option_id in enumerate(plan.static_option_ids.tolist()):
+            impacts = plan.static_impacts[row]
+            columns = np.flatnonzero(impacts)
+            static_rows.append(
+                (static_option_id, plan.static_factor_ids[columns], impacts[columns])
+            )
+
+    def table(rows):
+        rows.sort(key=lambda row: row[0])
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        indptr = np.cumsum([0] + [len(row[1]) for row in rows]).astype(np.int64)
+        factors = np.concatenate([row[1] for row in rows] + [np.zeros(0, np.int64)])
+        values = np.concatenate([row[2] for row in rows] + [np.zeros(0, np.int64)])
+        return ids, indptr, factors.astype(np.int64), values.astype(np.float64)
+
+    return table(option_rows), table(static_rows)
+
+
+def _scale_items(key, option_questions: Dict[int, int]) -> Dict[int, List[int]]:
+    # PSYCHOLOGY questions contributing to each factor: those with an option
+    # impacting it, and every question of a survey whose static scale does.
+    psychology_questions = {
+        question_id: key.question_surveys[question_id]
+        for question_id, question_type in key.question_types.items()
+        if question_type == schemas.QuestionType.PSYCHOLOGY
+    }
+
+    items = {}
+    for option_id, impacts in key.option_impacts.items():
+        question_id = option_questions.get(option_id)
+        if question_id not in psychology_questions:
+            continue
+        for factor_id, _ in impacts:
+            items.setdefault(factor_id, set()).add(question_id)
+
+    for static_option_id, impacts in key.static_option_impacts.items():
+        survey_id = key.static_option_surveys[static_option_id]
+        for factor_id, _ in impacts:
+            items.setdefault(factor_id, set()).update(
+                question_id
+                for question_id, question_survey in psychology_questions.items()
+                if question_survey == survey_id
+            )
+
+    return {factor_id: sorted(questions) for factor_id, questions in items.items()}
+
+
+def _cronbach(matrix: np.ndarray):
+    # Alpha and corrected item-total correlations from the item covariances.
+    n_responses, n_items = matrix.shape
+    if n_items < 2 or n_responses < 2:
+        return None, [None] * n_items
+
+    covariance = np.cov(matrix, rowvar=False)
+    variances = np.diag(covariance)
+    total_variance = covariance.sum()
+    alpha = None
+    if total_variance > 0:
+        alpha = n_items / (n_items - 1) * (1 - variances.sum() / total_variance)
+
+    row_sums = covariance.sum(axis=1)
+    rest_variances = total_variance - 2 * row_sums + variances
+    scale = np.sqrt(np.clip(variances * rest_variances, 0, None))
+    correlations = [
+        float((row_sum - variance) / item_scale) if item_scale > 0 else None
+        for row_sum, variance, item_scale in zip(row_sums, variances, scale)
+    ]
+    return (float(alpha) if alpha is not None else None), correlations
+
+
+def compute_reliability(answers: SessionAnswers, plans):
+    key = scoring_plan.merge_answer_keys([plan.key for plan in plans])
+    option_questions = {
+        option_id: question_id
+        for plan in plans
+        for option_id, question_id in zip(
+            plan.option_ids.tolist(), plan.option_questions.tolist()
+        )
+    }
+    option_table, static_table = _impact_tables(plans)
+
+    question_ids = np.array(sorted(key.question_surveys), dtype=np.int64)
+    question_surveys = np.array(
+        [key.question_surveys[question_id] for question_id in question_ids.tolist()],
+        dtype=np.int64,
+    )
+    static_ids = np.array(sorted(key.static_option_surveys), dtype=np.int64)
+    static_surveys = np.array(
+        [key.static_option_surveys[static_id] for static_id in static_ids.tolist()],
+        dtype=np.int64,
+    )
+
+    known = np.isin(answers.question_ids, question_ids)
+    answer_surveys = np.full(len(answers.question_ids), -1, dtype=np.int64)
+    answer_surveys[known] = question_surveys[
+        np.searchsorted(question_ids, answers.question_ids[known])
+    ]
+    static_positions = np.searchsorted(static_ids, answers.static_option_ids)
+    static_positions[static_positions >= len(static_ids)] = 0
+    same_survey = (
+        known & (static_surveys[static_positions] == answer_surveys)
+        if len(static_ids)
+        else np.zeros(len(answer_surveys), dtype=bool)
+    )
+
+    option_triples = _expand_impacts(*option_table, answers.option_ids, known)
+    static_triples = _expand_impacts(
+        *static_table, answers.static_option_ids, same_survey
+    )
+    triple_answers, triple_factors, triple_values = (
+        np.concatenate(parts) for parts in zip(option_triples, static_triples)
+    )
+
+    # Triples by factor and answers by question, so every scale gathers its
+    # rows with a few slices instead of a scan.
+    order = np.argsort(triple_factors, kind="stable")
+    triple_answers, triple_factors, triple_values = (
+        triple_answers[order],
+        triple_factors[order],
+        triple_values[order],
+    )
+    answer_order = np.argsort(answers.question_ids, kind="stable")
+    sorted_questions = answers.question_ids[answer_order]
+
+    def factor_slice(factor_id):
+        return slice(
+            np.searchsorted(triple_factors, factor_id, "left"),
+            np.searchsorted(triple_factors, factor_id, "right"),
+        )
+
+    def question_answers(question_id):
+        return answer_order[
+            np.searchsorted(sorted_questions, question_id, "left") : np.searchsorted(
+                sorted_questions, question_id, "right"
+            )
+        ]
+
+    items = _scale_items(key, option_questions)
+
+    def scale_reliability(factor_ids, item_ids, **scale):
+        # Respondents are those who answered any item of the scale; skipped
+        # items count as no contribution, the same way the factor sums do.
+        item_ids = np.array(item_ids, dtype=np.int64)
+        respondents = np.unique(
+            answers.response_ids[
+                np.concatenate(
+                    [question_answers(item_id) for item_id in item_ids.tolist()]
+                    + [np.zeros(0, dtype=np.int64)]
+                )
+            ]
+        )
+        selected = np.concatenate(
+            [np.arange(len(triple_answers))[factor_slice(f)] for f in factor_ids]
+            + [np.zeros(0, dtype=np.int64)]
+        )
+        selected_answers = triple_answers[selected]
+        rows = np.searchsorted(respondents, answers.response_ids[selected_answers])
+        columns = np.searchsorted(item_ids, answers.question_ids[selected_answers])
+
+        matrix = np.bincount(
+            rows * len(item_ids) + columns,
+            weights=triple_values[selected],
+            minlength=len(respondents) * len(item_ids),
+        ).reshape(len(respondents), len(item_ids))
+
+        alpha, correlations = _cronbach(matrix)
+        return schemas.ScaleReliability(
+            **scale,
+            respondents=len(respondents),
+            items=len(item_ids),
+            alpha=alpha,
+            itemTotal=[
+                schemas.ItemTotalCorrelation(questionId=item_id, correlation=correlation)
+                for item_id, correlation in zip(item_ids.tolist(), correlations)
+            ],
+        )
+
+    factor_ids = [
+        factor_id
+        for plan in plans
+        for factor_id in plan.key.survey_factors[plan.survey_id]
+    ]
+    factors = [
+        scale_reliability([factor_id], items.get(factor_id, []), factorId=factor_id)
+        for factor_id in factor_ids
+    ]
+
+    parameter_factors = {}
+    for factor_id in factor_ids:
+        parameter_id = key.factor_parameters.get(factor_id)
+        if parameter_id is not None:
+            parameter_factors.setdefault(parameter_id, []).append(factor_id)
+    parameters = [
+        scale_reliability(
+            parameter_factor_ids,
+            sorted(
+                {
+                    item_id
+                    for factor_id in parameter_factor_ids
+                    for item_id in items.get(factor_id, [])
+                }
+            ),
+            parameterId=parameter_id,
+        )
+        for parameter_id, parameter_factor_ids in parameter_factors.items()
+    ]
+    return factors, parameters
+
+
+async def get_reliability(exam_session) -> schemas.ReliabilityReport:
+    survey_ids = [exam_survey.surveyId for exam_survey in exam_session.exam.examSurveys]
+    plans = await scoring_plan.get_scoring_plans(survey_ids)
+    signature = await analysis_signature(exam_session.id, plans)
+
+    report = analysis_cache.get(exam_session.id, "reliability", signature)
+    if report is None:
+        answers = await load_session_answers(
+            exam_session.id, schemas.QuestionType.PSYCHOLOGY
+        )
+        factors, parameters = compute_reliability(answers, plans)
+        report = schemas.ReliabilityReport(
+            examSessionId=exam_session.id,
+            factors=factors,
+            parameters=parameters,
+        )
+        analysis_cache.put(exam_session.id, "reliability", signature, report)
+    return report
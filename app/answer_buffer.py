@@ -0,0 +1,380 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+import asyncpg
+from prisma.errors import DataError
+from app import crud
+
+
+ANSWER_WRITE_BEHIND = os.getenv("ANSWER_WRITE_BEHIND", "0") == "1"
+ANSWER_LOG_PATH = os.getenv("ANSWER_LOG_PATH", "answer_log/answers.jsonl")
+ANSWER_FLUSH_INTERVAL_MS = int(os.getenv("ANSWER_FLUSH_INTERVAL_MS", "200"))
+ANSWER_FLUSH_BATCH_SIZE = int(os.getenv("ANSWER_FLUSH_BATCH_SIZE", "1000"))
+ANSWER_ID_BLOCK_SIZE = int(os.getenv("ANSWER_ID_BLOCK_SIZE", "100"))
+ANSWER_DEAD_LETTER_PATH = os.getenv(
+    "ANSWER_DEAD_LETTER_PATH", "answer_log/dead_letter.jsonl"
+)
+# Advisory lock key held by the single worker allowed to buffer answers.
+ANSWER_WRITER_LOCK_KEY = 7_310_018
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerLog:
+    # Append-only JSON lines file. Appends are acknowledged once fsync'd;
+    # appends that arrive while a sync runs share the next one.
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._written = 0
+        self._synced = 0
+        self._sync_task: Optional[asyncio.Task] = None
+
+    def open(self) -> List[dict]:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        records = []
+        if os.path.exists(self.path):
+            with open(self.path, "r") as log_file:
+                for line in log_file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # A torn last line was never acknowledged.
+                        break
+        # The surviving records are rewritten to a temporary file that replaces
+        # the log only once it is synced, so a crash here keeps one full copy.
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as temporary_file:
+            for record in records:
+                temporary_file.write(json.dumps(record) + "\n")
+            temporary_file.flush()
+            os.fsync(temporary_file.fileno())
+        os.replace(temporary_path, self.path)
+        directory = os.open(os.path.dirname(self.path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+        self._file = open(self.path, "a")
+        return records
+
+    def _sync_file(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    async def wait_synced(self, target: int):
+        while self._synced < target:
+            if self._sync_task is None:
+                self._sync_task = asyncio.create_task(self._run_sync())
+            await asyncio.shield(self._sync_task)
+
+    async def _run_sync(self):
+        written = self._written
+        try:
+            await asyncio.to_thread(self._sync_file)
+            self._synced = max(self._synced, written)
+        finally:
+            self._sync_task = None
+
+    def write(self, record: dict) -> int:
+        self._file.write(json.dumps(record) + "\n")
+        self._written += 1
+        return self._written
+
+    def truncate(self):
+        # Only called when every appended record is stored in Postgres.
+        self._file.seek(0)
+        self._file.truncate()
+        self._sync_file()
+
+    @property
+    def written(self) -> int:
+        return self._written
+
+    @property
+    def idle(self) -> bool:
+        return self._sync_task is None and self._synced == self._written
+
+    def close(self):
+        if self._file is not None:
+            self._sync_file()
+            self._file.close()
+            self._file = None
+
+
+class DeadLetterFile:
+    # Buffered answers Postgres refused for good, kept for manual repair
+    # instead of being retried forever.
+
+    def __init__(self, path: str = ANSWER_DEAD_LETTER_PATH):
+        self.path = path
+        self.count = 0
+
+    def append(self, record: dict, reason: str, level: int = logging.WARNING):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as dead_letter_file:
+            dead_letter_file.write(json.dumps({"record": record, "reason": reason}) + "\n")
+            dead_letter_file.flush()
+            os.fsync(dead_letter_file.fileno())
+        self.count += 1
+        logger.log(
+            level,
+            "Buffered answer %s for response %s, question %s dead-lettered: %s",
+            record["id"],
+            record["responseId"],
+            record["questionId"],
+            reason,
+        )
+
+
+class AnswerBuffer:
+    # Deduplication is exact only within one process: an answer is
+    # acknowledged before Postgres sees it, so a second buffering worker
+    # could acknowledge another answer to the same question. start() takes
+    # a Postgres advisory lock to make this worker the only writer; workers
+    # that do not get it leave the buffer disabled and write synchronously.
+    #
+    # An acknowledgement means the answer is in the fsync'd log, not that it
+    # will be stored: a record that conflicts with an answer another worker
+    # wrote synchronously is dead-lettered at flush time. Such losses are counted in "conflicts"
+    # and logged at error level.
+
+    def __init__(
+        self,
+        path: str = ANSWER_LOG_PATH,
+        interval_ms: int = ANSWER_FLUSH_INTERVAL_MS,
+        batch_size: int = ANSWER_FLUSH_BATCH_SIZE,
+        dead_letter_path: str = ANSWER_DEAD_LETTER_PATH,
+    ):
+        self.log = AnswerLog(path)
+        self.dead_letter = DeadLetterFile(dead_letter_path)
+        self.interval = interval_ms / 1000
+        self.batch_size = batch_size
+        self.pending: List[dict] = []
+        self.pending_answers: Dict[Tuple[int, int], dict] = {}
+        self.flushed_total = 0
+        self.conflicts = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self._ids: List[int] = []
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._add_lock = asyncio.Lock()
+        self.enabled = False
+        self._task: Optional[asyncio.Task] = None
+        self._writer_connection = None
+
+    async def _lock_writer(self) -> bool:
+        connection = await asyncpg.connect(crud.postgres_dsn())
+        locked = await connection.fetchval(
+            "SELECT pg_try_advisory_lock($1)", ANSWER_WRITER_LOCK_KEY
+        )
+        if not locked:
+            await connection.close()
+            return False
+        self._writer_connection = connection
+        return True
+
+    async def start(self):
+        if not await self._lock_writer():
+            logger.warning(
+                "Answer buffer is held by another worker; "
+                "this worker writes answers synchronously"
+            )
+            return
+        self.enabled = True
+        for record in self.log.open():
+            self._enqueue(record)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            while self.pending:
+                await self.flush()
+        except Exception:
+            # The records stay in the synced log and replay on the next start.
+            logger.exception(
+                "Answer buffer stopped with %s answers pending", len(self.pending)
+            )
+        self.log.close()
+        if self._writer_connection is not None:
+            # Closing the session releases the advisory lock.
+            try:
+                await self._writer_connection.close()
+            except Exception:
+                self._writer_connection.terminate()
+            self._writer_connection = None
+        self.enabled = False
+
+    def _enqueue(self, record: dict):
+        self.pending.append(record)
+        self.pending_answers[(record["responseId"], record["questionId"])] = record
+        if len(self.pending) >= self.batch_size:
+            self._full.set()
+
+    def get_pending(self, response_id: int, question_id: int) -> Optional[dict]:
+        return self.pending_answers.get((response_id, question_id))
+
+    async def _next_id(self) -> int:
+        # Ids come from the Answer sequence in blocks, so an acknowledged
+        # answer already has the id it will be stored with.
+        if not self._ids:
+            self._ids = await crud.allocate_answer_ids(ANSWER_ID_BLOCK_SIZE)
+        return self._ids.pop(0)
+
+    async def add(self, response_id: int, answer_data: dict) -> Tuple[dict, bool]:
+        # Returns the answer stored or buffered for (response, question) and
+        # whether this call added it. The stored-answer lookup runs unlocked;
+        # it is repeated under the lock only if a flush finished meanwhile.
+        question_id = answer_data["questionId"]
+        flushes = self.flushes
+        stored_answer = await crud.get_answer(response_id, question_id)
+
+        async with self._add_lock:
+            pending_answer = self.get_pending(response_id, question_id)
+            if pending_answer is None and not stored_answer and self.flushes != flushes:
+                stored_answer = await crud.get_answer(response_id, question_id)
+            if stored_answer:
+                return stored_answer.dict(), False
+            if pending_answer is not None:
+                # It may have been logged by a request still awaiting fsync.
+                await self.log.wait_synced(self.log.written)
+                return pending_answer, False
+
+            record = {
+                **answer_data,
+                "id": await self._next_id(),
+                "responseId": response_id,
+                "creationDate": datetime.now(timezone.utc).isoformat(),
+            }
+            self._enqueue(record)
+            position = self.log.write(record)
+
+        await self.log.wait_synced(position)
+        return record, True
+
+    async def add_many(
+        self, response_id: int, answers_data: List[dict]
+    ) -> Optional[List[dict]]:
+        # Buffers all answers, or none if any question is already answered.
+        question_ids = [answer_data["questionId"] for answer_data in answers_data]
+        flushes = self.flushes
+        answered = await crud.list_answered_question_ids(response_id, question_ids)
+
+        async with self._add_lock:
+            if any(
+                self.get_pending(response_id, question_id)
+                for question_id in question_ids
+            ):
+                return None
+            if not answered and self.flushes != flushes:
+                answered = await crud.list_answered_question_ids(
+                    response_id, question_ids
+                )
+            if answered:
+                return None
+
+            answer_ids = [await self._next_id() for _ in answers_data]
+            creation_date = datetime.now(timezone.utc).isoformat()
+            records = []
+            for answer_id, answer_data in zip(answer_ids, answers_data):
+                record = {
+                    **answer_data,
+                    "id": answer_id,
+                    "responseId": response_id,
+                    "creationDate": creation_date,
+                }
+                self._enqueue(record)
+                position = self.log.write(record)
+                records.append(record)
+
+        await self.log.wait_synced(position)
+        return records
+
+    async def _insert_rows(self, batch: List[dict]) -> Tuple[Set[int], Set[int]]:
+        # A batch Postgres rejects for its data is retried row by row, so one
+        # bad record does not hold back the rest.
+        stored_ids, dead_ids = set(), set()
+        for record in batch:
+            try:
+                stored_ids |= await crud.insert_buffered_answers([record])
+            except DataError as error:
+                self.dead_letter.append(record, str(error))
+                dead_ids.add(record["id"])
+        return stored_ids, dead_ids
+
+    async def flush(self):
+        async with self._lock:
+            batch = self.pending[: self.batch_size]
+            if not batch:
+                return
+
+            started = time.monotonic()
+            try:
+                stored_ids, dead_ids = await crud.insert_buffered_answers(batch), set()
+            except DataError:
+                stored_ids, dead_ids = await self._insert_rows(batch)
+            self.last_flush_seconds = time.monotonic() - started
+            self.flushed_total += len(stored_ids)
+
+            for record in batch:
+                if record["id"] not in stored_ids and record["id"] not in dead_ids:
+                    # skip_duplicates dropped it: the question already has a
+                    # stored answer that was not written by this buffer, and
+                    # the client was told this one was saved.
+                    self.dead_letter.append(
+                        record, "conflicting stored answer", logging.ERROR
+                    )
+                    self.conflicts += 1
+
+            self.flushes += 1
+            del self.pending[: len(batch)]
+            for record in batch:
+                self.pending_answers.pop(
+                    (record["responseId"], record["questionId"]), None
+                )
+            if len(self.pending) < self.batch_size:
+                self._full.clear()
+            if not self.pending and self.log.idle:
+                self.log.truncate()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                # Postgres is unavailable; the records stay pending and logged.
+                await asyncio.sleep(self.interval)
+
+    def metrics(self) -> dict:
+        lag = 0.0
+        if self.pending:
+            oldest = datetime.fromisoformat(self.pending[0]["creationDate"])
+            lag = (datetime.now(timezone.utc) - oldest).total_seconds()
+        return {
+            "enabled": self.enabled,
+            "pending": len(self.pending),
+            "lagSeconds": lag,
+            "flushedTotal": self.flushed_total,
+            "deadLettered": self.dead_letter.count,
+            "conflicts": self.conflicts,
+            "lastFlushSeconds": self.last_flush_seconds,
+            "flushIntervalMs": int(self.interval * 1000),
+            "flushBatchSize": self.batch_size,
+        }
+
+
+answer_buffer = AnswerBuffer()
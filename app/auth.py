@@ -1,8 +1,15 @@
+import asyncio
+import hashlib
 import os
+import time
+import uuid
 import jwt
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Union
 from passlib.context import CryptContext
+from fastapi import HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from dotenv import load_dotenv
 
@@ -11,6 +18,8 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_POOL_MAX_PENDING = int(os.getenv("PASSWORD_POOL_MAX_PENDING", "64"))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -21,7 +30,7 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -32,8 +41,75 @@ def decode_access_token(token: str):
     except jwt.PyJWTError:
         return None
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+def get_token_id(token: str, payload: dict) -> str:
+    # Tokens issued before jti was added are identified by their hash.
+    return payload.get("jti") or hashlib.sha256(token.encode()).hexdigest()
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+class PasswordPool:
+    # bcrypt releases the GIL, so hashing runs on a bounded thread pool and
+    # the event loop keeps serving other requests. Past max_pending queued or
+    # running operations new ones are refused instead of piling up.
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_POOL_WORKERS,
+        max_pending: int = PASSWORD_POOL_MAX_PENDING,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password"
+        )
+        self._latencies = {"hash": deque(maxlen=1000), "verify": deque(maxlen=1000)}
+        self._counts = {"hash": 0, "verify": 0}
+
+    async def run(self, operation: str, function, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, try again shortly",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        started = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, function, *args
+            )
+        finally:
+            self.pending -= 1
+            self._counts[operation] += 1
+            self._latencies[operation].append(time.monotonic() - started)
+
+    def metrics(self) -> dict:
+        operations = {}
+        for operation, latencies in self._latencies.items():
+            ordered = sorted(latencies)
+            operations[operation] = {
+                "count": self._counts[operation],
+                "p50Seconds": ordered[len(ordered) // 2] if ordered else 0.0,
+                "p95Seconds": ordered[int(len(ordered) * 0.95)] if ordered else 0.0,
+                "maxSeconds": ordered[-1] if ordered else 0.0,
+            }
+        return {
+            "workers": self.workers,
+            "maxPending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "operations": operations,
+        }
+
+
+password_pool = PasswordPool()
+
+
+async def get_password_hash(password):
+    return await password_pool.run("hash", pwd_context.hash, password)
+
+async def verify_password(plain_password, hashed_password):
+    return await password_pool.run(
+        "verify", pwd_context.verify, plain_password, hashed_password
+    )
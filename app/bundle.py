@@ -0,0 +1,115 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+import orjson
+from app import schemas, crud
+
+
+BUNDLE_REVALIDATE_SECONDS = float(os.getenv("BUNDLE_REVALIDATE_SECONDS", "5"))
+BUNDLE_GZIP_LEVEL = int(os.getenv("BUNDLE_GZIP_LEVEL", "6"))
+
+
+@dataclass
+class ExamBundle:
+    # Serialized question/option payload of an exam, shared by its sessions.
+    signature: Tuple[Tuple[int, int], ...]
+    body: bytes
+    gzip_body: bytes
+    etag: str
+    checked_at: float
+
+
+class BundleCache:
+    # A bundle is valid while its exam's (survey id, scoringVersion) pairs are
+    # unchanged. Every question/option write bumps scoringVersion, so edits
+    # made through any worker are seen at the next revalidation; edits made
+    # through this worker drop the bundle at once.
+
+    def __init__(self, revalidate_seconds: float = BUNDLE_REVALIDATE_SECONDS):
+        self.revalidate_seconds = revalidate_seconds
+        self._bundles: Dict[int, ExamBundle] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def get(self, exam_id: int) -> Optional[ExamBundle]:
+        return self._bundles.get(exam_id)
+
+    def put(self, exam_id: int, exam_bundle: ExamBundle):
+        self._bundles[exam_id] = exam_bundle
+
+    def lock(self, exam_id: int) -> asyncio.Lock:
+        return self._locks.setdefault(exam_id, asyncio.Lock())
+
+    def invalidate_exam(self, exam_id: int):
+        self._bundles.pop(exam_id, None)
+
+    def invalidate_survey(self, survey_id: int):
+        for exam_id, exam_bundle in list(self._bundles.items()):
+            if any(signed_id == survey_id for signed_id, _ in exam_bundle.signature):
+                del self._bundles[exam_id]
+
+
+bundle_cache = BundleCache()
+
+
+def _signature(exam) -> Tuple[Tuple[int, int], ...]:
+    return tuple(
+        (exam_survey.surveyId, exam_survey.survey.scoringVersion)
+        for exam_survey in exam.examSurveys
+    )
+
+
+async def _build(exam, signature) -> ExamBundle:
+    survey_ids = [exam_survey.surveyId for exam_survey in exam.examSurveys]
+    questions_by_survey = {survey_id: [] for survey_id in survey_ids}
+    for question in await crud.list_questions_with_options_for_surveys(survey_ids):
+        questions_by_survey[question.surveyId].append(
+            schemas.QuestionResponse(**question.dict()).dict()
+        )
+
+    body = orjson.dumps(
+        [
+            question
+            for survey_id in survey_ids
+            for question in questions_by_survey[survey_id]
+        ]
+    )
+    return ExamBundle(
+        signature=signature,
+        body=body,
+        gzip_body=gzip.compress(body, compresslevel=BUNDLE_GZIP_LEVEL, mtime=0),
+        etag='"%s"' % hashlib.sha256(body).hexdigest()[:32],
+        checked_at=time.monotonic(),
+    )
+
+
+async def get_exam_bundle(exam_id: int) -> ExamBundle:
+    exam_bundle = bundle_cache.get(exam_id)
+    if (
+        exam_bundle is not None
+        and time.monotonic() - exam_bundle.checked_at < bundle_cache.revalidate_seconds
+    ):
+        return exam_bundle
+
+    # Concurrent starts of the same exam wait for a single build.
+    async with bundle_cache.lock(exam_id):
+        exam_bundle = bundle_cache.get(exam_id)
+        if (
+            exam_bundle is not None
+            and time.monotonic() - exam_bundle.checked_at
+            < bundle_cache.revalidate_seconds
+        ):
+            return exam_bundle
+
+        exam = await crud.get_exam_with_surveys(exam_id=exam_id)
+        signature = _signature(exam)
+        if exam_bundle is not None and exam_bundle.signature == signature:
+            exam_bundle.checked_at = time.monotonic()
+            return exam_bundle
+
+        exam_bundle = await _build(exam, signature)
+        bundle_cache.put(exam_id, exam_bundle)
+        return exam_bundle
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+from typing import Dict, Optional, Tuple
+from app import crud
+
+
+OPTION_COUNTER_FLUSH_INTERVAL = float(os.getenv("OPTION_COUNTER_FLUSH_INTERVAL", "1"))
+
+logger = logging.getLogger(__name__)
+
+
+class OptionCounterBuffer:
+    # Answers only bump an in-memory delta; a background task folds the
+    # deltas into OptionCount with one upsert per flush, so concurrent
+    # answers never contend on the same counter row.
+
+    def __init__(self, interval: float = OPTION_COUNTER_FLUSH_INTERVAL):
+        self.interval = interval
+        self.pending: Dict[Tuple[int, int, int], int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def record(self, session_id: int, question_id: int, option_id: Optional[int]):
+        if option_id is None:
+            return
+        counter_key = (session_id, question_id, option_id)
+        self.pending[counter_key] = self.pending.get(counter_key, 0) + 1
+
+    async def flush(self):
+        async with self._lock:
+            deltas, self.pending = self.pending, {}
+            if not deltas:
+                return
+            try:
+                await crud.add_option_counts(deltas)
+            except Exception:
+                # Keep the deltas for the next flush.
+                for counter_key, delta in deltas.items():
+                    self.pending[counter_key] = self.pending.get(counter_key, 0) + delta
+                raise
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            # Shutdown goes on; the unflushed deltas are lost.
+            logger.exception(
+                "Dropping %d option count deltas at shutdown", len(self.pending)
+            )
+
+    def pending_for_session(self, session_id: int) -> Dict[int, Tuple[int, int]]:
+        return {
+            option_id: (question_id, delta)
+            for (pending_session_id, question_id, option_id), delta in self.pending.items()
+            if pending_session_id == session_id
+        }
+
+
+option_counters = OptionCounterBuffer()
+
+
+async def get_option_distribution(session_id: int):
+    counts = {
+        option_count.optionId: [option_count.questionId, option_count.count]
+        for option_count in await crud.list_option_counts(session_id=session_id)
+    }
+    # Deltas still waiting for a flush, so the process that took the answer
+    # sees it at once.
+    for option_id, (question_id, delta) in option_counters.pending_for_session(
+        session_id
+    ).items():
+        counts.setdefault(option_id, [question_id, 0])[1] += delta
+
+    return [
+        {"questionId": question_id, "optionId": option_id, "count": count}
+        for option_id, (question_id, count) in sorted(
+            counts.items(), key=lambda item: (item[1][0], item[0])
+        )
+    ]
@@ -1,8 +1,12 @@
+import os
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 from prisma import Prisma
-from typing import List
+from typing import List, Dict, Optional
+from datetime import datetime, timedelta
 from app.auth import get_password_hash
 from app.schemas import (
     Role,
+    JobStatus,
     UserCreate,
     UserUpdate,
     SurveyCreate,
@@ -32,6 +36,53 @@ from app.schemas import (
 
 prisma = Prisma()
 
+# Query parameters understood by the Prisma engine but not by Postgres.
+PRISMA_URL_PARAMS = {
+    "schema",
+    "connection_limit",
+    "pool_timeout",
+    "pgbouncer",
+    "connect_timeout",
+    "socket_timeout",
+    "statement_cache_size",
+}
+
+BULK_CHUNK_SIZE = 5000
+BULK_TX_TIMEOUT = timedelta(minutes=5)
+
+
+def postgres_dsn() -> str:
+    # DATABASE_URL for clients that talk to Postgres directly (asyncpg).
+    parts = urlsplit(os.environ["DATABASE_URL"])
+    query = [
+        (name, value)
+        for name, value in parse_qsl(parts.query)
+        if name not in PRISMA_URL_PARAMS
+    ]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _chunks(items: list, size: int = BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+async def _bump_scoring_version(client, where: dict):
+    # Scoring plans are cached per (survey id, scoringVersion), so every
+    # write to a survey's scoring content moves its version forward. The
+    # bump runs last in the write's transaction: a reader that sees the new
+    # version also sees the write.
+    await client.survey.update_many(
+        where=where, data={"scoringVersion": {"increment": 1}}
+    )
+
+
+def _group_ids_by_value(values: dict):
+    groups = {}
+    for item_id, value in values.items():
+        groups.setdefault(value, []).append(item_id)
+    return groups.items()
+
 
 """
 User
@@ -39,7 +90,7 @@ User
 
 
 async def create_user(user: UserCreate):
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     user_data = {
         "username": user.username,
         "email": user.email,
@@ -55,7 +106,7 @@ async def create_user(user: UserCreate):
 
 # TEMP
 async def create_superadmin(user: UserCreate):
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     user_data = {
         "username": user.username,
         "email": user.email,
@@ -89,7 +140,7 @@ async def get_user_by_email_or_username(identifier: str):
 
 
 async def create_admin(user: UserCreate):
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     user_data = {
         "username": user.username,
         "email": user.email,
@@ -103,9 +154,48 @@ async def create_admin(user: UserCreate):
     return await prisma.user.create(data=user_data)
 
 
+PRINCIPAL_CHANNEL = "principal_invalidation"
+
+
+async def _notify_principal_change(client, email: str):
+    # Every worker caches users by token subject; the notification is
+    # delivered when the transaction commits.
+    await client.query_raw("SELECT pg_notify($1, $2)", PRINCIPAL_CHANNEL, email)
+
+
 async def update_user(user_id: int, user: UserUpdate):
     user_data = user.dict(exclude_unset=True)
-    return await prisma.user.update(where={"id": user_id}, data=user_data)
+    async with prisma.tx() as transaction:
+        existing_user = await transaction.user.find_unique(where={"id": user_id})
+        updated_user = await transaction.user.update(
+            where={"id": user_id}, data=user_data
+        )
+        await _notify_principal_change(transaction, existing_user.email)
+    return updated_user
+
+
+async def create_revoked_token(token_id: str, user_id: int, expires_at: datetime):
+    await prisma.revokedtoken.create_many(
+        data=[{"tokenId": token_id, "userId": user_id, "expiresAt": expires_at}],
+        skip_duplicates=True,
+    )
+
+
+async def get_revoked_token(token_id: str):
+    return await prisma.revokedtoken.find_unique(where={"tokenId": token_id})
+
+
+async def list_revoked_tokens(
+    expires_after: datetime, created_after: Optional[datetime] = None
+):
+    where = {"expiresAt": {"gt": expires_after}}
+    if created_after is not None:
+        where["creationDate"] = {"gte": created_after}
+    return await prisma.revokedtoken.find_many(where=where)
+
+
+async def delete_expired_revoked_tokens(now: datetime):
+    return await prisma.revokedtoken.delete_many(where={"expiresAt": {"lte": now}})
 
 
 async def list_admin_users():
@@ -131,6 +221,74 @@ async def get_survey_by_id(survey_id: int):
     return await prisma.survey.find_unique(where={"id": survey_id})
 
 
+def _owned_survey(survey_id: int, user_id: int):
+    # Relation filter matching a survey only when user_id is its author.
+    return {"is": {"id": survey_id, "authorId": user_id}}
+
+
+async def get_owned_survey(survey_id: int, user_id: int):
+    return await prisma.survey.find_first(
+        where={"id": survey_id, "authorId": user_id}
+    )
+
+
+async def get_owned_question(question_id: int, survey_id: int, user_id: int):
+    return await prisma.question.find_first(
+        where={"id": question_id, "survey": _owned_survey(survey_id, user_id)},
+        include={
+            "options": {"include": {"factorImpacts": True}},
+            "survey": True,
+        },
+    )
+
+
+async def get_owned_option(option_id: int, survey_id: int, user_id: int):
+    return await prisma.option.find_first(
+        where={
+            "id": option_id,
+            "question": {"is": {"survey": _owned_survey(survey_id, user_id)}},
+        },
+        include={"factorImpacts": True, "question": {"include": {"survey": True}}},
+    )
+
+
+async def get_owned_factor_impact(factor_impact_id: int, survey_id: int, user_id: int):
+    return await prisma.factorimpact.find_first(
+        where={
+            "id": factor_impact_id,
+            "option": {
+                "is": {
+                    "question": {"is": {"survey": _owned_survey(survey_id, user_id)}}
+                }
+            },
+        },
+        include={"option": {"include": {"question": {"include": {"survey": True}}}}},
+    )
+
+
+async def get_owned_static_option(static_option_id: int, survey_id: int, user_id: int):
+    return await prisma.staticoption.find_first(
+        where={"id": static_option_id, "survey": _owned_survey(survey_id, user_id)},
+        include={"staticFactorImpacts": True, "survey": True},
+    )
+
+
+async def get_owned_static_factor_impact(
+    static_factor_impact_id: int, survey_id: int, user_id: int
+):
+    return await prisma.staticfactorimpact.find_first(
+        where={
+            "id": static_factor_impact_id,
+            "staticOption": {"is": {"survey": _owned_survey(survey_id, user_id)}},
+        },
+        include={"staticOption": {"include": {"survey": True}}},
+    )
+
+
+async def list_surveys_by_ids(survey_ids: List[int]):
+    return await prisma.survey.find_many(where={"id": {"in": survey_ids}})
+
+
 async def get_survey_with_questions(survey_id: int):
     return await prisma.survey.find_unique(
         where={"id": survey_id}, include={"questions": {"include": {"options": True}}}
@@ -158,7 +316,10 @@ Factor
 async def create_factor(factor: FactorCreate, survey_id: int):
     data = factor.dict()
     data["surveyId"] = survey_id
-    return await prisma.factor.create(data=data)
+    async with prisma.tx() as transaction:
+        created_factor = await transaction.factor.create(data=data)
+        await _bump_scoring_version(transaction, {"id": survey_id})
+    return created_factor
 
 
 async def get_factor_by_id(factor_id: int):
@@ -169,13 +330,27 @@ async def list_survey_factors(survey_id: int):
     return await prisma.factor.find_many(where={"surveyId": survey_id})
 
 
+async def list_factors_for_surveys(survey_ids: List[int]):
+    return await prisma.factor.find_many(where={"surveyId": {"in": survey_ids}})
+
+
 async def update_factor(factor_id: int, factor: FactorUpdate):
     update_data = factor.dict(exclude_unset=True)
-    return await prisma.factor.update(where={"id": factor_id}, data=update_data)
+    async with prisma.tx() as transaction:
+        updated_factor = await transaction.factor.update(
+            where={"id": factor_id}, data=update_data
+        )
+        if updated_factor is not None:
+            await _bump_scoring_version(transaction, {"id": updated_factor.surveyId})
+    return updated_factor
 
 
 async def delete_factor(factor_id: int):
-    return await prisma.factor.delete(where={"id": factor_id})
+    async with prisma.tx() as transaction:
+        deleted_factor = await transaction.factor.delete(where={"id": factor_id})
+        if deleted_factor is not None:
+            await _bump_scoring_version(transaction, {"id": deleted_factor.surveyId})
+    return deleted_factor
 
 
 async def create_factor_value(factor_value: FactorValueCreate):
@@ -224,6 +399,7 @@ async def create_parameter(parameter: ParameterCreate, survey_id: int):
                 data["surveyId"] = survey_id
                 data["parameterId"] = created_parameter.id
                 await transaction.factor.create(data=data)
+        await _bump_scoring_version(transaction, {"id": survey_id})
 
     return await prisma.parameter.find_unique(
         where={"id": created_parameter.id},
@@ -266,6 +442,7 @@ async def update_parameter(parameter_id: int, parameter: ParameterUpdate):
                     data["surveyId"] = updated_parameter.surveyId
                     data["parameterId"] = updated_parameter.id
                     await transaction.factor.create(data=data)
+        await _bump_scoring_version(transaction, {"id": updated_parameter.surveyId})
 
     return await prisma.parameter.find_unique(
         where={"id": updated_parameter.id},
@@ -274,7 +451,15 @@ async def update_parameter(parameter_id: int, parameter: ParameterUpdate):
 
 
 async def delete_parameter(parameter_id: int):
-    return await prisma.parameter.delete(where={"id": parameter_id})
+    async with prisma.tx() as transaction:
+        deleted_parameter = await transaction.parameter.delete(
+            where={"id": parameter_id}
+        )
+        if deleted_parameter is not None:
+            await _bump_scoring_version(
+                transaction, {"id": deleted_parameter.surveyId}
+            )
+    return deleted_parameter
 
 
 """
@@ -289,11 +474,13 @@ async def create_question(survey_id: int, question: QuestionCreate) -> QuestionR
         created_question = await transaction.question.create(data=question_data)
 
         if question.questionType in ["SHORT_TEXT", "LONG_TEXT"]:
+            await _bump_scoring_version(transaction, {"id": survey_id})
             return created_question
 
         created_options = await create_options_for_question(
             transaction, created_question.id, question
         )
+        await _bump_scoring_version(transaction, {"id": survey_id})
 
         created_question_dict = created_question.dict()
         created_question_dict["options"] = created_options
@@ -304,7 +491,7 @@ async def create_options_for_question(
     transaction, question_id: int, question: QuestionCreate
 ) -> List[dict]:
     created_options = []
-    for option in question.options:
+    for option in question.options or []:
         option_data = option.dict(exclude={"factorImpacts"})
         option_data["questionId"] = question_id
         created_option = await transaction.option.create(data=option_data)
@@ -334,6 +521,16 @@ async def create_factor_impacts_for_option(
     return created_impacts
 
 
+async def list_exam_question_ids(exam_id: int, question_ids: List[int]):
+    questions = await prisma.question.find_many(
+        where={
+            "id": {"in": question_ids},
+            "survey": {"is": {"examSurveys": {"some": {"examId": exam_id}}}},
+        }
+    )
+    return {question.id for question in questions}
+
+
 async def get_question_by_id(question_id: int):
     return await prisma.question.find_unique(
         where={"id": question_id},
@@ -355,6 +552,21 @@ async def list_survey_questions(survey_id: int):
     return question_list
 
 
+async def list_questions_for_surveys(survey_ids: List[int]):
+    return await prisma.question.find_many(
+        where={"surveyId": {"in": survey_ids}},
+        include={"options": {"include": {"factorImpacts": True}}},
+    )
+
+
+async def list_questions_with_options_for_surveys(survey_ids: List[int]):
+    return await prisma.question.find_many(
+        where={"surveyId": {"in": survey_ids}},
+        include={"options": True},
+        order={"id": "asc"},
+    )
+
+
 async def update_question(question_id: int, question: QuestionUpdate):
     async with prisma.tx() as transaction:
         question_data = question.dict(exclude_unset=True, exclude={"options"})
@@ -363,9 +575,11 @@ async def update_question(question_id: int, question: QuestionUpdate):
         )
 
         if updated_question.questionType in ["SHORT_TEXT", "LONG_TEXT"]:
+            await _bump_scoring_version(transaction, {"id": updated_question.surveyId})
             return updated_question
 
         await update_options_for_question(transaction, updated_question.id, question)
+        await _bump_scoring_version(transaction, {"id": updated_question.surveyId})
 
     return await prisma.question.find_unique(
         where={"id": question_id},
@@ -443,12 +657,14 @@ async def delete_question(question_id: int):
         include={"options": {"include": {"factorImpacts": True}}},
     )
 
-    options = to_delete_question.options
-    for option in options:
-        await prisma.factorimpact.delete_many(where={"optionId": option.id})
+    async with prisma.tx() as transaction:
+        options = to_delete_question.options
+        for option in options:
+            await transaction.factorimpact.delete_many(where={"optionId": option.id})
 
-    await prisma.option.delete_many(where={"questionId": question_id})
-    await prisma.question.delete(where={"id": question_id})
+        await transaction.option.delete_many(where={"questionId": question_id})
+        await transaction.question.delete(where={"id": question_id})
+        await _bump_scoring_version(transaction, {"id": to_delete_question.surveyId})
 
     return to_delete_question
 
@@ -466,12 +682,35 @@ async def get_factor_impact(factor_impact_id: int):
 
 
 async def delete_option(option_id: int):
-    await prisma.factorimpact.delete_many(where={"optionId": option_id})
-    return await prisma.option.delete(where={"id": option_id})
+    async with prisma.tx() as transaction:
+        await transaction.factorimpact.delete_many(where={"optionId": option_id})
+        deleted_option = await transaction.option.delete(
+            where={"id": option_id}, include={"question": True}
+        )
+        if deleted_option is not None:
+            await _bump_scoring_version(
+                transaction, {"id": deleted_option.question.surveyId}
+            )
+    return deleted_option
+
+
+async def list_factor_impacts_by_ids(factor_impact_ids: List[int]):
+    return await prisma.factorimpact.find_many(
+        where={"id": {"in": factor_impact_ids}}
+    )
 
 
 async def delete_factor_impact(impact_id: int):
-    return await prisma.factorimpact.delete(where={"id": impact_id})
+    async with prisma.tx() as transaction:
+        deleted_impact = await transaction.factorimpact.delete(
+            where={"id": impact_id},
+            include={"option": {"include": {"question": True}}},
+        )
+        if deleted_impact is not None:
+            await _bump_scoring_version(
+                transaction, {"id": deleted_impact.option.question.surveyId}
+            )
+    return deleted_impact
 
 
 async def get_static_option(static_option_id: int):
@@ -495,6 +734,7 @@ async def create_static_option(
         created_static_impacts = await create_static_impacts_for_static_option(
             transaction, created_static_option.id, static_option
         )
+        await _bump_scoring_version(transaction, {"id": survey_id})
 
         created_static_option_dict = created_static_option.dict()
         created_static_option_dict["staticFactorImpacts"] = created_static_impacts
@@ -520,6 +760,13 @@ async def create_static_impacts_for_static_option(
     return created_static_impacts
 
 
+async def list_static_options_for_surveys(survey_ids: List[int]):
+    return await prisma.staticoption.find_many(
+        where={"surveyId": {"in": survey_ids}},
+        include={"staticFactorImpacts": True},
+    )
+
+
 async def list_static_options(survey_id: int):
     static_option_list = await prisma.staticoption.find_many(
         where={"surveyId": survey_id},
@@ -542,6 +789,9 @@ async def update_static_option(
         await update_static_impacts_for_static_option(
             transaction, updated_static_option.id, static_option
         )
+        await _bump_scoring_version(
+            transaction, {"id": updated_static_option.surveyId}
+        )
 
     return await prisma.staticoption.find_unique(
         where={"id": static_option_id},
@@ -580,10 +830,18 @@ async def update_static_impacts_for_static_option(
 
 
 async def delete_static_option(static_option_id: int):
-    await prisma.staticfactorimpact.delete_many(
-        where={"staticOptionId": static_option_id}
-    )
-    return await prisma.staticoption.delete(where={"id": static_option_id})
+    async with prisma.tx() as transaction:
+        await transaction.staticfactorimpact.delete_many(
+            where={"staticOptionId": static_option_id}
+        )
+        deleted_static_option = await transaction.staticoption.delete(
+            where={"id": static_option_id}
+        )
+        if deleted_static_option is not None:
+            await _bump_scoring_version(
+                transaction, {"id": deleted_static_option.surveyId}
+            )
+    return deleted_static_option
 
 
 async def get_static_factor_impact(static_factor_impact_id: int):
@@ -594,7 +852,15 @@ async def get_static_factor_impact(static_factor_impact_id: int):
 
 
 async def delete_static_factor_impact(static_impact_id: int):
-    return await prisma.factorimpact.delete(where={"id": static_impact_id})
+    async with prisma.tx() as transaction:
+        deleted_static_impact = await transaction.staticfactorimpact.delete(
+            where={"id": static_impact_id}, include={"staticOption": True}
+        )
+        if deleted_static_impact is not None:
+            await _bump_scoring_version(
+                transaction, {"id": deleted_static_impact.staticOption.surveyId}
+            )
+    return deleted_static_impact
 
 
 """
@@ -619,7 +885,7 @@ async def update_response(response_id: int, response: ResponseUpdate):
 async def get_response_by_session_and_user(session_id: int, user_id: int):
     response = await prisma.response.find_first(
         where={"examSessionId": session_id, "userId": user_id},
-        include={"answers": True, "factorValues": True},
+        include={"answers": True, "factorValues": True, "parameterValues": True},
     )
 
     if not response:
@@ -635,6 +901,23 @@ async def get_response_by_session_and_user(session_id: int, user_id: int):
     return response_dict
 
 
+async def get_plain_response_by_session_and_user(session_id: int, user_id: int):
+    return await prisma.response.find_first(
+        where={"examSessionId": session_id, "userId": user_id}
+    )
+
+
+async def list_plain_responses_by_session_and_users(session_user_ids: List[tuple]):
+    return await prisma.response.find_many(
+        where={
+            "OR": [
+                {"examSessionId": session_id, "userId": user_id}
+                for session_id, user_id in session_user_ids
+            ]
+        }
+    )
+
+
 async def list_user_responses(user_id: int):
     return await prisma.response.find_many(where={"userId": user_id})
 
@@ -642,7 +925,332 @@ async def list_user_responses(user_id: int):
 async def list_responses_for_exam_session(session_id: int):
     return await prisma.response.find_many(
         where={"examSessionId": session_id},
-        include={"answers": True, "factorValues": True},
+        include={"answers": True, "factorValues": True, "parameterValues": True},
+    )
+
+
+async def list_responses_by_ids(response_ids: List[int]):
+    return await prisma.response.find_many(where={"id": {"in": response_ids}})
+
+
+async def list_factor_values_for_responses(
+    response_ids: List[int], factor_ids: List[int]
+):
+    return await prisma.factorvalue.find_many(
+        where={"responseId": {"in": response_ids}, "factorId": {"in": factor_ids}}
+    )
+
+
+async def list_factor_values_for_exam_session_page(
+    session_id: int, after_id: int, take: int
+):
+    return await prisma.factorvalue.find_many(
+        where={
+            "response": {"is": {"examSessionId": session_id}},
+            "id": {"gt": after_id},
+        },
+        order={"id": "asc"},
+        take=take,
+    )
+
+
+SCORE_ANSWERS_SQL = """
+UPDATE "Answer" AS a
+SET "score" = CASE
+    WHEN q."correctOption" = (SELECT o."order" FROM "Option" AS o WHERE o."id" = a."optionId")
+    THEN q."point"
+    ELSE 0
+END
+FROM "Response" AS r, "Question" AS q, "ExamSession" AS s, "ExamSurvey" AS es
+WHERE r."id" = a."responseId"
+  AND r."examSessionId" = $1
+  AND q."id" = a."questionId"
+  AND q."questionType" = 'MULTIPLE_CHOICE'
+  AND s."id" = r."examSessionId"
+  AND es."examId" = s."examId"
+  AND es."surveyId" = q."surveyId"
+"""
+
+SUM_TOTAL_SCORES_SQL = """
+UPDATE "Response" AS r
+SET "totalScore" = COALESCE(
+    (SELECT SUM(a."score") FROM "Answer" AS a WHERE a."responseId" = r."id"), 0
+)
+WHERE r."examSessionId" = $1
+"""
+
+FACTOR_VALUE_TARGETS_SQL = """
+WITH exam_surveys AS (
+    SELECT es."surveyId"
+    FROM "ExamSurvey" AS es
+    JOIN "ExamSession" AS s ON s."examId" = es."examId"
+    WHERE s."id" = $1
+),
+session_answers AS (
+    SELECT a."responseId", a."optionId", a."staticOptionId", q."surveyId", q."questionType"
+    FROM "Answer" AS a
+    JOIN "Response" AS r ON r."id" = a."responseId"
+    JOIN "Question" AS q ON q."id" = a."questionId"
+    WHERE r."examSessionId" = $1
+      AND q."surveyId" IN (SELECT "surveyId" FROM exam_surveys)
+),
+impacts AS (
+    SELECT sa."responseId", fi."factorId", fi."impact", fi."plus"
+    FROM session_answers AS sa
+    JOIN "FactorImpact" AS fi ON fi."optionId" = sa."optionId"
+    WHERE sa."questionType" = 'PSYCHOLOGY'
+    UNION ALL
+    SELECT sa."responseId", sfi."factorId", sfi."impact", sfi."plus"
+    FROM session_answers AS sa
+    JOIN "StaticOption" AS so
+        ON so."id" = sa."staticOptionId" AND so."surveyId" = sa."surveyId"
+    JOIN "StaticFactorImpact" AS sfi ON sfi."staticOptionId" = so."id"
+    WHERE sa."questionType" = 'PSYCHOLOGY'
+),
+sums AS (
+    SELECT "responseId", "factorId",
+        SUM(CASE WHEN "plus" THEN "impact" ELSE -"impact" END) AS "value"
+    FROM impacts
+    GROUP BY "responseId", "factorId"
+),
+targets AS (
+    SELECT t."responseId", f."id" AS "factorId"
+    FROM (SELECT DISTINCT "responseId", "surveyId" FROM session_answers) AS t
+    JOIN "Factor" AS f ON f."surveyId" = t."surveyId"
+    UNION
+    SELECT "responseId", "factorId" FROM sums
+)
+"""
+
+UPSERT_FACTOR_VALUES_SQL = (
+    FACTOR_VALUE_TARGETS_SQL
+    + """
+INSERT INTO "FactorValue" ("factorId", "responseId", "value")
+SELECT tg."factorId", tg."responseId", COALESCE(sm."value", 0)::integer
+FROM targets AS tg
+LEFT JOIN sums AS sm
+    ON sm."responseId" = tg."responseId" AND sm."factorId" = tg."factorId"
+ON CONFLICT ("factorId", "responseId") DO UPDATE SET "value" = EXCLUDED."value"
+"""
+)
+
+DELETE_STALE_FACTOR_VALUES_SQL = (
+    FACTOR_VALUE_TARGETS_SQL
+    + """
+DELETE FROM "FactorValue" AS fv
+USING "Response" AS r
+WHERE fv."responseId" = r."id"
+  AND r."examSessionId" = $1
+  AND NOT EXISTS (
+      SELECT 1 FROM targets AS tg
+      WHERE tg."responseId" = fv."responseId" AND tg."factorId" = fv."factorId"
+  )
+"""
+)
+
+
+PARAMETER_VALUE_SUMS_SQL = """
+WITH sums AS (
+    SELECT fv."responseId", f."parameterId", SUM(fv."value")::integer AS "value"
+    FROM "FactorValue" AS fv
+    JOIN "Factor" AS f ON f."id" = fv."factorId"
+    JOIN "Response" AS r ON r."id" = fv."responseId"
+    WHERE r."examSessionId" = $1
+      AND f."parameterId" IS NOT NULL
+    GROUP BY fv."responseId", f."parameterId"
+)
+"""
+
+UPSERT_PARAMETER_VALUES_SQL = (
+    PARAMETER_VALUE_SUMS_SQL
+    + """
+INSERT INTO "ParameterValue" ("parameterId", "responseId", "value")
+SELECT "parameterId", "responseId", "value" FROM sums
+ON CONFLICT ("responseId", "parameterId") DO UPDATE SET "value" = EXCLUDED."value"
+"""
+)
+
+DELETE_STALE_PARAMETER_VALUES_SQL = (
+    PARAMETER_VALUE_SUMS_SQL
+    + """
+DELETE FROM "ParameterValue" AS pv
+USING "Response" AS r
+WHERE pv."responseId" = r."id"
+  AND r."examSessionId" = $1
+  AND NOT EXISTS (
+      SELECT 1 FROM sums AS sm
+      WHERE sm."responseId" = pv."responseId" AND sm."parameterId" = pv."parameterId"
+  )
+"""
+)
+
+
+async def score_exam_session_in_db(session_id: int):
+    async with prisma.tx(timeout=BULK_TX_TIMEOUT) as transaction:
+        await transaction.execute_raw(SCORE_ANSWERS_SQL, session_id)
+        await transaction.execute_raw(SUM_TOTAL_SCORES_SQL, session_id)
+        await transaction.execute_raw(UPSERT_FACTOR_VALUES_SQL, session_id)
+        await transaction.execute_raw(DELETE_STALE_FACTOR_VALUES_SQL, session_id)
+        await transaction.execute_raw(UPSERT_PARAMETER_VALUES_SQL, session_id)
+        await transaction.execute_raw(DELETE_STALE_PARAMETER_VALUES_SQL, session_id)
+
+
+SESSION_TYPED_ANSWERS_PAGE_SQL = """
+SELECT a."id", a."responseId", a."questionId", a."optionId", a."staticOptionId"
+FROM "Answer" AS a
+JOIN "Response" AS r ON r."id" = a."responseId"
+JOIN "Question" AS q ON q."id" = a."questionId"
+JOIN "ExamSession" AS s ON s."id" = r."examSessionId"
+JOIN "ExamSurvey" AS es ON es."examId" = s."examId" AND es."surveyId" = q."surveyId"
+WHERE r."examSessionId" = $1
+  AND q."questionType" = $2::"QuestionType"
+  AND a."id" > $3
+ORDER BY a."id"
+LIMIT $4
+"""
+
+
+async def list_typed_answers_for_exam_session_page(
+    session_id: int, question_type: QuestionType, after_id: int, take: int
+) -> List[dict]:
+    return await prisma.query_raw(
+        SESSION_TYPED_ANSWERS_PAGE_SQL, session_id, question_type.value, after_id, take
+    )
+
+
+async def count_responses_for_exam_session(session_id: int):
+    return await prisma.response.count(where={"examSessionId": session_id})
+
+
+async def list_responses_for_exam_session_page(
+    session_id: int, after_id: int, take: int
+):
+    return await prisma.response.find_many(
+        where={"examSessionId": session_id, "id": {"gt": after_id}},
+        include={"answers": True},
+        order={"id": "asc"},
+        take=take,
+    )
+
+
+LEADERBOARD_SESSION_SCOPE = 'r."examSessionId" = $1'
+LEADERBOARD_EXAM_SCOPE = (
+    'r."examSessionId" IN (SELECT "id" FROM "ExamSession" WHERE "examId" = $1)'
+)
+
+# Keyset page ranked without a window over the whole scope: a row's rank
+# is one plus the rows scoring higher, taken from index range counts for
+# the rows before the page and from window functions over the page itself.
+# The values match RANK() and PERCENT_RANK() over the whole scope.
+LEADERBOARD_PAGE_SQL = """
+WITH page AS (
+    SELECT r."id" AS "responseId", r."userId", r."examSessionId", r."totalScore"
+    FROM "Response" AS r
+    WHERE {scope}
+      AND r."totalScore" IS NOT NULL
+      AND (
+          $2::double precision IS NULL
+          OR (r."totalScore", r."id") < ($2::double precision, $3::integer)
+      )
+    ORDER BY r."totalScore" DESC, r."id" DESC
+    LIMIT $4
+),
+bounds AS (
+    SELECT MAX("totalScore") AS "first", MIN("totalScore") AS "last",
+        COUNT(*) AS "size"
+    FROM page
+),
+counts AS MATERIALIZED (
+    SELECT
+        (
+            SELECT COUNT(*) FROM "Response" AS r
+            WHERE {scope} AND r."totalScore" IS NOT NULL
+        ) AS "total",
+        (
+            SELECT COUNT(*) FROM "Response" AS r
+            WHERE {scope}
+              AND (r."totalScore", r."id") >= ($2::double precision, $3::integer)
+        ) AS "before",
+        (
+            SELECT COUNT(*) FROM "Response" AS r
+            WHERE {scope} AND r."totalScore" > b."first"
+        ) AS "above",
+        (
+            SELECT COUNT(*) FROM "Response" AS r
+            WHERE {scope} AND r."totalScore" < b."last"
+        ) AS "below"
+    FROM bounds AS b
+)
+SELECT p.*,
+    CASE WHEN p."totalScore" < b."first" THEN c."before" ELSE c."above" END
+        + RANK() OVER (ORDER BY p."totalScore" DESC) AS "rank",
+    COALESCE(
+        (
+            CASE
+                WHEN p."totalScore" > b."last"
+                THEN c."total" - c."before" - b."size"
+                ELSE c."below"
+            END
+            + RANK() OVER (ORDER BY p."totalScore") - 1
+        )::double precision
+        / NULLIF(c."total" - 1, 0),
+        0
+    ) AS "percentRank"
+FROM page AS p, bounds AS b, counts AS c
+ORDER BY p."totalScore" DESC, p."responseId" DESC
+"""
+
+# Rank and percent rank of single responses from index range counts, the
+# same values RANK() and PERCENT_RANK() give over the whole scope.
+LEADERBOARD_USER_SQL = """
+WITH user_responses AS (
+    SELECT r."id" AS "responseId", r."userId", r."examSessionId", r."totalScore"
+    FROM "Response" AS r
+    WHERE {scope}
+      AND r."userId" = $2
+      AND r."totalScore" IS NOT NULL
+)
+SELECT u.*,
+    (
+        SELECT COUNT(*) FROM "Response" AS r
+        WHERE {scope} AND r."totalScore" > u."totalScore"
+    ) + 1 AS "rank",
+    COALESCE(
+        (
+            SELECT COUNT(*) FROM "Response" AS r
+            WHERE {scope} AND r."totalScore" < u."totalScore"
+        )::double precision
+        / NULLIF(
+            (
+                SELECT COUNT(*) FROM "Response" AS r
+                WHERE {scope} AND r."totalScore" IS NOT NULL
+            ) - 1,
+            0
+        ),
+        0
+    ) AS "percentRank"
+FROM user_responses AS u
+ORDER BY u."examSessionId"
+"""
+
+
+async def list_leaderboard_page(
+    scope: str,
+    scope_id: int,
+    after_score: Optional[float],
+    after_id: Optional[int],
+    take: int,
+) -> List[dict]:
+    return await prisma.query_raw(
+        LEADERBOARD_PAGE_SQL.format(scope=scope), scope_id, after_score, after_id, take
+    )
+
+
+async def list_leaderboard_user_entries(
+    scope: str, scope_id: int, user_id: int
+) -> List[dict]:
+    return await prisma.query_raw(
+        LEADERBOARD_USER_SQL.format(scope=scope), scope_id, user_id
     )
 
 
@@ -653,20 +1261,322 @@ async def save_total_score(response_id: int, total_score: float):
     )
 
 
+async def save_scores_bulk(
+    answer_scores: Dict[int, Optional[float]],
+    total_scores: Dict[int, float],
+    factor_values: Dict[int, Dict[int, int]],
+    factor_ids: Optional[List[int]] = None,
+    parameter_values: Optional[Dict[int, Dict[int, int]]] = None,
+    parameter_ids: Optional[List[int]] = None,
+):
+    parameter_values = parameter_values or {}
+
+    async with prisma.tx(timeout=BULK_TX_TIMEOUT) as transaction:
+        for score, answer_ids in _group_ids_by_value(answer_scores):
+            for chunk in _chunks(answer_ids):
+                await transaction.answer.update_many(
+                    where={"id": {"in": chunk}},
+                    data={"score": score},
+                )
+
+        for total_score, response_ids in _group_ids_by_value(total_scores):
+            for chunk in _chunks(response_ids):
+                await transaction.response.update_many(
+                    where={"id": {"in": chunk}},
+                    data={"totalScore": total_score},
+                )
+
+        for chunk in _chunks(list(factor_values)):
+            where = {"responseId": {"in": chunk}}
+            if factor_ids is not None:
+                where["factorId"] = {"in": factor_ids}
+            await transaction.factorvalue.delete_many(where=where)
+
+        factor_value_data = [
+            {"factorId": factor_id, "responseId": response_id, "value": value}
+            for response_id, values in factor_values.items()
+            for factor_id, value in values.items()
+        ]
+        for chunk in _chunks(factor_value_data):
+            await transaction.factorvalue.create_many(data=chunk)
+
+        for chunk in _chunks(list(parameter_values)):
+            where = {"responseId": {"in": chunk}}
+            if parameter_ids is not None:
+                where["parameterId"] = {"in": parameter_ids}
+            await transaction.parametervalue.delete_many(where=where)
+
+        parameter_value_data = [
+            {"parameterId": parameter_id, "responseId": response_id, "value": value}
+            for response_id, values in parameter_values.items()
+            for parameter_id, value in values.items()
+        ]
+        for chunk in _chunks(parameter_value_data):
+            await transaction.parametervalue.create_many(data=chunk)
+
+
 """
 Answer
 """
 
 
-async def create_answer(response_id: int, answer_data: dict):
-    answer_data["responseId"] = response_id
-    return await prisma.answer.create(data=answer_data)
+# Inserts the answer or, when the response already answered the question,
+# returns the stored row instead; "inserted" tells the two apart.
+UPSERT_ANSWER_SQL = """
+INSERT INTO "Answer" (
+    "responseId", "questionId", "optionId", "staticOptionId", "answerText",
+    "score", "idempotencyKey"
+)
+VALUES ($1, $2, $3, $4, $5, $6, $7)
+ON CONFLICT ("responseId", "questionId")
+DO UPDATE SET "responseId" = EXCLUDED."responseId"
+RETURNING "id", "creationDate", "score", "responseId", "questionId", "optionId",
+    "staticOptionId", "answerText", "idempotencyKey", (xmax = 0) AS "inserted"
+"""
+
+
+async def _upsert_answer(client, response_id: int, answer_data: dict):
+    rows = await client.query_raw(
+        UPSERT_ANSWER_SQL,
+        response_id,
+        answer_data["questionId"],
+        answer_data.get("optionId"),
+        answer_data.get("staticOptionId"),
+        answer_data.get("answerText"),
+        answer_data.get("score"),
+        answer_data.get("idempotencyKey"),
+    )
+    answer = rows[0]
+    return answer, answer.pop("inserted")
+
+
+async def upsert_answer(response_id: int, answer_data: dict):
+    return await _upsert_answer(prisma, response_id, answer_data)
+
+
+async def _increment_response_values(
+    transaction,
+    response_id: int,
+    factor_ids: List[int],
+    factor_deltas: Dict[int, int],
+    parameter_ids: Optional[List[int]] = None,
+    parameter_deltas: Optional[Dict[int, int]] = None,
+):
+    if factor_ids:
+        existing_factor_values = await transaction.factorvalue.find_many(
+            where={"responseId": response_id, "factorId": {"in": factor_ids}}
+        )
+        existing_factor_ids = {
+            factor_value.factorId for factor_value in existing_factor_values
+        }
+        missing_factor_values = [
+            {"factorId": factor_id, "responseId": response_id, "value": 0}
+            for factor_id in factor_ids
+            if factor_id not in existing_factor_ids
+        ]
+        if missing_factor_values:
+            await transaction.factorvalue.create_many(
+                data=missing_factor_values, skip_duplicates=True
+            )
+
+    for factor_id, delta in factor_deltas.items():
+        if delta:
+            await transaction.factorvalue.update_many(
+                where={"factorId": factor_id, "responseId": response_id},
+                data={"value": {"increment": delta}},
+            )
+
+    if parameter_ids:
+        await transaction.parametervalue.create_many(
+            data=[
+                {"parameterId": parameter_id, "responseId": response_id, "value": 0}
+                for parameter_id in parameter_ids
+            ],
+            skip_duplicates=True,
+        )
+
+    for parameter_id, delta in (parameter_deltas or {}).items():
+        if delta:
+            await transaction.parametervalue.update_many(
+                where={"parameterId": parameter_id, "responseId": response_id},
+                data={"value": {"increment": delta}},
+            )
+
+
+async def upsert_scored_answer(
+    response_id: int,
+    answer_data: dict,
+    factor_ids: List[int],
+    factor_deltas: Dict[int, int],
+    parameter_ids: Optional[List[int]] = None,
+    parameter_deltas: Optional[Dict[int, int]] = None,
+):
+    async with prisma.tx() as transaction:
+        answer, inserted = await _upsert_answer(transaction, response_id, answer_data)
+        if inserted:
+            await _increment_response_values(
+                transaction,
+                response_id,
+                factor_ids,
+                factor_deltas,
+                parameter_ids,
+                parameter_deltas,
+            )
+
+    return answer, inserted
+
+
+async def create_answers_bulk(
+    response_id: int,
+    answers_data: List[dict],
+    factor_ids: Optional[List[int]] = None,
+    factor_deltas: Optional[Dict[int, int]] = None,
+    parameter_ids: Optional[List[int]] = None,
+    parameter_deltas: Optional[Dict[int, int]] = None,
+):
+    for answer_data in answers_data:
+        answer_data["responseId"] = response_id
+
+    async with prisma.tx() as transaction:
+        await transaction.answer.create_many(data=answers_data)
+        await _increment_response_values(
+            transaction,
+            response_id,
+            factor_ids or [],
+            factor_deltas or {},
+            parameter_ids,
+            parameter_deltas,
+        )
+        created_answers = await transaction.answer.find_many(
+            where={
+                "responseId": response_id,
+                "questionId": {
+                    "in": [answer_data["questionId"] for answer_data in answers_data]
+                },
+            },
+            order={"id": "asc"},
+        )
+
+    return created_answers
+
+
+async def sum_answer_scores_for_exam_session(session_id: int):
+    groups = await prisma.answer.group_by(
+        by=["responseId"],
+        where={"response": {"is": {"examSessionId": session_id}}},
+        sum={"score": True},
+    )
+    return {group["responseId"]: group["_sum"]["score"] or 0 for group in groups}
+
+
+async def list_session_answers_for_questions(session_id: int, question_ids: List[int]):
+    return await prisma.answer.find_many(
+        where={
+            "questionId": {"in": question_ids},
+            "response": {"is": {"examSessionId": session_id}},
+        }
+    )
+
+
+async def list_answers_for_responses_and_questions(
+    response_ids: List[int], question_ids: List[int]
+):
+    return await prisma.answer.find_many(
+        where={"responseId": {"in": response_ids}, "questionId": {"in": question_ids}}
+    )
+
+
+async def list_answers_for_responses(response_ids: List[int]):
+    return await prisma.answer.find_many(where={"responseId": {"in": response_ids}})
 
 
 async def list_answers_for_response(response_id: int):
     return await prisma.answer.find_many(where={"responseId": response_id})
 
 
+ALLOCATE_ANSWER_IDS_SQL = """
+SELECT nextval(pg_get_serial_sequence('"Answer"', 'id')) AS "id"
+FROM generate_series(1, $1)
+"""
+
+
+async def allocate_answer_ids(count: int) -> List[int]:
+    rows = await prisma.query_raw(ALLOCATE_ANSWER_IDS_SQL, count)
+    return [row["id"] for row in rows]
+
+
+async def insert_buffered_answers(records: List[dict]):
+    # Records carry their preallocated ids, so replaying an already stored
+    # record is a no-op.
+    data = [
+        {**record, "creationDate": datetime.fromisoformat(record["creationDate"])}
+        for record in records
+    ]
+    async with prisma.tx() as transaction:
+        await transaction.answer.create_many(data=data, skip_duplicates=True)
+        # Records skipped for a conflicting (responseId, questionId) are the
+        # ones whose id is not stored.
+        stored_answers = await transaction.answer.find_many(
+            where={"id": {"in": [record["id"] for record in records]}}
+        )
+    return {answer.id for answer in stored_answers}
+
+
+# Largest add_answers batch. The reference check binds three parameters
+# per answer and Postgres takes at most 32767 per statement.
+ANSWER_BATCH_MAX_SIZE = 1000
+
+
+async def count_valid_answer_references(exam_id: int, answers: List[dict]) -> int:
+    # Counts the answers whose question belongs to the exam and whose option
+    # or static option, when given, belongs to that question or its survey.
+    values = ", ".join(
+        f"(${i * 3 + 2}::int, ${i * 3 + 3}::int, ${i * 3 + 4}::int)"
+        for i in range(len(answers))
+    )
+    result = await prisma.query_raw(
+        f"""
+        SELECT count(*)::int AS "valid"
+        FROM (VALUES {values}) AS a ("questionId", "optionId", "staticOptionId")
+        JOIN "Question" q ON q."id" = a."questionId"
+        WHERE EXISTS (
+            SELECT 1 FROM "ExamSurvey" es
+            WHERE es."examId" = $1 AND es."surveyId" = q."surveyId"
+        )
+        AND (
+            a."optionId" IS NULL OR EXISTS (
+                SELECT 1 FROM "Option" o
+                WHERE o."id" = a."optionId" AND o."questionId" = q."id"
+            )
+        )
+        AND (
+            a."staticOptionId" IS NULL OR EXISTS (
+                SELECT 1 FROM "StaticOption" so
+                WHERE so."id" = a."staticOptionId" AND so."surveyId" = q."surveyId"
+            )
+        )
+        """,
+        exam_id,
+        *[
+            value
+            for answer in answers
+            for value in (
+                answer["questionId"],
+                answer.get("optionId"),
+                answer.get("staticOptionId"),
+            )
+        ],
+    )
+    return result[0]["valid"]
+
+
+async def list_answered_question_ids(response_id: int, question_ids: List[int]):
+    answers = await prisma.answer.find_many(
+        where={"responseId": response_id, "questionId": {"in": question_ids}}
+    )
+    return {answer.questionId for answer in answers}
+
+
 async def get_answer(response_id: int, question_id: int):
     return await prisma.answer.find_first(
         where={"responseId": response_id, "questionId": question_id}
@@ -729,6 +1639,19 @@ async def get_exam_by_id(exam_id: int):
     )
 
 
+async def list_exams_by_ids(exam_ids: List[int]):
+    return await prisma.exam.find_many(
+        where={"id": {"in": exam_ids}},
+        include={
+            "examSurveys": {
+                "include": {
+                    "survey": True,
+                }
+            }
+        },
+    )
+
+
 async def get_exam_with_surveys(exam_id: int):
     return await prisma.exam.find_unique(
         where={"id": exam_id},
@@ -808,9 +1731,9 @@ async def create_exam_survey(
     )
 
 
-async def get_exam_survey_by_id(exam_survey_id: int):
-    return await prisma.examsurvey.find_unique(
-        where={"id": exam_survey_id},
+async def get_exam_survey_by_id(exam_survey_id: int, exam_id: int):
+    return await prisma.examsurvey.find_first(
+        where={"id": exam_survey_id, "examId": exam_id},
         include={"survey": True},
     )
 
@@ -855,6 +1778,23 @@ async def create_exam_session(exam_session: ExamSessionCreate, exam_id: int):
     return await prisma.examsession.create(data=exam_session_data)
 
 
+async def list_exam_sessions_by_ids(exam_session_ids: List[int]):
+    return await prisma.examsession.find_many(
+        where={"id": {"in": exam_session_ids}},
+        include={
+            "exam": {
+                "include": {
+                    "examSurveys": {
+                        "include": {
+                            "survey": True,
+                        }
+                    }
+                }
+            }
+        },
+    )
+
+
 async def get_exam_session_by_id(exam_session_id: int):
     return await prisma.examsession.find_unique(
         where={"id": exam_session_id},
@@ -930,3 +1870,138 @@ async def list_public_exam_sessions():
         },
     )
     return exam_sessions
+
+
+async def bump_session_scores_version(session_id: int):
+    # Marks a finished scoring pass; caches of scoring results key on it.
+    await prisma.examsession.update(
+        where={"id": session_id}, data={"scoresVersion": {"increment": 1}}
+    )
+
+
+async def get_session_scores_version(session_id: int) -> int:
+    rows = await prisma.query_raw(
+        'SELECT "scoresVersion" FROM "ExamSession" WHERE "id" = $1', session_id
+    )
+    return rows[0]["scoresVersion"] if rows else 0
+
+
+"""
+ScoringJob
+"""
+
+
+async def create_scoring_job(session_id: int, mode: str):
+    return await prisma.scoringjob.create(
+        data={"examSessionId": session_id, "mode": mode}
+    )
+
+
+async def get_scoring_job(job_id: int):
+    return await prisma.scoringjob.find_unique(where={"id": job_id})
+
+
+async def get_active_scoring_job(session_id: int):
+    return await prisma.scoringjob.find_first(
+        where={
+            "examSessionId": session_id,
+            "status": {"in": [JobStatus.QUEUED.value, JobStatus.RUNNING.value]},
+        },
+        order={"id": "desc"},
+    )
+
+
+async def list_active_scoring_jobs():
+    return await prisma.scoringjob.find_many(
+        where={"status": {"in": [JobStatus.QUEUED.value, JobStatus.RUNNING.value]}},
+        order={"id": "asc"},
+    )
+
+
+async def claim_scoring_job(job_id: int, now: datetime, lease_expires_at: datetime):
+    claimed = await prisma.scoringjob.update_many(
+        where={
+            "id": job_id,
+            "OR": [
+                {"status": JobStatus.QUEUED.value},
+                {"status": JobStatus.RUNNING.value, "leaseExpiresAt": None},
+                {"status": JobStatus.RUNNING.value, "leaseExpiresAt": {"lt": now}},
+            ],
+        },
+        data={"status": JobStatus.RUNNING.value, "leaseExpiresAt": lease_expires_at},
+    )
+    return claimed > 0
+
+
+async def renew_scoring_job_lease(job_id: int, lease_expires_at: datetime):
+    # Only a running job is renewed, so a late heartbeat cannot lease a job
+    # that has already finished.
+    renewed = await prisma.scoringjob.update_many(
+        where={"id": job_id, "status": JobStatus.RUNNING.value},
+        data={"leaseExpiresAt": lease_expires_at},
+    )
+    return renewed > 0
+
+
+async def update_scoring_job(job_id: int, data: dict):
+    return await prisma.scoringjob.update(where={"id": job_id}, data=data)
+
+
+"""
+FactorNorm
+"""
+
+
+async def list_factor_norms(session_id: int):
+    return await prisma.factornorm.find_many(where={"examSessionId": session_id})
+
+
+async def replace_factor_norms(session_id: int, norms_data: List[dict]):
+    async with prisma.tx() as transaction:
+        await transaction.factornorm.delete_many(where={"examSessionId": session_id})
+        if norms_data:
+            await transaction.factornorm.create_many(
+                data=[
+                    {**norm_data, "examSessionId": session_id}
+                    for norm_data in norms_data
+                ]
+            )
+
+
+"""
+OptionCount
+"""
+
+
+OPTION_COUNT_BATCH_SIZE = 1000
+
+
+async def add_option_counts(deltas: Dict[tuple, int]):
+    # One upsert per batch of (examSessionId, questionId, optionId) deltas.
+    # Deltas for options or sessions deleted since the answer are dropped by
+    # the joins instead of failing the whole batch.
+    rows = [(*counter_key, delta) for counter_key, delta in deltas.items() if delta]
+    for chunk in _chunks(rows, OPTION_COUNT_BATCH_SIZE):
+        values = ", ".join(
+            f"(${i * 4 + 1}::int, ${i * 4 + 2}::int, ${i * 4 + 3}::int, ${i * 4 + 4}::int)"
+            for i in range(len(chunk))
+        )
+        await prisma.execute_raw(
+            f"""
+            INSERT INTO "OptionCount" ("examSessionId", "questionId", "optionId", "count")
+            SELECT v."examSessionId", o."questionId", v."optionId", v."count"
+            FROM (VALUES {values}) AS v ("examSessionId", "questionId", "optionId", "count")
+            JOIN "Option" o ON o."id" = v."optionId"
+            JOIN "ExamSession" s ON s."id" = v."examSessionId"
+            ON CONFLICT ("examSessionId", "optionId")
+            DO UPDATE SET "count" = "OptionCount"."count" + EXCLUDED."count"
+            """,
+            *[value for row in chunk for value in row],
+        )
+
+
+async def list_option_counts(session_id: int):
+    return await prisma.optioncount.find_many(
+        where={"examSessionId": session_id},
+        order=[{"questionId": "asc"}, {"optionId": "asc"}],
+    )
@@ -1,17 +1,27 @@
 from fastapi import Depends, HTTPException, status
+from typing import Optional
 from app.schemas import Role
-from app import auth, crud
+from app import auth, crud, principals, revocation
+from app.loaders import RequestLoaders
+
+
+async def get_loaders():
+    # FastAPI caches dependencies per request, so every dependency of a
+    # request shares these loaders.
+    return RequestLoaders()
 
 
 async def get_current_user(token: str = Depends(auth.oauth2_scheme)):
     payload = auth.decode_access_token(token)
-    if payload is None:
+    if payload is None or await revocation.revocation_list.is_revoked(
+        auth.get_token_id(token, payload)
+    ):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    user = await crud.get_user_by_email(email=payload["sub"])
+    user = await principals.get_principal(payload["sub"])
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -39,123 +49,133 @@ async def get_current_super_admin_user(current_user: dict = Depends(get_current_
     return current_user
 
 
-async def verify_survey(
+async def verify_own_survey(
     survey_id: int,
+    current_user: dict = Depends(get_current_admin_user),
 ):
-    survey = await crud.get_survey_by_id(survey_id)
+    survey = await crud.get_owned_survey(survey_id, current_user.id)
     if not survey:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Survey not found",
-        )
+        raise await survey_access_error(survey_id, current_user)
     return survey
 
 
 async def verify_author(
-    survey: dict = Depends(verify_survey),
+    survey: dict = Depends(verify_own_survey),
     current_user: dict = Depends(get_current_admin_user),
 ):
+    return current_user
+
+
+async def survey_access_error(survey_id: int, current_user, load=None, detail=None):
+    # Ownership is checked inside the fetch query; only a failed fetch pays
+    # for the lookups that tell the caller which check failed.
+    survey = await crud.get_survey_by_id(survey_id)
+    if not survey:
+        return HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Survey not found",
+        )
     if survey.authorId != current_user.id:
-        raise HTTPException(
+        return HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied",
         )
-    return current_user
+    if load is not None and not await load():
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+    return HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
 
 
 async def verify_question(
     question_id: int,
-    survey: dict = Depends(verify_survey),
-    current_user: dict = Depends(verify_author),
+    survey_id: int,
+    current_user: dict = Depends(get_current_admin_user),
 ):
-    question = await crud.get_question_by_id(question_id)
+    question = await crud.get_owned_question(question_id, survey_id, current_user.id)
     if not question:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Question not found"
-        )
-    if question.surveyId != survey.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN, detail="Access denied"
+        raise await survey_access_error(
+            survey_id,
+            current_user,
+            lambda: crud.get_question_by_id(question_id),
+            "Question not found",
         )
     return question
 
 
 async def verify_option(
     option_id: int,
-    survey: dict = Depends(verify_survey),
-    current_user: dict = Depends(verify_author),
+    survey_id: int,
+    current_user: dict = Depends(get_current_admin_user),
 ):
-    option = await crud.get_option(option_id)
+    option = await crud.get_owned_option(option_id, survey_id, current_user.id)
     if not option:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Option not found"
-        )
-    question = await crud.get_question_by_id(option.questionId)
-    if question.surveyId != survey.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN, detail="Access denied"
+        raise await survey_access_error(
+            survey_id,
+            current_user,
+            lambda: crud.get_option(option_id),
+            "Option not found",
         )
     return option
 
 
 async def verify_impact(
     factor_impact_id: int,
-    survey: dict = Depends(verify_survey),
-    current_user: dict = Depends(verify_author),
+    survey_id: int,
+    current_user: dict = Depends(get_current_admin_user),
 ):
-    impact = await crud.get_factor_impact(factor_impact_id)
+    impact = await crud.get_owned_factor_impact(
+        factor_impact_id, survey_id, current_user.id
+    )
     if not impact:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="FactorImpact not found"
-        )
-    option = await crud.get_option(impact.optionId)
-    question = await crud.get_question_by_id(option.questionId)
-    if question.surveyId != survey.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN, detail="Access denied"
+        raise await survey_access_error(
+            survey_id,
+            current_user,
+            lambda: crud.get_factor_impact(factor_impact_id),
+            "FactorImpact not found",
         )
     return impact
 
 
 async def verify_static_option(
     static_option_id: int,
-    survey: dict = Depends(verify_survey),
-    current_user: dict = Depends(verify_author),
+    survey_id: int,
+    current_user: dict = Depends(get_current_admin_user),
 ):
-    static_option = await crud.get_static_option(static_option_id)
+    static_option = await crud.get_owned_static_option(
+        static_option_id, survey_id, current_user.id
+    )
     if not static_option:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="StaticOption not found"
-        )
-    if static_option.surveyId != survey.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN, detail="Access denied"
+        raise await survey_access_error(
+            survey_id,
+            current_user,
+            lambda: crud.get_static_option(static_option_id),
+            "StaticOption not found",
         )
     return static_option
 
 
 async def verify_static_impact(
     static_factor_impact_id: int,
-    survey: dict = Depends(verify_survey),
-    current_user: dict = Depends(verify_author),
+    survey_id: int,
+    current_user: dict = Depends(get_current_admin_user),
 ):
-    static_impact = await crud.get_static_factor_impact(static_factor_impact_id)
+    static_impact = await crud.get_owned_static_factor_impact(
+        static_factor_impact_id, survey_id, current_user.id
+    )
     if not static_impact:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="FactorImpact not found"
-        )
-    static_option = await crud.get_static_option(static_impact.staticOptionId)
-    if static_option.surveyId != survey.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN, detail="Access denied"
+        raise await survey_access_error(
+            survey_id,
+            current_user,
+            lambda: crud.get_static_factor_impact(static_factor_impact_id),
+            "FactorImpact not found",
         )
     return static_impact
 
 
 async def verify_exam(
     exam_id: int,
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
-    exam = await crud.get_exam_by_id(exam_id)
+    exam = await loaders.exam(exam_id)
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
     return exam
@@ -175,8 +195,9 @@ async def verify_exam_author(
 
 async def verify_exam_survey(
     exam_survey_id: int,
+    exam_id: int,
 ):
-    exam_survey = await crud.get_exam_survey_by_id(exam_survey_id)
+    exam_survey = await crud.get_exam_survey_by_id(exam_survey_id, exam_id)
     if not exam_survey:
         raise HTTPException(status_code=404, detail="ExamSurvey not found")
     return exam_survey
@@ -184,8 +205,9 @@ async def verify_exam_survey(
 
 async def verify_exam_session(
     exam_session_id: int,
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
-    exam_session = await crud.get_exam_session_by_id(exam_session_id)
+    exam_session = await loaders.exam_session(exam_session_id)
     if not exam_session:
         raise HTTPException(status_code=404, detail="ExamSession not found")
     return exam_session
@@ -194,8 +216,9 @@ async def verify_exam_session(
 async def verify_exam_author_by_session(
     exam_session: dict = Depends(verify_exam_session),
     current_user: dict = Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
-    exam = await crud.get_exam_by_id(exam_id=exam_session.examId)
+    exam = await loaders.exam(exam_session.examId)
     if exam.authorId != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -207,11 +230,9 @@ async def verify_exam_author_by_session(
 async def check_existing_response(
     current_user: dict = Depends(get_current_user),
     exam_session: dict = Depends(verify_exam_session),
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
-    existing_response = await crud.get_response_by_session_and_user(
-        session_id=exam_session.id,
-        user_id=current_user.id,
-    )
+    existing_response = await loaders.plain_response(exam_session.id, current_user.id)
     if existing_response:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -223,11 +244,23 @@ async def check_existing_response(
 async def verify_response(
     exam_session: dict = Depends(verify_exam_session),
     current_user: dict = Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
-    response = await crud.get_response_by_session_and_user(
-        exam_session.id,
-        current_user.id,
-    )
+    response = await loaders.response(exam_session.id, current_user.id)
+    if not response:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Response not found",
+        )
+    return response
+
+
+async def verify_own_response(
+    exam_session: dict = Depends(verify_exam_session),
+    current_user: dict = Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
+):
+    response = await loaders.plain_response(exam_session.id, current_user.id)
     if not response:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -240,8 +273,9 @@ async def viewable_response(
     current_user: dict = Depends(get_current_user),
     response: dict = Depends(verify_response),
     exam_session: dict = Depends(verify_exam_session),
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
-    exam = await crud.get_exam_by_id(exam_id=exam_session.examId)
+    exam = await loaders.exam(exam_session.examId)
     if exam.viewableByAuthorOnly and exam.authorId != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -254,8 +288,9 @@ async def check_user_access_to_response(
     exam_session: dict = Depends(verify_exam_session),
     current_user: dict = Depends(get_current_user),
     response: dict = Depends(verify_response),
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
-    exam = await crud.get_exam_by_id(exam_id=exam_session.examId)
+    exam = await loaders.exam(exam_session.examId)
     if response["userId"] != current_user.id and exam.authorId != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -267,15 +302,25 @@ async def check_user_access_to_response(
 async def check_user_access(
     exam_session: dict = Depends(verify_exam_session),
     current_user: dict = Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
-    exam = await crud.get_exam_by_id(exam_id=exam_session.examId)
-    response = await crud.get_response_by_session_and_user(
-        exam_session.id,
-        current_user.id,
-    )
+    exam = await loaders.exam(exam_session.examId)
+    response = await loaders.plain_response(exam_session.id, current_user.id)
     if not response and exam.authorId != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied",
         )
     return current_user
+
+
+async def check_leaderboard_cursor(
+    after_score: Optional[float] = None,
+    after_id: Optional[int] = None,
+):
+    if (after_score is None) != (after_id is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="after_score and after_id must be given together",
+        )
+    return after_score, after_id
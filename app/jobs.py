@@ -0,0 +1,126 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from app import schemas, crud, result, norms
+
+
+SCORING_JOB_LEASE = timedelta(minutes=5)
+SCORING_JOB_HEARTBEAT = SCORING_JOB_LEASE / 5
+
+# Keeps a reference to the running tasks so they are not garbage collected.
+running_tasks = set()
+
+
+def _lease():
+    now = datetime.now(timezone.utc)
+    return now, now + SCORING_JOB_LEASE
+
+
+async def _claim(job_id: int):
+    while True:
+        now, lease_expires_at = _lease()
+        if await crud.claim_scoring_job(job_id, now, lease_expires_at):
+            return True
+
+        job = await crud.get_scoring_job(job_id)
+        if job is None or job.status not in [
+            schemas.JobStatus.QUEUED,
+            schemas.JobStatus.RUNNING,
+        ]:
+            return False
+
+        # Another worker holds the lease; take over once it has expired.
+        wait = (job.leaseExpiresAt - now).total_seconds() if job.leaseExpiresAt else 0
+        await asyncio.sleep(max(wait, 1))
+
+
+async def _heartbeat(job_id: int):
+    # Keeps the lease alive for the whole job, including single long steps
+    # such as SQL mode or FINALIZE, so no other worker takes it over.
+    while True:
+        await asyncio.sleep(SCORING_JOB_HEARTBEAT.total_seconds())
+        _, lease_expires_at = _lease()
+        try:
+            await crud.renew_scoring_job_lease(job_id, lease_expires_at)
+        except Exception:
+            # Retried at the next beat, well before the lease runs out.
+            pass
+
+
+async def _score_job(job_id: int) -> dict:
+    # Runs a claimed job and returns the fields that mark it done.
+    job = await crud.get_scoring_job(job_id)
+    exam_session = await crud.get_exam_session_by_id(job.examSessionId)
+    mode = schemas.ScoringMode(job.mode)
+
+    if mode == schemas.ScoringMode.FINALIZE:
+        sheet = await result.finalize_session_scores(exam_session)
+        await result.finish_session_scoring(exam_session.id)
+        return {
+            "total": len(sheet.total_scores),
+            "processed": len(sheet.total_scores),
+        }
+
+    total = await crud.count_responses_for_exam_session(exam_session.id)
+    await crud.update_scoring_job(job_id, {"total": total})
+
+    if mode == schemas.ScoringMode.SQL:
+        await crud.score_exam_session_in_db(session_id=exam_session.id)
+        await result.finish_session_scoring(exam_session.id)
+        return {"processed": total}
+
+    context = await result.load_scoring_context(exam_session, mode)
+    processed = job.processed
+    # The norms can only be folded in memory when this run sees every chunk.
+    session_norms = norms.SessionNorms() if job.lastResponseId == 0 else None
+
+    async for last_response_id, count in result.stream_session_scores(
+        exam_session,
+        context,
+        after_id=job.lastResponseId,
+        session_norms=session_norms,
+    ):
+        processed += count
+        await crud.update_scoring_job(
+            job_id, {"processed": processed, "lastResponseId": last_response_id}
+        )
+
+    await result.finish_session_scoring(exam_session.id, session_norms)
+    return {}
+
+
+async def run_scoring_job(job_id: int):
+    if not await _claim(job_id):
+        return
+
+    heartbeat = asyncio.create_task(_heartbeat(job_id))
+    try:
+        data = {**await _score_job(job_id), "status": schemas.JobStatus.DONE.value}
+    except Exception as error:
+        data = {"status": schemas.JobStatus.FAILED.value, "error": repr(error)}
+    finally:
+        heartbeat.cancel()
+
+    await crud.update_scoring_job(job_id, {**data, "leaseExpiresAt": None})
+
+
+def schedule_scoring_job(job_id: int):
+    task = asyncio.create_task(run_scoring_job(job_id))
+    running_tasks.add(task)
+    task.add_done_callback(running_tasks.discard)
+    return task
+
+
+async def enqueue_scoring_job(exam_session, mode=None):
+    active_job = await crud.get_active_scoring_job(exam_session.id)
+    if active_job:
+        return active_job
+
+    mode = result.resolve_scoring_mode(exam_session, mode)
+    job = await crud.create_scoring_job(exam_session.id, mode.value)
+    schedule_scoring_job(job.id)
+    return job
+
+
+async def resume_scoring_jobs():
+    for job in await crud.list_active_scoring_jobs():
+        schedule_scoring_job(job.id)
@@ -0,0 +1,80 @@
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from app import schemas, crud
+
+
+LEADERBOARD_TOP_N = int(os.getenv("LEADERBOARD_TOP_N", "100"))
+LEADERBOARD_CACHE_TTL = float(os.getenv("LEADERBOARD_CACHE_TTL", "30"))
+LEADERBOARD_MAX_PAGE_SIZE = 500
+
+SESSION = "session"
+EXAM = "exam"
+
+SCOPES = {
+    SESSION: crud.LEADERBOARD_SESSION_SCOPE,
+    EXAM: crud.LEADERBOARD_EXAM_SCOPE,
+}
+
+
+class TopCache:
+    # First LEADERBOARD_TOP_N entries per scope. Rescoring a session drops it
+    # and every exam board; the TTL covers totals written by other paths.
+
+    def __init__(self, ttl: float = LEADERBOARD_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: Dict[Tuple[str, int], Tuple[float, List[dict]]] = {}
+
+    def get(self, scope: str, scope_id: int) -> Optional[List[dict]]:
+        cached = self._entries.get((scope, scope_id))
+        if cached is None or time.monotonic() - cached[0] > self.ttl:
+            return None
+        return cached[1]
+
+    def put(self, scope: str, scope_id: int, entries: List[dict]):
+        self._entries[(scope, scope_id)] = (time.monotonic(), entries)
+
+    def invalidate_session(self, session_id: int):
+        for cache_key in list(self._entries):
+            if cache_key == (SESSION, session_id) or cache_key[0] == EXAM:
+                del self._entries[cache_key]
+
+
+top_cache = TopCache()
+
+
+def _page(entries: List[dict], limit: int) -> schemas.LeaderboardPage:
+    entries = entries[:limit]
+    page = schemas.LeaderboardPage(entries=entries)
+    if len(entries) == limit:
+        page.nextAfterScore = entries[-1]["totalScore"]
+        page.nextAfterId = entries[-1]["responseId"]
+    return page
+
+
+async def get_leaderboard(
+    scope: str,
+    scope_id: int,
+    limit: int = 50,
+    after_score: Optional[float] = None,
+    after_id: Optional[int] = None,
+) -> schemas.LeaderboardPage:
+    limit = max(1, min(limit, LEADERBOARD_MAX_PAGE_SIZE))
+
+    if after_score is None and limit <= LEADERBOARD_TOP_N:
+        entries = top_cache.get(scope, scope_id)
+        if entries is None:
+            entries = await crud.list_leaderboard_page(
+                SCOPES[scope], scope_id, None, None, LEADERBOARD_TOP_N
+            )
+            top_cache.put(scope, scope_id, entries)
+        return _page(entries, limit)
+
+    entries = await crud.list_leaderboard_page(
+        SCOPES[scope], scope_id, after_score, after_id, limit
+    )
+    return _page(entries, limit)
+
+
+async def get_user_ranks(scope: str, scope_id: int, user_id: int) -> List[dict]:
+    return await crud.list_leaderboard_user_entries(SCOPES[scope], scope_id, user_id)
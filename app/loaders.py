@@ -0,0 +1,94 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+from app import crud
+
+
+class Loader:
+    # Memoizes lookups for the lifetime of one request. Keys requested in the
+    # same event loop turn are fetched together with one batch call.
+
+    def __init__(self, batch_load: Callable[[List[Hashable]], Awaitable[Dict]]):
+        self.batch_load = batch_load
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+        self._queue: List[Hashable] = []
+
+    def load(self, key: Hashable) -> "asyncio.Future":
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._futures[key] = future
+            if not self._queue:
+                loop.call_soon(lambda: asyncio.ensure_future(self._dispatch()))
+            self._queue.append(key)
+        return future
+
+    async def load_many(self, keys: List[Hashable]) -> List[Any]:
+        return await asyncio.gather(*[self.load(key) for key in keys])
+
+    def prime(self, key: Hashable, value: Any):
+        if key not in self._futures:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+            self._futures[key] = future
+
+    async def _dispatch(self):
+        keys, self._queue = self._queue, []
+        try:
+            values = await self.batch_load(keys)
+        except Exception as error:
+            for key in keys:
+                self._futures.pop(key).set_exception(error)
+            return
+        for key in keys:
+            self._futures[key].set_result(values.get(key))
+
+
+async def _load_exam_sessions(exam_session_ids: List[int]) -> Dict:
+    exam_sessions = await crud.list_exam_sessions_by_ids(exam_session_ids)
+    return {exam_session.id: exam_session for exam_session in exam_sessions}
+
+
+async def _load_exams(exam_ids: List[int]) -> Dict:
+    exams = await crud.list_exams_by_ids(exam_ids)
+    return {exam.id: exam for exam in exams}
+
+
+async def _load_plain_responses(session_user_ids: List[tuple]) -> Dict:
+    responses = await crud.list_plain_responses_by_session_and_users(session_user_ids)
+    return {(response.examSessionId, response.userId): response for response in responses}
+
+
+async def _load_responses(session_user_ids: List[tuple]) -> Dict:
+    # Full responses carry their last answer, which has no batched query.
+    responses = await asyncio.gather(
+        *[
+            crud.get_response_by_session_and_user(session_id, user_id)
+            for session_id, user_id in session_user_ids
+        ]
+    )
+    return dict(zip(session_user_ids, responses))
+
+
+class RequestLoaders:
+    def __init__(self):
+        self.exam_sessions = Loader(_load_exam_sessions)
+        self.exams = Loader(_load_exams)
+        self.plain_responses = Loader(_load_plain_responses)
+        self.responses = Loader(_load_responses)
+
+    async def exam_session(self, exam_session_id: int):
+        exam_session = await self.exam_sessions.load(exam_session_id)
+        if exam_session is not None:
+            # Sessions are loaded with their exam included.
+            self.exams.prime(exam_session.examId, exam_session.exam)
+        return exam_session
+
+    async def exam(self, exam_id: int):
+        return await self.exams.load(exam_id)
+
+    async def plain_response(self, session_id: int, user_id: int):
+        return await self.plain_responses.load((session_id, user_id))
+
+    async def response(self, session_id: int, user_id: int):
+        return await self.responses.load((session_id, user_id))
@@ -3,7 +3,17 @@ import os
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
 from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
-from app import crud, dependencies
+from app import (
+    auth,
+    crud,
+    dependencies,
+    jobs,
+    counters,
+    answer_buffer,
+    principals,
+    revocation,
+    schemas,
+)
 from app.routers import user, survey, response, exam
 
 
@@ -33,6 +43,30 @@ async def get_image(filename: str, current_user: dict = Depends(dependencies.get
     return FileResponse(file_path)
 
 
+@app.get("/metrics/answer_buffer", response_model=schemas.AnswerBufferMetrics)
+async def get_answer_buffer_metrics(
+    current_user: dict = Depends(dependencies.get_current_admin_user),
+):
+    return answer_buffer.answer_buffer.metrics()
+
+
+@app.get("/metrics/password_pool", response_model=schemas.PasswordPoolMetrics)
+async def get_password_pool_metrics(
+    current_user: dict = Depends(dependencies.get_current_admin_user),
+):
+    return auth.password_pool.metrics()
+
+
+@app.get("/metrics/principal_cache", response_model=schemas.PrincipalCacheMetrics)
+async def get_principal_cache_metrics(
+    current_user: dict = Depends(dependencies.get_current_admin_user),
+):
+    return {
+        **principals.principal_cache.metrics(),
+        "listening": principals.principal_listener.connected,
+    }
+
+
 app.include_router(user.router, prefix="/users", tags=["users"])
 app.include_router(survey.router, prefix="/surveys", tags=["surveys"])
 app.include_router(response.router, prefix="/responses", tags=["responses"])
@@ -53,7 +87,18 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup():
     await crud.prisma.connect()
+    await jobs.resume_scoring_jobs()
+    counters.option_counters.start()
+    principals.principal_listener.start()
+    await revocation.revocation_list.start()
+    if answer_buffer.ANSWER_WRITE_BEHIND:
+        await answer_buffer.answer_buffer.start()
 
 @app.on_event("shutdown")
 async def shutdown():
+    if answer_buffer.ANSWER_WRITE_BEHIND:
+        await answer_buffer.answer_buffer.stop()
+    await counters.option_counters.stop()
+    await principals.principal_listener.stop()
+    await revocation.revocation_list.stop()
     await crud.prisma.disconnect()
@@ -0,0 +1,190 @@
+import bisect
+import math
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from app import crud
+
+
+NORM_SKETCH_BINS = int(os.getenv("NORM_SKETCH_BINS", "256"))
+NORM_PAGE_SIZE = int(os.getenv("NORM_PAGE_SIZE", "5000"))
+
+
+class QuantileSketch:
+    # Mergeable histogram sketch: sorted centroids with counts. Factor values
+    # are small integers, so it stays exact until more than max_bins distinct
+    # values are seen; past that the two closest centroids are merged.
+
+    def __init__(self, values=None, counts=None, max_bins: int = NORM_SKETCH_BINS):
+        self.max_bins = max_bins
+        self.values: List[float] = list(values or [])
+        self.counts: List[int] = list(counts or [])
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def add(self, value: float, count: int = 1):
+        position = bisect.bisect_left(self.values, value)
+        if position < len(self.values) and self.values[position] == value:
+            self.counts[position] += count
+            return
+        self.values.insert(position, value)
+        self.counts.insert(position, count)
+        self._compress()
+
+    def merge(self, other: "QuantileSketch"):
+        for value, count in zip(other.values, other.counts):
+            self.add(value, count)
+
+    def _compress(self):
+        while len(self.values) > self.max_bins:
+            gaps = [
+                self.values[i + 1] - self.values[i] for i in range(len(self.values) - 1)
+            ]
+            i = gaps.index(min(gaps))
+            count = self.counts[i] + self.counts[i + 1]
+            self.values[i] = (
+                self.values[i] * self.counts[i] + self.values[i + 1] * self.counts[i + 1]
+            ) / count
+            self.counts[i] = count
+            del self.values[i + 1]
+            del self.counts[i + 1]
+
+    def percentile(self, value: float) -> Optional[float]:
+        # Mid-rank percentile: values below count fully, ties count half.
+        total = self.count
+        if not total:
+            return None
+
+        position = bisect.bisect_left(self.values, value)
+        below = sum(self.counts[:position])
+        if position < len(self.values) and self.values[position] == value:
+            rank = below + self.counts[position] / 2
+        elif 0 < position < len(self.values):
+            # Between two centroids: interpolate over their halves.
+            low, high = self.values[position - 1], self.values[position]
+            weight = (value - low) / (high - low)
+            rank = below - self.counts[position - 1] / 2 + weight * (
+                self.counts[position - 1] + self.counts[position]
+            ) / 2
+        else:
+            rank = below
+        return 100 * rank / total
+
+
+@dataclass
+class RunningStats:
+    # Welford's online mean / variance, mergeable with Chan's formula.
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    sketch: QuantileSketch = field(default_factory=QuantileSketch)
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.sketch.add(value)
+
+    def merge(self, other: "RunningStats"):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.sketch.merge(other.sketch)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+    def z_score(self, value: float) -> Optional[float]:
+        std = self.std
+        if not std:
+            return None
+        return (value - self.mean) / std
+
+    def percentile(self, value: float) -> Optional[float]:
+        return self.sketch.percentile(value)
+
+
+class SessionNorms:
+    def __init__(self, stats: Optional[Dict[int, RunningStats]] = None):
+        self.stats: Dict[int, RunningStats] = stats or {}
+
+    def add_factor_values(self, factor_values: Dict[int, Dict[int, int]]):
+        for values in factor_values.values():
+            for factor_id, value in values.items():
+                self.stats.setdefault(factor_id, RunningStats()).add(value)
+
+    def merge(self, other: "SessionNorms"):
+        for factor_id, stats in other.stats.items():
+            self.stats.setdefault(factor_id, RunningStats()).merge(stats)
+
+
+def _norm_from_row(factor_norm) -> RunningStats:
+    return RunningStats(
+        count=factor_norm.count,
+        mean=factor_norm.mean,
+        m2=factor_norm.m2,
+        sketch=QuantileSketch(factor_norm.sketchValues, factor_norm.sketchCounts),
+    )
+
+
+async def save_session_norms(session_id: int, norms: SessionNorms):
+    await crud.replace_factor_norms(
+        session_id=session_id,
+        norms_data=[
+            {
+                "factorId": factor_id,
+                "count": stats.count,
+                "mean": stats.mean,
+                "m2": stats.m2,
+                "sketchValues": stats.sketch.values,
+                "sketchCounts": stats.sketch.counts,
+            }
+            for factor_id, stats in norms.stats.items()
+        ],
+    )
+
+
+async def refresh_session_norms(session_id: int) -> SessionNorms:
+    # Rebuilds the norms from the stored FactorValue rows in one keyset pass,
+    # for scoring paths that do not see every factor value in memory.
+    norms = SessionNorms()
+    after_id = 0
+    while True:
+        factor_values = await crud.list_factor_values_for_exam_session_page(
+            session_id=session_id, after_id=after_id, take=NORM_PAGE_SIZE
+        )
+        if not factor_values:
+            break
+        for factor_value in factor_values:
+            norms.stats.setdefault(factor_value.factorId, RunningStats()).add(
+                factor_value.value
+            )
+        after_id = factor_values[-1].id
+
+    await save_session_norms(session_id, norms)
+    return norms
+
+
+async def load_session_norms(session_id: int) -> SessionNorms:
+    factor_norms = await crud.list_factor_norms(session_id=session_id)
+    return SessionNorms(
+        {factor_norm.factorId: _norm_from_row(factor_norm) for factor_norm in factor_norms}
+    )
+
+
+def standardize_factor_values(factor_values: List[dict], norms: SessionNorms):
+    for factor_value in factor_values:
+        stats = norms.stats.get(factor_value["factorId"])
+        if stats is None:
+            continue
+        factor_value["zScore"] = stats.z_score(factor_value["value"])
+        factor_value["percentile"] = stats.percentile(factor_value["value"])
+    return factor_values
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+import asyncpg
+from app import crud
+
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_LISTEN_RETRY_SECONDS = 5
+
+
+class PrincipalCache:
+    # LRU of authenticated users keyed by the token subject (email). Entries
+    # expire after the TTL, which also bounds staleness while the listener
+    # is disconnected.
+
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL, size: int = PRINCIPAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.generation = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, subject: str):
+        cached = self._entries.get(subject)
+        if cached is None or time.monotonic() - cached[0] > self.ttl:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(subject)
+        self.hits += 1
+        return cached[1]
+
+    def put(self, subject: str, user):
+        self._entries[subject] = (time.monotonic(), user)
+        self._entries.move_to_end(subject)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, subject: str):
+        self.invalidations += 1
+        self.generation += 1
+        self._entries.pop(subject, None)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+    def metrics(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "ttlSeconds": self.ttl,
+        }
+
+
+principal_cache = PrincipalCache()
+
+
+async def get_principal(subject: str):
+    user = principal_cache.get(subject)
+    if user is None:
+        generation = principal_cache.generation
+        user = await crud.get_user_by_email(email=subject)
+        # A user read before an invalidation must not be cached after it.
+        if user is not None and principal_cache.generation == generation:
+            principal_cache.put(subject, user)
+    return user
+
+
+class PrincipalListener:
+    # Prisma has no LISTEN support, so one asyncpg connection per worker
+    # receives the notifications sent by crud on user changes.
+
+    def __init__(self, cache: PrincipalCache = principal_cache):
+        self.cache = cache
+        self.connected = False
+        self._task: Optional[asyncio.Task] = None
+
+    def _on_notification(self, connection, pid, channel, subject):
+        self.cache.invalidate(subject)
+
+    async def _run(self):
+        dsn = crud.postgres_dsn()
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                await connection.add_listener(
+                    crud.PRINCIPAL_CHANNEL, self._on_notification
+                )
+                # Notifications sent while disconnected are lost.
+                self.cache.clear()
+                self.connected = True
+                while not connection.is_closed():
+                    await asyncio.sleep(PRINCIPAL_LISTEN_RETRY_SECONDS)
+            except Exception:
+                pass
+            finally:
+                self.connected = False
+                if connection is not None:
+                    await connection.close()
+            await asyncio.sleep(PRINCIPAL_LISTEN_RETRY_SECONDS)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+principal_listener = PrincipalListener()
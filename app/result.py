@@ -1,4 +1,13 @@
-from app import schemas, crud
+import asyncio
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from app import schemas, crud, scoring_plan, vectorized, norms, analysis, leaderboard
+from app.scoring_plan import AnswerKey
 
 
 async def save_answer_scores_in_db(response: schemas.ResponseWithAnswers):
@@ -69,3 +78,624 @@ async def save_total_score_in_db(response: schemas.ResponseWithAnswers):
             response_id=response.id,
             total_score=total_score,
         )
+
+
+async def legacy_calculate_session_scores(session_id: int):
+    # The per-answer path calculate_scores used before batch scoring. It is
+    # kept as the reference for the parity test and the baseline of
+    # scripts/benchmark_scoring.py, not for the API. It adds impacts onto the
+    # stored factor values, so it is only meaningful on an unscored session.
+    # The original endpoint summed totals from the answers loaded before
+    # scoring, so they trailed by one run; they are summed from the freshly
+    # scored answers here.
+    responses = await crud.list_responses_for_exam_session(session_id=session_id)
+    for response in responses:
+        await save_answer_scores_in_db(response)
+
+    responses = await crud.list_responses_for_exam_session(session_id=session_id)
+    for response in responses:
+        await save_total_score_in_db(response)
+
+
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "0")) or os.cpu_count() or 1
+SCORING_CHUNK_SIZE = int(os.getenv("SCORING_CHUNK_SIZE", "500"))
+# Upper bounds for the per-request overrides of the two settings above.
+SCORING_MAX_WORKERS = 64
+SCORING_MAX_CHUNK_SIZE = 10000
+
+CompactAnswer = namedtuple(
+    "CompactAnswer", ["id", "questionId", "optionId", "staticOptionId", "score"]
+)
+CompactResponse = namedtuple("CompactResponse", ["id", "answers"])
+
+
+@dataclass
+class ScoreSheet:
+    answer_scores: Dict[int, Optional[float]] = field(default_factory=dict)
+    total_scores: Dict[int, float] = field(default_factory=dict)
+    factor_values: Dict[int, Dict[int, int]] = field(default_factory=dict)
+    parameter_values: Dict[int, Dict[int, int]] = field(default_factory=dict)
+
+
+async def load_answer_key(survey_ids: List[int]) -> AnswerKey:
+    plans = await scoring_plan.get_scoring_plans(survey_ids)
+    return scoring_plan.merge_answer_keys([plan.key for plan in plans])
+
+
+def score_answer(
+    question_id: int,
+    option_id: Optional[int],
+    key: AnswerKey,
+    static_option_id: Optional[int] = None,
+):
+    question_type = key.question_types[question_id]
+
+    if question_type == schemas.QuestionType.MULTIPLE_CHOICE:
+        selected_order = key.option_orders.get(option_id)
+        if selected_order is not None and key.correct_options[question_id] == selected_order:
+            return key.points[question_id], []
+        return 0, []
+
+    if question_type == schemas.QuestionType.PSYCHOLOGY:
+        impacts = key.option_impacts.get(option_id, [])
+        if (
+            static_option_id is not None
+            and key.static_option_surveys.get(static_option_id)
+            == key.question_surveys[question_id]
+        ):
+            impacts = impacts + key.static_option_impacts[static_option_id]
+        return None, impacts
+
+    return None, []
+
+
+def score_response(
+    response, key: AnswerKey, sheet: ScoreSheet, with_factors: bool = True
+):
+    surveys = set()
+    factor_values = {}
+    total_score = 0
+
+    for answer in response.answers:
+        score = answer.score
+        survey_id = key.question_surveys.get(answer.questionId)
+
+        if survey_id is not None:
+            if survey_id not in surveys:
+                for factor_id in key.survey_factors.get(survey_id, []):
+                    factor_values.setdefault(factor_id, 0)
+                surveys.add(survey_id)
+
+            answer_score, impacts = score_answer(
+                answer.questionId, answer.optionId, key, answer.staticOptionId
+            )
+
+            if key.question_types[answer.questionId] == schemas.QuestionType.MULTIPLE_CHOICE:
+                score = answer_score
+                sheet.answer_scores[answer.id] = score
+
+            if with_factors:
+                for factor_id, impact in impacts:
+                    factor_values[factor_id] = factor_values.get(factor_id, 0) + impact
+
+        if score:
+            total_score += score
+
+    sheet.total_scores[response.id] = total_score
+    if with_factors:
+        sheet.factor_values[response.id] = factor_values
+
+
+def rollup_parameter_values(
+    factor_values: Dict[int, Dict[int, int]], key: AnswerKey
+) -> Dict[int, Dict[int, int]]:
+    parameter_values = {}
+    for response_id, values in factor_values.items():
+        rollup = parameter_values.setdefault(response_id, {})
+        for factor_id, value in values.items():
+            parameter_id = key.factor_parameters.get(factor_id)
+            if parameter_id is not None:
+                rollup[parameter_id] = rollup.get(parameter_id, 0) + value
+    return parameter_values
+
+
+def _new_answer_deltas(key: AnswerKey, response_id: int, answers_data: List[dict]):
+    # Scores the new answers in place and returns the FactorValue and
+    # ParameterValue rows they touch with the deltas to add to them.
+    factor_ids = []
+    factor_deltas = {}
+    for answer_data in answers_data:
+        survey_id = key.question_surveys.get(answer_data["questionId"])
+        if survey_id is None:
+            continue
+
+        score, impacts = score_answer(
+            answer_data["questionId"],
+            answer_data.get("optionId"),
+            key,
+            answer_data.get("staticOptionId"),
+        )
+        if score is not None:
+            answer_data["score"] = score
+
+        for factor_id in key.survey_factors.get(survey_id, []):
+            if factor_id not in factor_ids:
+                factor_ids.append(factor_id)
+        for factor_id, impact in impacts:
+            if factor_id not in factor_ids:
+                factor_ids.append(factor_id)
+            factor_deltas[factor_id] = factor_deltas.get(factor_id, 0) + impact
+
+    parameter_ids = []
+    for factor_id in factor_ids:
+        parameter_id = key.factor_parameters.get(factor_id)
+        if parameter_id is not None and parameter_id not in parameter_ids:
+            parameter_ids.append(parameter_id)
+    parameter_deltas = rollup_parameter_values({response_id: factor_deltas}, key)
+
+    return factor_ids, factor_deltas, parameter_ids, parameter_deltas[response_id]
+
+
+async def score_new_answer(exam_session, response_id: int, answer_data: dict):
+    key = await load_answer_key(exam_session_survey_ids(exam_session))
+
+    if answer_data["questionId"] not in key.question_surveys:
+        return await crud.upsert_answer(response_id, answer_data)
+
+    factor_ids, factor_deltas, parameter_ids, parameter_deltas = _new_answer_deltas(
+        key, response_id, [answer_data]
+    )
+    return await crud.upsert_scored_answer(
+        response_id=response_id,
+        answer_data=answer_data,
+        factor_ids=factor_ids,
+        factor_deltas=factor_deltas,
+        parameter_ids=parameter_ids,
+        parameter_deltas=parameter_deltas,
+    )
+
+
+async def score_new_answers(exam_session, response_id: int, answers_data: List[dict]):
+    key = await load_answer_key(exam_session_survey_ids(exam_session))
+
+    factor_ids, factor_deltas, parameter_ids, parameter_deltas = _new_answer_deltas(
+        key, response_id, answers_data
+    )
+    return await crud.create_answers_bulk(
+        response_id=response_id,
+        answers_data=answers_data,
+        factor_ids=factor_ids,
+        factor_deltas=factor_deltas,
+        parameter_ids=parameter_ids,
+        parameter_deltas=parameter_deltas,
+    )
+
+
+async def finalize_session_scores(exam_session):
+    total_scores = await crud.sum_answer_scores_for_exam_session(
+        session_id=exam_session.id
+    )
+    sheet = ScoreSheet(total_scores=total_scores)
+    await save_score_sheet(sheet)
+    return sheet
+
+
+@dataclass
+class ScoringContext:
+    key: AnswerKey
+    matrix: Optional[vectorized.ImpactMatrix] = None
+    workers: int = 1
+
+
+def exam_session_survey_ids(exam_session) -> List[int]:
+    return [exam_survey.surveyId for exam_survey in exam_session.exam.examSurveys]
+
+
+def resolve_scoring_mode(
+    exam_session, mode: Optional[schemas.ScoringMode] = None
+) -> schemas.ScoringMode:
+    if mode is not None:
+        return mode
+    if exam_session.exam.incrementalScoring:
+        return schemas.ScoringMode.FINALIZE
+    return schemas.ScoringMode.BATCH
+
+
+async def load_scoring_context(
+    exam_session, mode: schemas.ScoringMode, workers: Optional[int] = None
+) -> ScoringContext:
+    plans = await scoring_plan.get_scoring_plans(exam_session_survey_ids(exam_session))
+    context = ScoringContext(
+        key=scoring_plan.merge_answer_keys([plan.key for plan in plans])
+    )
+    if mode == schemas.ScoringMode.VECTORIZED:
+        context.matrix = vectorized.build_impact_matrix(plans)
+    if mode == schemas.ScoringMode.PARALLEL:
+        context.workers = workers or SCORING_WORKERS
+    return context
+
+
+def score_responses(responses, context: ScoringContext) -> ScoreSheet:
+    sheet = ScoreSheet()
+    with_factors = context.matrix is None
+    for response in responses:
+        score_response(response, context.key, sheet, with_factors=with_factors)
+
+    if not with_factors:
+        sheet.factor_values = vectorized.score_factor_values(
+            responses, context.key, context.matrix
+        )
+    sheet.parameter_values = rollup_parameter_values(sheet.factor_values, context.key)
+    return sheet
+
+
+def merge_score_sheets(sheets: List[ScoreSheet]) -> ScoreSheet:
+    merged = ScoreSheet()
+    for sheet in sheets:
+        merged.answer_scores.update(sheet.answer_scores)
+        merged.total_scores.update(sheet.total_scores)
+        merged.factor_values.update(sheet.factor_values)
+        merged.parameter_values.update(sheet.parameter_values)
+    return merged
+
+
+_worker_context: Optional[ScoringContext] = None
+
+
+def _init_scoring_worker(context: ScoringContext):
+    global _worker_context
+    _worker_context = context
+
+
+def _score_chunk(responses) -> ScoreSheet:
+    return score_responses(responses, _worker_context)
+
+
+def _compact_response(response) -> CompactResponse:
+    return CompactResponse(
+        response.id,
+        [
+            CompactAnswer(
+                answer.id,
+                answer.questionId,
+                answer.optionId,
+                answer.staticOptionId,
+                answer.score,
+            )
+            for answer in response.answers
+        ],
+    )
+
+
+@asynccontextmanager
+async def scoring_executor(context: ScoringContext):
+    if context.workers <= 1:
+        yield None
+        return
+
+    # Every worker receives the read-only context once, through the initializer.
+    executor = ProcessPoolExecutor(
+        max_workers=context.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_scoring_worker,
+        initargs=(context,),
+    )
+    try:
+        yield executor
+    finally:
+        # Joining the workers blocks, so it runs off the event loop.
+        await asyncio.to_thread(executor.shutdown, True)
+
+
+async def score_responses_parallel(
+    responses, context: ScoringContext, executor: Optional[ProcessPoolExecutor]
+) -> ScoreSheet:
+    if executor is None:
+        return score_responses(responses, context)
+
+    compact_responses = [_compact_response(response) for response in responses]
+    # A few chunks per worker keeps them busy when response sizes are uneven.
+    chunk_size = max(1, -(-len(compact_responses) // (context.workers * 4)))
+
+    loop = asyncio.get_running_loop()
+    sheets = await asyncio.gather(
+        *[
+            loop.run_in_executor(
+                executor, _score_chunk, compact_responses[start : start + chunk_size]
+            )
+            for start in range(0, len(compact_responses), chunk_size)
+        ]
+    )
+    return merge_score_sheets(sheets)
+
+
+async def save_score_sheet(sheet: ScoreSheet):
+    await crud.save_scores_bulk(
+        answer_scores=sheet.answer_scores,
+        total_scores=sheet.total_scores,
+        factor_values=sheet.factor_values,
+        parameter_values=sheet.parameter_values,
+    )
+
+
+async def stream_session_scores(
+    exam_session,
+    context: ScoringContext,
+    after_id: int = 0,
+    chunk_size: Optional[int] = None,
+    session_norms: Optional[norms.SessionNorms] = None,
+):
+    # Scores the session in keyset-ordered pages, flushing each one in turn,
+    # and yields the id of the last flushed response. The next page is
+    # fetched while the current one is scored and saved.
+    page_size = chunk_size or SCORING_CHUNK_SIZE
+
+    def fetch_page(page_after_id: int):
+        return asyncio.ensure_future(
+            crud.list_responses_for_exam_session_page(
+                session_id=exam_session.id,
+                after_id=page_after_id,
+                take=page_size,
+            )
+        )
+
+    async with scoring_executor(context) as executor:
+        if executor is not None:
+            # A chunk's worth of responses for every worker in each page.
+            page_size *= context.workers
+
+        next_page = fetch_page(after_id)
+        try:
+            while True:
+                responses = await next_page
+                if not responses:
+                    break
+
+                after_id = responses[-1].id
+                next_page = fetch_page(after_id)
+                sheet = await score_responses_parallel(responses, context, executor)
+                await save_score_sheet(sheet)
+                if session_norms is not None:
+                    session_norms.add_factor_values(sheet.factor_values)
+
+                yield after_id, len(responses)
+        finally:
+            next_page.cancel()
+
+
+async def finish_session_scoring(
+    session_id: int, session_norms: Optional[norms.SessionNorms] = None
+):
+    # Norms folded during the pass are saved as they are; other paths rebuild
+    # them from the stored factor values.
+    if session_norms is None:
+        await norms.refresh_session_norms(session_id)
+    else:
+        await norms.save_session_norms(session_id, session_norms)
+    await crud.bump_session_scores_version(session_id)
+    analysis.analysis_cache.invalidate(session_id)
+    leaderboard.top_cache.invalidate_session(session_id)
+
+
+async def calculate_session_scores(
+    exam_session,
+    mode: Optional[schemas.ScoringMode] = None,
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+) -> schemas.ScoringMode:
+    mode = resolve_scoring_mode(exam_session, mode)
+    if mode == schemas.ScoringMode.FINALIZE:
+        await finalize_session_scores(exam_session)
+        await finish_session_scoring(exam_session.id)
+        return mode
+
+    if mode == schemas.ScoringMode.SQL:
+        await crud.score_exam_session_in_db(session_id=exam_session.id)
+        await finish_session_scoring(exam_session.id)
+        return mode
+
+    context = await load_scoring_context(exam_session, mode, workers=workers)
+    session_norms = norms.SessionNorms()
+    async for _ in stream_session_scores(
+        exam_session, context, chunk_size=chunk_size, session_norms=session_norms
+    ):
+        pass
+    await finish_session_scoring(exam_session.id, session_norms)
+    return mode
+
+
+async def rescore_changes(
+    exam_session,
+    question_ids: Optional[List[int]] = None,
+    option_ids: Optional[List[int]] = None,
+    factor_impact_ids: Optional[List[int]] = None,
+) -> schemas.RescoreReport:
+    plans = await scoring_plan.get_scoring_plans(exam_session_survey_ids(exam_session))
+    key = scoring_plan.merge_answer_keys([plan.key for plan in plans])
+
+    option_questions = {}
+    for plan in plans:
+        option_questions.update(
+            zip(plan.option_ids.tolist(), plan.option_questions.tolist())
+        )
+
+    option_ids = list(option_ids or [])
+    changed_questions = set(question_ids or [])
+    if factor_impact_ids:
+        impacts = await crud.list_factor_impacts_by_ids(factor_impact_ids)
+        option_ids.extend(impact.optionId for impact in impacts)
+        if len(impacts) < len(set(factor_impact_ids)):
+            # A deleted impact leaves no trace of its option, so the factors
+            # of every psychology question are recomputed to drop its share.
+            changed_questions.update(
+                question_id
+                for question_id, question_type in key.question_types.items()
+                if question_type == schemas.QuestionType.PSYCHOLOGY
+            )
+
+    changed_questions.update(
+        option_questions[option_id]
+        for option_id in option_ids
+        if option_id in option_questions
+    )
+    changed_questions &= set(key.question_surveys)
+
+    answers = []
+    if changed_questions:
+        answers = await crud.list_session_answers_for_questions(
+            session_id=exam_session.id, question_ids=list(changed_questions)
+        )
+
+    answer_scores = {}
+    total_deltas = {}
+    changed_answers = {}
+    factor_responses = set()
+    factor_surveys = set()
+
+    for answer in answers:
+        question_type = key.question_types[answer.questionId]
+
+        if question_type == schemas.QuestionType.MULTIPLE_CHOICE:
+            score, _ = score_answer(answer.questionId, answer.optionId, key)
+            if score != answer.score:
+                answer_scores[answer.id] = score
+                total_deltas[answer.responseId] = (
+                    total_deltas.get(answer.responseId, 0)
+                    + (score or 0)
+                    - (answer.score or 0)
+                )
+                changed_answers[answer.responseId] = (
+                    changed_answers.get(answer.responseId, 0) + 1
+                )
+
+        elif question_type == schemas.QuestionType.PSYCHOLOGY:
+            factor_responses.add(answer.responseId)
+            factor_surveys.add(key.question_surveys[answer.questionId])
+
+    # FactorValue rows only hold the sums, so the factors of the affected
+    # surveys are recomputed from the affected responses' answers to them.
+    new_factor_values = {}
+    if factor_responses:
+        survey_question_ids = [
+            question_id
+            for question_id, survey_id in key.question_surveys.items()
+            if survey_id in factor_surveys
+        ]
+        survey_answers = await crud.list_answers_for_responses_and_questions(
+            response_ids=list(factor_responses), question_ids=survey_question_ids
+        )
+        for answer in survey_answers:
+            values = new_factor_values.setdefault(answer.responseId, {})
+            for factor_id in key.survey_factors.get(
+                key.question_surveys[answer.questionId], []
+            ):
+                values.setdefault(factor_id, 0)
+            _, impacts = score_answer(
+                answer.questionId, answer.optionId, key, answer.staticOptionId
+            )
+            for factor_id, impact in impacts:
+                values[factor_id] = values.get(factor_id, 0) + impact
+
+    factor_ids = sorted(
+        {factor_id for values in new_factor_values.values() for factor_id in values}
+    )
+    old_factor_values = {}
+    if new_factor_values:
+        existing_factor_values = await crud.list_factor_values_for_responses(
+            response_ids=list(new_factor_values), factor_ids=factor_ids
+        )
+        for factor_value in existing_factor_values:
+            old_factor_values.setdefault(factor_value.responseId, {})[
+                factor_value.factorId
+            ] = factor_value.value
+
+    factor_changes = {}
+    for response_id, values in new_factor_values.items():
+        old_values = old_factor_values.get(response_id, {})
+        changes = [
+            schemas.FactorValueChange(
+                factorId=factor_id,
+                oldValue=old_values.get(factor_id),
+                newValue=value,
+            )
+            for factor_id, value in values.items()
+            if old_values.get(factor_id) != value
+        ]
+        if changes or set(old_values) - set(values):
+            factor_changes[response_id] = changes
+
+    changed_response_ids = sorted(
+        {response_id for response_id, delta in total_deltas.items() if delta}
+        | set(changed_answers)
+        | set(factor_changes)
+    )
+    responses = {}
+    if changed_response_ids:
+        responses = {
+            response.id: response
+            for response in await crud.list_responses_by_ids(changed_response_ids)
+        }
+
+    # A response without a stored total has nothing to apply a delta to, so
+    # its total is summed from all its answers with the new scores.
+    unscored_response_ids = [
+        response_id
+        for response_id in changed_response_ids
+        if total_deltas.get(response_id) and responses[response_id].totalScore is None
+    ]
+    summed_totals = {}
+    if unscored_response_ids:
+        for answer in await crud.list_answers_for_responses(unscored_response_ids):
+            score = answer_scores.get(answer.id, answer.score)
+            summed_totals[answer.responseId] = (
+                summed_totals.get(answer.responseId, 0) + (score or 0)
+            )
+
+    total_scores = {}
+    changes = []
+    for response_id in changed_response_ids:
+        response = responses[response_id]
+        new_total_score = response.totalScore
+        if response_id in unscored_response_ids:
+            new_total_score = summed_totals.get(response_id, 0)
+            total_scores[response_id] = new_total_score
+        elif total_deltas.get(response_id):
+            new_total_score = response.totalScore + total_deltas[response_id]
+            total_scores[response_id] = new_total_score
+        changes.append(
+            schemas.ResponseScoreChange(
+                responseId=response_id,
+                userId=response.userId,
+                oldTotalScore=response.totalScore,
+                newTotalScore=new_total_score,
+                changedAnswers=changed_answers.get(response_id, 0),
+                factorValues=factor_changes.get(response_id, []),
+            )
+        )
+
+    changed_factor_values = {
+        response_id: new_factor_values[response_id] for response_id in factor_changes
+    }
+    await crud.save_scores_bulk(
+        answer_scores=answer_scores,
+        total_scores=total_scores,
+        factor_values=changed_factor_values,
+        factor_ids=factor_ids,
+        parameter_values=rollup_parameter_values(changed_factor_values, key),
+        parameter_ids=sorted(
+            {
+                key.factor_parameters[factor_id]
+                for factor_id in factor_ids
+                if factor_id in key.factor_parameters
+            }
+        ),
+    )
+    if changes:
+        await finish_session_scoring(exam_session.id)
+
+    return schemas.RescoreReport(
+        examSessionId=exam_session.id,
+        answersChecked=len(answers),
+        responsesChanged=len(changes),
+        changes=changes,
+    )
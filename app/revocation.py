@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Set
+from app import crud
+
+
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", "5"))
+REVOCATION_REBUILD_SECONDS = float(os.getenv("REVOCATION_REBUILD_SECONDS", "3600"))
+REVOCATION_BLOOM_CAPACITY = int(os.getenv("REVOCATION_BLOOM_CAPACITY", "100000"))
+REVOCATION_BLOOM_ERROR_RATE = float(os.getenv("REVOCATION_BLOOM_ERROR_RATE", "0.001"))
+REVOCATION_EXACT_SET_SIZE = int(os.getenv("REVOCATION_EXACT_SET_SIZE", "100000"))
+# Rows committed late by concurrent transactions are picked up by re-reading
+# this much of the previous refresh window.
+REVOCATION_REFRESH_OVERLAP = timedelta(seconds=30)
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        for position in self._positions(key):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class RevocationList:
+    # In-process mirror of RevokedToken. The exact set holds up to
+    # REVOCATION_EXACT_SET_SIZE ids and answers alone while it holds them
+    # all; past that the Bloom filter, which holds every unexpired id, clears
+    # the rest and only its hits are checked in Postgres. Revocations made by
+    # other workers are seen after the next refresh.
+
+    def __init__(
+        self,
+        refresh_seconds: float = REVOCATION_REFRESH_SECONDS,
+        rebuild_seconds: float = REVOCATION_REBUILD_SECONDS,
+    ):
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self.bloom = BloomFilter(REVOCATION_BLOOM_CAPACITY, REVOCATION_BLOOM_ERROR_RATE)
+        self.exact: Set[str] = set()
+        self.complete = True
+        self._refreshed_at: Optional[datetime] = None
+        self._rebuilt_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _add(self, token_id: str):
+        self.bloom.add(token_id)
+        if len(self.exact) < REVOCATION_EXACT_SET_SIZE:
+            self.exact.add(token_id)
+        else:
+            self.complete = False
+
+    async def rebuild(self):
+        # Bloom filters cannot drop members, so expired revocations are only
+        # shed by rebuilding from the unexpired rows.
+        now = datetime.now(timezone.utc)
+        await crud.delete_expired_revoked_tokens(now)
+        revoked_tokens = await crud.list_revoked_tokens(expires_after=now)
+
+        self.bloom = BloomFilter(
+            max(REVOCATION_BLOOM_CAPACITY, 2 * len(revoked_tokens)),
+            REVOCATION_BLOOM_ERROR_RATE,
+        )
+        self.exact = set()
+        self.complete = True
+        for revoked_token in revoked_tokens:
+            self._add(revoked_token.tokenId)
+        self._refreshed_at = self._rebuilt_at = now
+
+    async def refresh(self):
+        now = datetime.now(timezone.utc)
+        revoked_tokens = await crud.list_revoked_tokens(
+            expires_after=now,
+            created_after=self._refreshed_at - REVOCATION_REFRESH_OVERLAP,
+        )
+        for revoked_token in revoked_tokens:
+            self._add(revoked_token.tokenId)
+        self._refreshed_at = now
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                elapsed = datetime.now(timezone.utc) - self._rebuilt_at
+                if elapsed.total_seconds() > self.rebuild_seconds:
+                    await self.rebuild()
+                else:
+                    await self.refresh()
+            except Exception:
+                pass
+
+    async def start(self):
+        await self.rebuild()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def is_revoked(self, token_id: str) -> bool:
+        if token_id in self.exact:
+            return True
+        if self.complete or token_id not in self.bloom:
+            return False
+        return await crud.get_revoked_token(token_id) is not None
+
+    async def revoke(self, token_id: str, user_id: int, expires_at: datetime):
+        await crud.create_revoked_token(token_id, user_id, expires_at)
+        self._add(token_id)
+
+
+revocation_list = RevocationList()
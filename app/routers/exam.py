@@ -1,6 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-from app import schemas, crud, result
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from typing import List, Optional
+from app import (
+    schemas,
+    crud,
+    result,
+    jobs,
+    norms,
+    analysis,
+    leaderboard,
+    counters,
+    bundle,
+)
 from app.dependencies import (
     get_current_admin_user,
     get_current_user,
@@ -10,7 +20,10 @@ from app.dependencies import (
     verify_exam_session,
     check_user_access,
     verify_exam_author_by_session,
+    check_leaderboard_cursor,
+    get_loaders,
 )
+from app.loaders import RequestLoaders
 
 
 router = APIRouter()
@@ -58,9 +71,37 @@ async def update_exam(
             detail="Can not edit exam after activation",
         )
     updated_exam = await crud.update_exam(existing_exam.id, exam)
+    bundle.bundle_cache.invalidate_exam(existing_exam.id)
     return updated_exam
 
 
+@router.get("/{exam_id}/leaderboard/", response_model=schemas.LeaderboardPage)
+async def get_exam_leaderboard(
+    limit: int = 50,
+    cursor: tuple = Depends(check_leaderboard_cursor),
+    exam: dict = Depends(verify_exam),
+    current_user: dict = Depends(verify_exam_author),
+):
+    after_score, after_id = cursor
+    page = await leaderboard.get_leaderboard(
+        leaderboard.EXAM, exam.id, limit, after_score, after_id
+    )
+    return page
+
+
+@router.get(
+    "/{exam_id}/leaderboard/user/{user_id}",
+    response_model=List[schemas.LeaderboardEntry],
+)
+async def get_exam_user_ranks(
+    user_id: int,
+    exam: dict = Depends(verify_exam),
+    current_user: dict = Depends(verify_exam_author),
+):
+    entries = await leaderboard.get_user_ranks(leaderboard.EXAM, exam.id, user_id)
+    return entries
+
+
 @router.post("/{exam_id}/activate/", response_model=schemas.ExamResponse)
 async def activate_exam(
     existing_exam: dict = Depends(verify_exam),
@@ -133,6 +174,7 @@ async def delete_exam_survey(
             detail="Can not delete exam's survey after activation",
         )
     deleted_exam_survey = await crud.delete_exam_survey(existing_exam_survey.id)
+    bundle.bundle_cache.invalidate_exam(exam.id)
     return deleted_exam_survey
 
 
@@ -226,10 +268,8 @@ async def get_private_exam_session(
     exam_session: dict = Depends(verify_exam_session),
     current_user: dict = Depends(check_user_access),
 ):
-    exam = await crud.get_exam_with_surveys(exam_session.examId)
-    exam_session_dict = exam_session.dict()
-    exam_session_dict["exam"] = exam
-    return exam_session_dict
+    # The session is loaded with its exam and surveys included.
+    return exam_session
 
 
 @router.get(
@@ -238,14 +278,13 @@ async def get_private_exam_session(
 )
 async def list_user_sessions(
     current_user: dict = Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
     responses = await crud.list_user_responses(current_user.id)
 
-    sessions = []
-    for response in responses:
-        session = await crud.get_exam_session_by_id(response.examSessionId)
-        sessions.append(session)
-
+    sessions = await loaders.exam_sessions.load_many(
+        [response.examSessionId for response in responses]
+    )
     return sessions
 
 
@@ -271,35 +310,182 @@ async def list_sessions(
     response_model=List[schemas.QuestionResponse],
 )
 async def get_question(
+    request: Request,
     exam_session: dict = Depends(verify_exam_session),
     current_user: dict = Depends(check_user_access),
 ):
-    exam = await crud.get_exam_with_surveys(exam_id=exam_session.examId)
-
-    questions = []
-    for exam_survey in exam.examSurveys:
-        survey = await crud.get_survey_with_questions(survey_id=exam_survey.surveyId)
-        questions.extend(survey.questions)
-
-    return questions
+    exam_bundle = await bundle.get_exam_bundle(exam_session.examId)
+
+    headers = {"ETag": exam_bundle.etag, "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == exam_bundle.etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(
+            exam_bundle.gzip_body, media_type="application/json", headers=headers
+        )
+    return Response(exam_bundle.body, media_type="application/json", headers=headers)
 
 
 @router.post(
     "/session/{exam_session_id}/calculate_scores/",
-    response_model=List[schemas.ResponseWithScore],
+    response_model=schemas.ScoringSummary,
 )
 async def calculate_scores(
+    mode: Optional[schemas.ScoringMode] = None,
+    workers: Optional[int] = Query(None, ge=1, le=result.SCORING_MAX_WORKERS),
+    chunk_size: Optional[int] = Query(None, ge=1, le=result.SCORING_MAX_CHUNK_SIZE),
+    exam_session: dict = Depends(verify_exam_session),
+    current_user: dict = Depends(verify_exam_author_by_session),
+):
+    mode = await result.calculate_session_scores(
+        exam_session, mode=mode, workers=workers, chunk_size=chunk_size
+    )
+
+    # Scores are read back through the leaderboard and per-response routes;
+    # loading the whole session here would undo the batched pass.
+    return {
+        "examSessionId": exam_session.id,
+        "mode": mode,
+        "responseCount": await crud.count_responses_for_exam_session(exam_session.id),
+        "scoresVersion": await crud.get_session_scores_version(exam_session.id),
+    }
+
+
+@router.get(
+    "/session/{exam_session_id}/norms/",
+    response_model=List[schemas.FactorNormResponse],
+)
+async def get_session_norms(
+    exam_session: dict = Depends(verify_exam_session),
+    current_user: dict = Depends(verify_exam_author_by_session),
+):
+    session_norms = await norms.load_session_norms(exam_session.id)
+    return [
+        schemas.FactorNormResponse(
+            factorId=factor_id, count=stats.count, mean=stats.mean, std=stats.std
+        )
+        for factor_id, stats in session_norms.stats.items()
+    ]
+
+
+@router.get(
+    "/session/{exam_session_id}/option_counts/",
+    response_model=List[schemas.OptionCountResponse],
+)
+async def get_option_counts(
+    exam_session: dict = Depends(verify_exam_session),
+    current_user: dict = Depends(verify_exam_author_by_session),
+):
+    option_counts = await counters.get_option_distribution(exam_session.id)
+    return option_counts
+
+
+@router.get(
+    "/session/{exam_session_id}/leaderboard/",
+    response_model=schemas.LeaderboardPage,
+)
+async def get_session_leaderboard(
+    limit: int = 50,
+    cursor: tuple = Depends(check_leaderboard_cursor),
+    exam_session: dict = Depends(verify_exam_session),
+    current_user: dict = Depends(verify_exam_author_by_session),
+):
+    after_score, after_id = cursor
+    page = await leaderboard.get_leaderboard(
+        leaderboard.SESSION, exam_session.id, limit, after_score, after_id
+    )
+    return page
+
+
+@router.get(
+    "/session/{exam_session_id}/leaderboard/user/{user_id}",
+    response_model=schemas.LeaderboardEntry,
+)
+async def get_session_user_rank(
+    user_id: int,
     exam_session: dict = Depends(verify_exam_session),
     current_user: dict = Depends(verify_exam_author_by_session),
 ):
-    initial_responses = await crud.list_responses_for_exam_session(
-        session_id=exam_session.id
+    entries = await leaderboard.get_user_ranks(
+        leaderboard.SESSION, exam_session.id, user_id
     )
-    for response in initial_responses:
-        await result.save_answer_scores_in_db(response)
-    for response in initial_responses:
-        await result.save_total_score_in_db(response)
+    if not entries:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Response not found",
+        )
+    return entries[0]
+
 
-    responses = await crud.list_responses_for_exam_session(session_id=exam_session.id)
+@router.get(
+    "/session/{exam_session_id}/item_analysis/",
+    response_model=schemas.ItemAnalysisReport,
+)
+async def get_item_analysis(
+    exam_session: dict = Depends(verify_exam_session),
+    current_user: dict = Depends(verify_exam_author_by_session),
+):
+    report = await analysis.get_item_analysis(exam_session)
+    return report
+
+
+@router.get(
+    "/session/{exam_session_id}/reliability/",
+    response_model=schemas.ReliabilityReport,
+)
+async def get_reliability(
+    exam_session: dict = Depends(verify_exam_session),
+    current_user: dict = Depends(verify_exam_author_by_session),
+):
+    report = await analysis.get_reliability(exam_session)
+    return report
 
-    return responses
+
+@router.post(
+    "/session/{exam_session_id}/rescore/",
+    response_model=schemas.RescoreReport,
+)
+async def rescore(
+    rescore_request: schemas.RescoreRequest,
+    exam_session: dict = Depends(verify_exam_session),
+    current_user: dict = Depends(verify_exam_author_by_session),
+):
+    report = await result.rescore_changes(
+        exam_session,
+        question_ids=rescore_request.questionIds,
+        option_ids=rescore_request.optionIds,
+        factor_impact_ids=rescore_request.factorImpactIds,
+    )
+    return report
+
+
+@router.post(
+    "/session/{exam_session_id}/scoring_jobs/",
+    response_model=schemas.ScoringJobResponse,
+)
+async def create_scoring_job(
+    scoring_job: schemas.ScoringJobCreate,
+    exam_session: dict = Depends(verify_exam_session),
+    current_user: dict = Depends(verify_exam_author_by_session),
+):
+    job = await jobs.enqueue_scoring_job(exam_session, mode=scoring_job.mode)
+    return job
+
+
+@router.get(
+    "/session/{exam_session_id}/scoring_jobs/{job_id}",
+    response_model=schemas.ScoringJobResponse,
+)
+async def get_scoring_job(
+    job_id: int,
+    exam_session: dict = Depends(verify_exam_session),
+    current_user: dict = Depends(verify_exam_author_by_session),
+):
+    job = await crud.get_scoring_job(job_id)
+    if not job or job.examSessionId != exam_session.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="ScoringJob not found",
+        )
+    return job
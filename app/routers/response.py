@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-from app import schemas, crud
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from prisma.errors import UniqueViolationError
+from typing import List, Optional
+from app import schemas, crud, result, norms, counters, answer_buffer
 from app.dependencies import (
     get_current_user,
     check_existing_response,
     check_user_access_to_response,
     verify_response,
+    verify_own_response,
     viewable_response,
     verify_exam_session,
     verify_exam_author_by_session,
@@ -84,20 +86,144 @@ async def list_responses(
     return responses
 
 
+def existing_answer(answer: dict, idempotency_key: Optional[str]):
+    # A retry with the key of the stored answer gets that answer back.
+    if idempotency_key is None or answer["idempotencyKey"] != idempotency_key:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Answer already exists",
+        )
+    return answer
+
+
 @router.post("/{exam_session_id}/add_answer", response_model=schemas.AnswerResponse)
 async def create_answer(
     answer: schemas.AnswerCreate,
+    idempotency_key: Optional[str] = Header(None),
+    exam_session: dict = Depends(verify_exam_session),
     response: dict = Depends(verify_response),
 ):
     answer_data = answer.dict()
-    existed_answer = await crud.get_answer(response["id"], answer_data["questionId"])
-    if existed_answer:
+    answer_data["idempotencyKey"] = idempotency_key
+
+    if answer_buffer.answer_buffer.enabled and not exam_session.exam.incrementalScoring:
+        # Buffered answers are acknowledged before Postgres sees them, so
+        # their references are checked up front.
+        if not await crud.count_valid_answer_references(
+            exam_session.examId, [answer_data]
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Question or option not in exam",
+            )
+
+        record, added = await answer_buffer.answer_buffer.add(
+            response["id"], answer_data
+        )
+        if not added:
+            return existing_answer(record, idempotency_key)
+        counters.option_counters.record(
+            exam_session.id, record["questionId"], record["optionId"]
+        )
+        return record
+
+    if exam_session.exam.incrementalScoring:
+        created_answer, inserted = await result.score_new_answer(
+            exam_session, response["id"], answer_data
+        )
+    else:
+        created_answer, inserted = await crud.upsert_answer(response["id"], answer_data)
+    if not inserted:
+        return existing_answer(created_answer, idempotency_key)
+
+    counters.option_counters.record(
+        exam_session.id, created_answer["questionId"], created_answer["optionId"]
+    )
+    return created_answer
+
+
+@router.post(
+    "/{exam_session_id}/add_answers", response_model=List[schemas.AnswerResponse]
+)
+async def create_answers(
+    answers: List[schemas.AnswerCreate],
+    exam_session: dict = Depends(verify_exam_session),
+    response: dict = Depends(verify_own_response),
+):
+    if len(answers) > crud.ANSWER_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {crud.ANSWER_BATCH_MAX_SIZE} answers per request",
+        )
+
+    answers_data = [answer.dict() for answer in answers]
+    question_ids = [answer_data["questionId"] for answer_data in answers_data]
+    if not question_ids:
+        return []
+
+    if len(set(question_ids)) != len(question_ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Duplicate answers for a question",
+        )
+
+    exam_question_ids = await crud.list_exam_question_ids(
+        exam_session.examId, question_ids
+    )
+    if len(exam_question_ids) != len(question_ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Question not in exam",
+        )
+
+    if answer_buffer.answer_buffer.enabled and not exam_session.exam.incrementalScoring:
+        if await crud.count_valid_answer_references(
+            exam_session.examId, answers_data
+        ) != len(answers_data):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Question or option not in exam",
+            )
+        records = await answer_buffer.answer_buffer.add_many(response.id, answers_data)
+        if records is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Answer already exists",
+            )
+        for record in records:
+            counters.option_counters.record(
+                exam_session.id, record["questionId"], record["optionId"]
+            )
+        return records
+
+    if await crud.list_answered_question_ids(response.id, question_ids) or any(
+        answer_buffer.answer_buffer.get_pending(response.id, question_id)
+        for question_id in question_ids
+    ):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Answer already exists",
         )
-    created_answer = await crud.create_answer(response["id"], answer_data)
-    return created_answer
+
+    try:
+        if exam_session.exam.incrementalScoring:
+            created_answers = await result.score_new_answers(
+                exam_session, response.id, answers_data
+            )
+        else:
+            created_answers = await crud.create_answers_bulk(response.id, answers_data)
+    except UniqueViolationError:
+        # A concurrent submission answered one of the questions first.
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Answer already exists",
+        )
+
+    for created_answer in created_answers:
+        counters.option_counters.record(
+            exam_session.id, created_answer.questionId, created_answer.optionId
+        )
+    return created_answers
 
 
 @router.get("/{exam_session_id}/answers", response_model=List[schemas.AnswerResponse])
@@ -123,6 +249,9 @@ async def get_user_response_with_score(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Response not found",
         )
+
+    session_norms = await norms.load_session_norms(exam_session.id)
+    norms.standardize_factor_values(response["factorValues"] or [], session_norms)
     return response
 
 
@@ -1,11 +1,11 @@
 from fastapi import APIRouter, Depends, status, HTTPException
 from typing import List
-from app import schemas, crud
+from app import schemas, crud, bundle
 from app.dependencies import (
     get_current_admin_user,
     verify_author,
     verify_question,
-    verify_survey,
+    verify_own_survey,
     verify_option,
     verify_impact,
     verify_static_option,
@@ -26,7 +26,7 @@ async def create_survey(
 
 @router.get("/{survey_id}", response_model=schemas.SurveyResponse)
 async def get_survey(
-    survey: dict = Depends(verify_survey), current_user: dict = Depends(verify_author)
+    survey: dict = Depends(verify_own_survey), current_user: dict = Depends(verify_author)
 ):
     return survey
 
@@ -40,7 +40,7 @@ async def list_surveys(current_user: dict = Depends(get_current_admin_user)):
 @router.put("/{survey_id}", response_model=schemas.SurveyResponse)
 async def update_survey(
     survey: schemas.SurveyUpdate,
-    existing_survey: dict = Depends(verify_survey),
+    existing_survey: dict = Depends(verify_own_survey),
     currnet_user: dict = Depends(verify_author),
 ):
     if existing_survey.isActive is True:
@@ -54,7 +54,7 @@ async def update_survey(
 
 @router.delete("/{survey_id}", response_model=schemas.SurveyResponse)
 async def delete_survey(
-    existing_survey: dict = Depends(verify_survey),
+    existing_survey: dict = Depends(verify_own_survey),
     currnet_user: dict = Depends(verify_author),
 ):
     if existing_survey.isActive is True:
@@ -69,10 +69,11 @@ async def delete_survey(
 @router.post("/{survey_id}/add_question", response_model=schemas.QuestionResponse)
 async def create_question(
     question: schemas.QuestionCreate,
-    survey=Depends(verify_survey),
+    survey=Depends(verify_own_survey),
     currnet_user: dict = Depends(verify_author),
 ):
     new_question = await crud.create_question(survey.id, question)
+    bundle.bundle_cache.invalidate_survey(survey.id)
     return new_question
 
 
@@ -87,7 +88,7 @@ async def get_question(question=Depends(verify_question)):
     "/{survey_id}/list_questions", response_model=List[schemas.QuestionResponse]
 )
 async def list_question(
-    survey=Depends(verify_survey),
+    survey=Depends(verify_own_survey),
     currnet_user: dict = Depends(verify_author),
 ):
     questions = await crud.list_survey_questions(survey.id)
@@ -103,13 +104,14 @@ async def update_question(
     question: schemas.QuestionUpdate,
     existing_question=Depends(verify_question),
 ):
-    existing_survey = await crud.get_survey_by_id(survey_id)
+    existing_survey = existing_question.survey
     if existing_survey.isActive is True:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Can not edit question after activation",
         )
     updated_question = await crud.update_question(existing_question.id, question)
+    bundle.bundle_cache.invalidate_survey(survey_id)
     return updated_question
 
 
@@ -121,13 +123,14 @@ async def delete_question(
     survey_id: int,
     question=Depends(verify_question),
 ):
-    existing_survey = await crud.get_survey_by_id(survey_id)
+    existing_survey = question.survey
     if existing_survey.isActive is True:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Can not delete question after activation",
         )
     deleted_question = await crud.delete_question(question.id)
+    bundle.bundle_cache.invalidate_survey(survey_id)
     return deleted_question
 
 
@@ -139,13 +142,14 @@ async def delete_option(
     survey_id: int,
     option=Depends(verify_option),
 ):
-    existing_survey = await crud.get_survey_by_id(survey_id)
+    existing_survey = option.question.survey
     if existing_survey.isActive is True:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Can not delete option after activation",
         )
     deleted_option = await crud.delete_option(option.id)
+    bundle.bundle_cache.invalidate_survey(survey_id)
     return deleted_option
 
 
@@ -157,7 +161,7 @@ async def delete_factor_impact(
     survey_id: int,
     impact=Depends(verify_impact),
 ):
-    existing_survey = await crud.get_survey_by_id(survey_id)
+    existing_survey = impact.option.question.survey
     if existing_survey.isActive is True:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -170,7 +174,7 @@ async def delete_factor_impact(
 @router.post("/{survey_id}/factor/", response_model=schemas.FactorResponse)
 async def create_factor(
     factor: schemas.FactorCreate,
-    survey: dict = Depends(verify_survey),
+    survey: dict = Depends(verify_own_survey),
     current_user: dict = Depends(verify_author),
 ):
     created_factor = await crud.create_factor(factor, survey.id)
@@ -180,7 +184,7 @@ async def create_factor(
 @router.get("/{survey_id}/factor/{factor_id}", response_model=schemas.FactorResponse)
 async def get_factor(
     factor_id: int,
-    survey: dict = Depends(verify_survey),
+    survey: dict = Depends(verify_own_survey),
     current_user: dict = Depends(verify_author),
 ):
     factor = await crud.get_factor_by_id(factor_id)
@@ -189,7 +193,7 @@ async def get_factor(
 
 @router.get("/{survey_id}/factors/", response_model=List[schemas.FactorResponse])
 async def list_factor(
-    survey: dict = Depends(verify_survey),
+    survey: dict = Depends(verify_own_survey),
     current_user: dict = Depends(verify_author),
 ):
     factors = await crud.list_survey_factors(survey.id)
@@ -200,7 +204,7 @@ async def list_factor(
 async def update_factor(
     factor_id: int,
     factor: schemas.FactorUpdate,
-    survey: dict = Depends(verify_survey),
+    survey: dict = Depends(verify_own_survey),
     current_user: dict = Depends(verify_author),
 ):
     if survey.isActive is True:
@@ -215,7 +219,7 @@ async def update_factor(
 @router.delete("/{survey_id}/factor/{factor_id}", response_model=schemas.FactorResponse)
 async def delete_factor(
     factor_id: int,
-    survey: dict = Depends(verify_survey),
+    survey: dict = Depends(verify_own_survey),
     current_user: dict = Depends(verify_author),
 ):
     if survey.isActive is True:
@@ -230,7 +234,7 @@ async def delete_factor(
 @router.post("/{survey_id}/parameter/", response_model=schemas.ParameterResponse)
 async def create_parameter(
     parameter: schemas.ParameterCreate,
-    survey: dict = Depends(verify_survey),
+    survey: dict = Depends(verify_own_survey),
     current_user: dict = Depends(verify_author),
 ):
     created_parameter = await crud.create_parameter(parameter, survey.id)
@@ -243,7 +247,7 @@ async def create_parameter(
 )
 async def get_parameter(
     parameter_id: int,
-    survey: dict = Depends(verify_survey),
+    survey: dict = Depends(verify_own_survey),
     current_user: dict = Depends(verify_author),
 ):
     parameter = await crud.get_parameter_by_id(parameter_id)
@@ -252,7 +256,7 @@ async def get_parameter(
 
 @router.get("/{survey_id}/parameter/", response_model=List[schemas.ParameterResponse])
 async def list_parameter(
-    survey: dict = Depends(verify_survey),
+    survey: dict = Depends(verify_own_survey),
     current_user: dict = Depends(verify_author),
 ):
     parameters = await crud.list_survey_parameters(survey.id)
@@ -266,7 +270,7 @@ async def list_parameter(
 async def update_parameter(
     parameter_id: int,
     parameter: schemas.ParameterUpdate,
-    survey: dict = Depends(verify_survey),
+    survey: dict = Depends(verify_own_survey),
     current_user: dict = Depends(verify_author),
 ):
     if survey.isActive is True:
@@ -284,7 +288,7 @@ async def update_parameter(
 )
 async def delete_parameter(
     parameter_id: int,
-    survey: dict = Depends(verify_survey),
+    survey: dict = Depends(verify_own_survey),
     current_user: dict = Depends(verify_author),
 ):
     if survey.isActive is True:
@@ -301,7 +305,7 @@ async def delete_parameter(
 )
 async def create_static_option(
     static_option: schemas.StaticOptionCreate,
-    survey=Depends(verify_survey),
+    survey=Depends(verify_own_survey),
     currnet_user: dict = Depends(verify_author),
 ):
     new_static_option = await crud.create_static_option(survey.id, static_option)
@@ -321,7 +325,7 @@ async def get_static_option(static_option=Depends(verify_static_option)):
     response_model=List[schemas.StaticOptionResponse],
 )
 async def list_static_option(
-    survey=Depends(verify_survey),
+    survey=Depends(verify_own_survey),
     currnet_user: dict = Depends(verify_author),
 ):
     static_options = await crud.list_static_options(survey.id)
@@ -337,7 +341,7 @@ async def update_static_option(
     static_option: schemas.StaticOptionUpdate,
     existing_static_option=Depends(verify_static_option),
 ):
-    existing_survey = await crud.get_survey_by_id(survey_id)
+    existing_survey = existing_static_option.survey
     if existing_survey.isActive is True:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -357,7 +361,7 @@ async def delete_static_option(
     survey_id: int,
     static_option=Depends(verify_static_option),
 ):
-    existing_survey = await crud.get_survey_by_id(survey_id)
+    existing_survey = static_option.survey
     if existing_survey.isActive is True:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -375,7 +379,7 @@ async def delete_static_factor_impact(
     survey_id: int,
     static_impact=Depends(verify_static_impact),
 ):
-    existing_survey = await crud.get_survey_by_id(survey_id)
+    existing_survey = static_impact.staticOption.survey
     if existing_survey.isActive is True:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -1,7 +1,8 @@
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from app import schemas, crud, auth, dependencies
+from datetime import datetime, timezone
+from app import schemas, crud, auth, dependencies, principals, revocation
 
 
 router = APIRouter()
@@ -20,7 +21,7 @@ async def register(user: schemas.UserCreate):
 @router.post("/login", response_model=schemas.TokenResponse)
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     user = await crud.get_user_by_email_or_username(form_data.username)
-    if not user or not auth.verify_password(form_data.password, user.password):
+    if not user or not await auth.verify_password(form_data.password, user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username/email or password",
@@ -30,6 +31,20 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     return {"message": "Login successful", "access_token": access_token, "token_type": "bearer", "role": user.role}
 
 
+@router.post("/logout")
+async def logout(
+    token: str = Depends(auth.oauth2_scheme),
+    current_user: dict = Depends(dependencies.get_current_user),
+):
+    payload = auth.decode_access_token(token)
+    await revocation.revocation_list.revoke(
+        auth.get_token_id(token, payload),
+        current_user.id,
+        datetime.fromtimestamp(payload["exp"], tz=timezone.utc),
+    )
+    return {"message": "Logout successful"}
+
+
 @router.get("/me", response_model=schemas.UserResponse)
 async def get_current_user_profile(current_user: dict = Depends(dependencies.get_current_user)):
     return current_user
@@ -38,6 +53,7 @@ async def get_current_user_profile(current_user: dict = Depends(dependencies.get
 @router.put("/me", response_model=schemas.UserResponse)
 async def update_user(user: schemas.UserUpdate, current_user: dict = Depends(dependencies.get_current_user)):
     updated_user = await crud.update_user(current_user.id, user)
+    principals.principal_cache.invalidate(current_user.email)
     return updated_user
 
 
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 from enum import Enum
 
@@ -155,11 +155,25 @@ class FactorValueCreate(FactorValueBase):
 
 class FactorValueResponse(FactorValueBase):
     id: int
+    zScore: Optional[float] = None
+    percentile: Optional[float] = None
 
     class Config:
         orm_mode: True    
 
 
+"""
+Factor Norm
+"""
+
+
+class FactorNormResponse(BaseModel):
+    factorId: int
+    count: int
+    mean: float
+    std: float
+
+
 """
 Parameter
 """
@@ -186,6 +200,24 @@ class ParameterResponse(ParameterBase):
         orm_mode: True
 
 
+"""
+Parameter Value
+"""
+
+
+class ParameterValueBase(BaseModel):
+    parameterId: int
+    responseId: int
+    value: float = 0
+
+
+class ParameterValueResponse(ParameterValueBase):
+    id: int
+
+    class Config:
+        orm_mode: True
+
+
 """
 Option
 """
@@ -343,6 +375,7 @@ Answer
 class AnswerCreate(BaseModel):
     questionId: int
     optionId: Optional[int] = None
+    staticOptionId: Optional[int] = None
     answerText: Optional[str] = None
 
 
@@ -352,18 +385,56 @@ class AnswerResponse(BaseModel):
     questionId: int
     creationDate: datetime
     optionId: Optional[int] = None
+    staticOptionId: Optional[int] = None
     answerText: Optional[str] = None
 
     class Config:
         orm_mode: True
 
 
+class AnswerBufferMetrics(BaseModel):
+    enabled: bool
+    pending: int
+    lagSeconds: float
+    flushedTotal: int
+    deadLettered: int
+    conflicts: int
+    lastFlushSeconds: float
+    flushIntervalMs: int
+    flushBatchSize: int
+
+
+class PasswordOperationMetrics(BaseModel):
+    count: int
+    p50Seconds: float
+    p95Seconds: float
+    maxSeconds: float
+
+
+class PasswordPoolMetrics(BaseModel):
+    workers: int
+    maxPending: int
+    pending: int
+    rejected: int
+    operations: Dict[str, PasswordOperationMetrics]
+
+
+class PrincipalCacheMetrics(BaseModel):
+    size: int
+    hits: int
+    misses: int
+    invalidations: int
+    ttlSeconds: float
+    listening: bool
+
+
 class AnswerResponseWithScore(BaseModel):
     id: int
     responseId: int
     questionId: int
     creationDate: datetime
     optionId: Optional[int] = None
+    staticOptionId: Optional[int] = None
     answerText: Optional[str] = None
     score: Optional[float] = None
 
@@ -429,12 +500,157 @@ class ResponseWithScore(ResponseBase):
     answers: List[AnswerResponseWithScore]
     totalScore: Optional[float] = None
     factorValues: Optional[List[FactorValueResponse]] = None
+    parameterValues: Optional[List[ParameterValueResponse]] = None
     lastAnswer: Optional[AnswerResponse] = None
 
     class Config:
         orm_mode: True
 
 
+class ScoringMode(str, Enum):
+    BATCH = "BATCH"
+    VECTORIZED = "VECTORIZED"
+    FINALIZE = "FINALIZE"
+    PARALLEL = "PARALLEL"
+    SQL = "SQL"
+
+
+class ScoringSummary(BaseModel):
+    examSessionId: int
+    mode: ScoringMode
+    responseCount: int
+    scoresVersion: int
+
+
+class RescoreRequest(BaseModel):
+    questionIds: List[int] = []
+    optionIds: List[int] = []
+    factorImpactIds: List[int] = []
+
+
+class FactorValueChange(BaseModel):
+    factorId: int
+    oldValue: Optional[float] = None
+    newValue: float
+
+
+class ResponseScoreChange(BaseModel):
+    responseId: int
+    userId: int
+    oldTotalScore: Optional[float] = None
+    newTotalScore: Optional[float] = None
+    changedAnswers: int = 0
+    factorValues: List[FactorValueChange] = []
+
+
+class RescoreReport(BaseModel):
+    examSessionId: int
+    answersChecked: int
+    responsesChanged: int
+    changes: List[ResponseScoreChange]
+
+
+class LeaderboardEntry(BaseModel):
+    responseId: int
+    userId: int
+    examSessionId: int
+    totalScore: float
+    rank: int
+    percentRank: float
+
+
+class LeaderboardPage(BaseModel):
+    entries: List[LeaderboardEntry]
+    nextAfterScore: Optional[float] = None
+    nextAfterId: Optional[int] = None
+
+
+class OptionCountResponse(BaseModel):
+    questionId: int
+    optionId: int
+    count: int
+
+
+"""
+ScoringJob
+"""
+
+
+class JobStatus(str, Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+
+class ScoringJobCreate(BaseModel):
+    mode: Optional[ScoringMode] = None
+
+
+class ScoringJobResponse(BaseModel):
+    id: int
+    examSessionId: int
+    mode: ScoringMode
+    status: JobStatus
+    total: int
+    processed: int
+    error: Optional[str] = None
+    creationDate: datetime
+    updateDate: datetime
+
+    class Config:
+        orm_mode: True
+
+
+"""
+Analysis
+"""
+
+
+class DistractorCount(BaseModel):
+    optionId: int
+    order: int
+    correct: bool
+    count: int
+    upperCount: int
+    lowerCount: int
+
+
+class ItemStatistics(BaseModel):
+    questionId: int
+    answered: int
+    difficulty: float
+    discrimination: float
+    pointBiserial: Optional[float] = None
+    options: List[DistractorCount]
+
+
+class ItemAnalysisReport(BaseModel):
+    examSessionId: int
+    responseCount: int
+    items: List[ItemStatistics]
+
+
+class ItemTotalCorrelation(BaseModel):
+    questionId: int
+    correlation: Optional[float] = None
+
+
+class ScaleReliability(BaseModel):
+    factorId: Optional[int] = None
+    parameterId: Optional[int] = None
+    respondents: int
+    items: int
+    alpha: Optional[float] = None
+    itemTotal: List[ItemTotalCorrelation]
+
+
+class ReliabilityReport(BaseModel):
+    examSessionId: int
+    factors: List[ScaleReliability]
+    parameters: List[ScaleReliability]
+
+
 """
 ExamSurvey
 """
@@ -475,6 +691,7 @@ class ExamBase(BaseModel):
     isPublic: bool = True
     isActive: bool = False
     viewableByAuthorOnly: bool = False
+    incrementalScoring: bool = False
 
 
 class ExamCreate(ExamBase):
@@ -487,6 +704,7 @@ class ExamUpdate(ExamBase):
     isPublic: Optional[bool] = None
     isActive: Optional[bool] = None
     viewableByAuthorOnly: Optional[bool] = None
+    incrementalScoring: Optional[bool] = None
     examSurveys: Optional[List[ExamSurveyUpdate]] = None
 
 
@@ -0,0 +1,237 @@
+import os
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from app import schemas, crud
+
+
+SCORING_PLAN_CACHE_SIZE = int(os.getenv("SCORING_PLAN_CACHE_SIZE", "128"))
+
+
+@dataclass
+class AnswerKey:
+    question_surveys: Dict[int, int] = field(default_factory=dict)
+    question_types: Dict[int, str] = field(default_factory=dict)
+    correct_options: Dict[int, Optional[int]] = field(default_factory=dict)
+    points: Dict[int, Optional[float]] = field(default_factory=dict)
+    option_orders: Dict[int, int] = field(default_factory=dict)
+    option_impacts: Dict[int, List[Tuple[int, int]]] = field(default_factory=dict)
+    survey_factors: Dict[int, List[int]] = field(default_factory=dict)
+    factor_parameters: Dict[int, int] = field(default_factory=dict)
+    static_option_surveys: Dict[int, int] = field(default_factory=dict)
+    static_option_impacts: Dict[int, List[Tuple[int, int]]] = field(
+        default_factory=dict
+    )
+
+
+@dataclass
+class ScoringPlan:
+    survey_id: int
+    version: int
+    key: AnswerKey
+    # Per-option arrays, aligned with the sorted option_ids.
+    option_ids: np.ndarray
+    option_questions: np.ndarray
+    option_correct: np.ndarray
+    option_points: np.ndarray
+    # Signed factor deltas of every option in CSR form.
+    impact_indptr: np.ndarray
+    impact_factors: np.ndarray
+    impact_values: np.ndarray
+    # Shared scale of the survey: static option x factor signed impacts.
+    static_option_ids: np.ndarray
+    static_factor_ids: np.ndarray
+    static_impacts: np.ndarray
+
+    def option_positions(self, option_ids) -> np.ndarray:
+        option_ids = np.asarray(option_ids, dtype=np.int64)
+        if len(self.option_ids) == 0:
+            return np.full(len(option_ids), -1, dtype=np.int64)
+        positions = np.searchsorted(self.option_ids, option_ids)
+        positions[positions >= len(self.option_ids)] = 0
+        return np.where(self.option_ids[positions] == option_ids, positions, -1)
+
+
+def build_answer_key(questions, factors, static_options=()) -> AnswerKey:
+    key = AnswerKey()
+
+    for factor in factors:
+        key.survey_factors.setdefault(factor.surveyId, []).append(factor.id)
+        if factor.parameterId is not None:
+            key.factor_parameters[factor.id] = factor.parameterId
+
+    for question in questions:
+        key.question_surveys[question.id] = question.surveyId
+        key.question_types[question.id] = question.questionType
+        key.correct_options[question.id] = question.correctOption
+        key.points[question.id] = question.point
+
+        for option in question.options or []:
+            key.option_orders[option.id] = option.order
+            key.option_impacts[option.id] = [
+                (
+                    factor_impact.factorId,
+                    factor_impact.impact if factor_impact.plus else -factor_impact.impact,
+                )
+                for factor_impact in option.factorImpacts or []
+            ]
+
+    for static_option in static_options:
+        key.static_option_surveys[static_option.id] = static_option.surveyId
+        key.static_option_impacts[static_option.id] = [
+            (
+                static_impact.factorId,
+                static_impact.impact if static_impact.plus else -static_impact.impact,
+            )
+            for static_impact in static_option.staticFactorImpacts or []
+        ]
+
+    return key
+
+
+def merge_answer_keys(keys: List[AnswerKey]) -> AnswerKey:
+    merged = AnswerKey()
+    for key in keys:
+        merged.question_surveys.update(key.question_surveys)
+        merged.question_types.update(key.question_types)
+        merged.correct_options.update(key.correct_options)
+        merged.points.update(key.points)
+        merged.option_orders.update(key.option_orders)
+        merged.option_impacts.update(key.option_impacts)
+        merged.survey_factors.update(key.survey_factors)
+        merged.factor_parameters.update(key.factor_parameters)
+        merged.static_option_surveys.update(key.static_option_surveys)
+        merged.static_option_impacts.update(key.static_option_impacts)
+    return merged
+
+
+def compile_scoring_plan(
+    survey_id: int, version: int, questions, factors, static_options=()
+) -> ScoringPlan:
+    key = build_answer_key(questions, factors, static_options)
+    key.survey_factors.setdefault(survey_id, [])
+
+    option_ids = np.array(sorted(key.option_orders), dtype=np.int64)
+    option_questions = np.zeros(len(option_ids), dtype=np.int64)
+    option_correct = np.zeros(len(option_ids), dtype=bool)
+    option_points = np.zeros(len(option_ids), dtype=np.float64)
+    impact_indptr = [0]
+    impact_factors = []
+    impact_values = []
+
+    option_question_ids = {
+        option.id: question.id
+        for question in questions
+        for option in question.options or []
+    }
+
+    for position, option_id in enumerate(option_ids.tolist()):
+        question_id = option_question_ids[option_id]
+        option_questions[position] = question_id
+
+        if (
+            key.question_types[question_id] == schemas.QuestionType.MULTIPLE_CHOICE
+            and key.correct_options[question_id] == key.option_orders[option_id]
+        ):
+            option_correct[position] = True
+            option_points[position] = key.points[question_id] or 0
+
+        if key.question_types[question_id] == schemas.QuestionType.PSYCHOLOGY:
+            for factor_id, impact in key.option_impacts[option_id]:
+                impact_factors.append(factor_id)
+                impact_values.append(impact)
+        impact_indptr.append(len(impact_factors))
+
+    static_option_ids = np.array(sorted(key.static_option_impacts), dtype=np.int64)
+    static_factor_ids = list(key.survey_factors[survey_id])
+    for static_option_id in static_option_ids.tolist():
+        for factor_id, _ in key.static_option_impacts[static_option_id]:
+            if factor_id not in static_factor_ids:
+                static_factor_ids.append(factor_id)
+    static_columns = {factor_id: i for i, factor_id in enumerate(static_factor_ids)}
+
+    static_impacts = np.zeros(
+        (len(static_option_ids), len(static_factor_ids)), dtype=np.int64
+    )
+    for row, static_option_id in enumerate(static_option_ids.tolist()):
+        for factor_id, impact in key.static_option_impacts[static_option_id]:
+            static_impacts[row, static_columns[factor_id]] += impact
+
+    return ScoringPlan(
+        survey_id=survey_id,
+        version=version,
+        key=key,
+        option_ids=option_ids,
+        option_questions=option_questions,
+        option_correct=option_correct,
+        option_points=option_points,
+        impact_indptr=np.array(impact_indptr, dtype=np.int64),
+        impact_factors=np.array(impact_factors, dtype=np.int64),
+        impact_values=np.array(impact_values, dtype=np.int64),
+        static_option_ids=static_option_ids,
+        static_factor_ids=np.array(static_factor_ids, dtype=np.int64),
+        static_impacts=static_impacts,
+    )
+
+
+class ScoringPlanCache:
+    def __init__(self, maxsize: int = SCORING_PLAN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._plans = OrderedDict()
+
+    def get(self, survey_id: int, version: int) -> Optional[ScoringPlan]:
+        plan = self._plans.get((survey_id, version))
+        if plan is not None:
+            self._plans.move_to_end((survey_id, version))
+        return plan
+
+    def put(self, plan: ScoringPlan):
+        self._plans[(plan.survey_id, plan.version)] = plan
+        self._plans.move_to_end((plan.survey_id, plan.version))
+        while len(self._plans) > self.maxsize:
+            self._plans.popitem(last=False)
+
+
+plan_cache = ScoringPlanCache()
+
+
+async def get_scoring_plans(survey_ids: List[int]) -> List[ScoringPlan]:
+    surveys = await crud.list_surveys_by_ids(survey_ids=survey_ids)
+
+    plans = {}
+    stale = {}
+    for survey in surveys:
+        plan = plan_cache.get(survey.id, survey.scoringVersion)
+        if plan is None:
+            stale[survey.id] = survey.scoringVersion
+        else:
+            plans[survey.id] = plan
+
+    if stale:
+        questions = await crud.list_questions_for_surveys(survey_ids=list(stale))
+        factors = await crud.list_factors_for_surveys(survey_ids=list(stale))
+        static_options = await crud.list_static_options_for_surveys(
+            survey_ids=list(stale)
+        )
+        for survey_id, version in stale.items():
+            plan = compile_scoring_plan(
+                survey_id,
+                version,
+                [question for question in questions if question.surveyId == survey_id],
+                [factor for factor in factors if factor.surveyId == survey_id],
+                [
+                    static_option
+                    for static_option in static_options
+                    if static_option.surveyId == survey_id
+                ],
+            )
+            plan_cache.put(plan)
+            plans[survey_id] = plan
+
+    return [plans[survey_id] for survey_id in survey_ids if survey_id in plans]
+
+
+async def get_scoring_plan(survey_id: int) -> Optional[ScoringPlan]:
+    plans = await get_scoring_plans([survey_id])
+    return plans[0] if plans else None
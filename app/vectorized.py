@@ -0,0 +1,160 @@
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, List
+from app import schemas
+
+
+@dataclass
+class ImpactMatrix:
+    # Signed FactorImpact values of every option in CSR form (option x factor).
+    option_index: Dict[int, int]
+    survey_index: Dict[int, int]
+    factor_ids: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    data: np.ndarray
+    # survey x factor membership, used to decide which FactorValue rows exist.
+    survey_factors: np.ndarray
+    # Dense static option x factor lookup shared by all questions of a survey.
+    static_option_index: Dict[int, int]
+    static_impacts: np.ndarray
+
+
+def build_impact_matrix(plans) -> ImpactMatrix:
+    # Stacks the per-survey CSR impact arrays of the scoring plans into one
+    # block matrix for the whole exam.
+    factor_ids: List[int] = []
+    factor_index: Dict[int, int] = {}
+
+    def column(factor_id):
+        if factor_id not in factor_index:
+            factor_index[factor_id] = len(factor_ids)
+            factor_ids.append(factor_id)
+        return factor_index[factor_id]
+
+    survey_index = {plan.survey_id: i for i, plan in enumerate(plans)}
+    for plan in plans:
+        for factor_id in plan.key.survey_factors[plan.survey_id]:
+            column(factor_id)
+
+    option_index = {}
+    indptr = [np.zeros(1, dtype=np.int64)]
+    indices = []
+    data = []
+    offset = 0
+    for plan in plans:
+        for option_id in plan.option_ids.tolist():
+            option_index[option_id] = len(option_index)
+        indptr.append(plan.impact_indptr[1:] + offset)
+        indices.append(
+            np.array(
+                [column(factor_id) for factor_id in plan.impact_factors.tolist()],
+                dtype=np.int64,
+            )
+        )
+        data.append(plan.impact_values)
+        offset += len(plan.impact_values)
+
+    static_option_index = {}
+    static_rows = []
+    for plan in plans:
+        columns = [column(factor_id) for factor_id in plan.static_factor_ids.tolist()]
+        for row, static_option_id in enumerate(plan.static_option_ids.tolist()):
+            static_option_index[static_option_id] = len(static_option_index)
+            static_rows.append((columns, plan.static_impacts[row]))
+
+    static_impacts = np.zeros((len(static_rows), len(factor_ids)), dtype=np.int64)
+    for row, (columns, impacts) in enumerate(static_rows):
+        static_impacts[row, columns] = impacts
+
+    survey_factors = np.zeros((len(survey_index), len(factor_ids)), dtype=bool)
+    for plan in plans:
+        for factor_id in plan.key.survey_factors[plan.survey_id]:
+            survey_factors[survey_index[plan.survey_id], factor_index[factor_id]] = True
+
+    return ImpactMatrix(
+        option_index=option_index,
+        survey_index=survey_index,
+        factor_ids=np.array(factor_ids, dtype=np.int64),
+        indptr=np.concatenate(indptr),
+        indices=np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64),
+        data=np.concatenate(data) if data else np.zeros(0, dtype=np.int64),
+        survey_factors=survey_factors,
+        static_option_index=static_option_index,
+        static_impacts=static_impacts,
+    )
+
+
+def score_factor_values(responses, key, matrix: ImpactMatrix):
+    n_responses = len(responses)
+    n_factors = len(matrix.factor_ids)
+
+    touched = np.zeros((n_responses, len(matrix.survey_index)), dtype=bool)
+    selected_rows = []
+    selected_options = []
+    static_rows = []
+    static_options = []
+
+    for row, response in enumerate(responses):
+        for answer in response.answers:
+            survey_id = key.question_surveys.get(answer.questionId)
+            if survey_id is None:
+                continue
+            if survey_id in matrix.survey_index:
+                touched[row, matrix.survey_index[survey_id]] = True
+            if key.question_types[answer.questionId] != schemas.QuestionType.PSYCHOLOGY:
+                continue
+            option = matrix.option_index.get(answer.optionId)
+            if option is not None:
+                selected_rows.append(row)
+                selected_options.append(option)
+            static_option = matrix.static_option_index.get(answer.staticOptionId)
+            if (
+                static_option is not None
+                and key.static_option_surveys[answer.staticOptionId] == survey_id
+            ):
+                static_rows.append(row)
+                static_options.append(static_option)
+
+    selected_rows = np.array(selected_rows, dtype=np.int64)
+    selected_options = np.array(selected_options, dtype=np.int64)
+
+    # Sparse (response x option) selection times sparse (option x factor)
+    # impacts: expand every selection into the CSR row of its option and
+    # reduce the (response, factor) pairs with a single bincount.
+    starts = matrix.indptr[selected_options]
+    counts = matrix.indptr[selected_options + 1] - starts
+    offsets = np.cumsum(counts) - counts
+    positions = (
+        np.arange(counts.sum(), dtype=np.int64)
+        - np.repeat(offsets, counts)
+        + np.repeat(starts, counts)
+    )
+    cells = np.repeat(selected_rows, counts) * n_factors + matrix.indices[positions]
+
+    size = n_responses * n_factors
+    values = np.rint(
+        np.bincount(cells, weights=matrix.data[positions], minlength=size)
+    ).astype(np.int64)
+    hits = np.bincount(cells, minlength=size) > 0
+
+    values = values.reshape(n_responses, n_factors)
+    present = (touched @ matrix.survey_factors) | hits.reshape(n_responses, n_factors)
+
+    # Static options use the dense lookup: count how often each response
+    # picked each static option and multiply by the static impact table.
+    if static_rows:
+        static_counts = np.zeros(
+            (n_responses, len(matrix.static_option_index)), dtype=np.int64
+        )
+        np.add.at(static_counts, (static_rows, static_options), 1)
+        values += static_counts @ matrix.static_impacts
+        present |= (static_counts @ (matrix.static_impacts != 0)) > 0
+
+    factor_values = {}
+    for row, response in enumerate(responses):
+        columns = np.flatnonzero(present[row])
+        factor_values[response.id] = dict(
+            zip(matrix.factor_ids[columns].tolist(), values[row, columns].tolist())
+        )
+    return factor_values
@@ -0,0 +1,2 @@
+-- AlterTable
+ALTER TABLE "Exam" ADD COLUMN     "incrementalScoring" BOOLEAN NOT NULL DEFAULT false;
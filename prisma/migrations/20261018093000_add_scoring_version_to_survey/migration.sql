@@ -0,0 +1,2 @@
+-- AlterTable
+ALTER TABLE "Survey" ADD COLUMN     "scoringVersion" INTEGER NOT NULL DEFAULT 0;
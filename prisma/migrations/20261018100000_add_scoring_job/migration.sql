@@ -0,0 +1,25 @@
+-- CreateEnum
+CREATE TYPE "JobStatus" AS ENUM ('QUEUED', 'RUNNING', 'DONE', 'FAILED');
+
+-- CreateTable
+CREATE TABLE "ScoringJob" (
+    "id" SERIAL NOT NULL,
+    "examSessionId" INTEGER NOT NULL,
+    "mode" TEXT NOT NULL,
+    "status" "JobStatus" NOT NULL DEFAULT 'QUEUED',
+    "total" INTEGER NOT NULL DEFAULT 0,
+    "processed" INTEGER NOT NULL DEFAULT 0,
+    "lastResponseId" INTEGER NOT NULL DEFAULT 0,
+    "error" TEXT,
+    "leaseExpiresAt" TIMESTAMP(3),
+    "creationDate" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updateDate" TIMESTAMP(3) NOT NULL,
+
+    CONSTRAINT "ScoringJob_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE INDEX "ScoringJob_examSessionId_status_idx" ON "ScoringJob"("examSessionId", "status");
+
+-- AddForeignKey
+ALTER TABLE "ScoringJob" ADD CONSTRAINT "ScoringJob_examSessionId_fkey" FOREIGN KEY ("examSessionId") REFERENCES "ExamSession"("id") ON DELETE CASCADE ON UPDATE CASCADE;
@@ -0,0 +1,5 @@
+-- CreateIndex
+CREATE INDEX "Answer_questionId_idx" ON "Answer"("questionId");
+
+-- CreateIndex
+CREATE INDEX "Answer_optionId_idx" ON "Answer"("optionId");
@@ -0,0 +1,9 @@
+-- Remove duplicate FactorValue rows, keeping the oldest one
+DELETE FROM "FactorValue" AS a
+USING "FactorValue" AS b
+WHERE a."factorId" = b."factorId"
+  AND a."responseId" = b."responseId"
+  AND a."id" > b."id";
+
+-- CreateIndex
+CREATE UNIQUE INDEX "FactorValue_factorId_responseId_key" ON "FactorValue"("factorId", "responseId");
@@ -0,0 +1,8 @@
+-- AlterTable
+ALTER TABLE "Answer" ADD COLUMN     "staticOptionId" INTEGER;
+
+-- CreateIndex
+CREATE INDEX "Answer_staticOptionId_idx" ON "Answer"("staticOptionId");
+
+-- AddForeignKey
+ALTER TABLE "Answer" ADD CONSTRAINT "Answer_staticOptionId_fkey" FOREIGN KEY ("staticOptionId") REFERENCES "StaticOption"("id") ON DELETE CASCADE ON UPDATE CASCADE;
@@ -0,0 +1,26 @@
+-- CreateTable
+CREATE TABLE "ParameterValue" (
+    "id" SERIAL NOT NULL,
+    "parameterId" INTEGER NOT NULL,
+    "responseId" INTEGER NOT NULL,
+    "value" INTEGER NOT NULL,
+
+    CONSTRAINT "ParameterValue_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE UNIQUE INDEX "ParameterValue_responseId_parameterId_key" ON "ParameterValue"("responseId", "parameterId");
+
+-- AddForeignKey
+ALTER TABLE "ParameterValue" ADD CONSTRAINT "ParameterValue_parameterId_fkey" FOREIGN KEY ("parameterId") REFERENCES "Parameter"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "ParameterValue" ADD CONSTRAINT "ParameterValue_responseId_fkey" FOREIGN KEY ("responseId") REFERENCES "Response"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- Backfill the rollups of the responses that are already scored
+INSERT INTO "ParameterValue" ("parameterId", "responseId", "value")
+SELECT f."parameterId", fv."responseId", SUM(fv."value")::integer
+FROM "FactorValue" AS fv
+JOIN "Factor" AS f ON f."id" = fv."factorId"
+WHERE f."parameterId" IS NOT NULL
+GROUP BY f."parameterId", fv."responseId";
@@ -0,0 +1,23 @@
+-- CreateTable
+CREATE TABLE "FactorNorm" (
+    "id" SERIAL NOT NULL,
+    "examSessionId" INTEGER NOT NULL,
+    "factorId" INTEGER NOT NULL,
+    "count" INTEGER NOT NULL DEFAULT 0,
+    "mean" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "m2" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "sketchValues" DOUBLE PRECISION[],
+    "sketchCounts" INTEGER[],
+    "updateDate" TIMESTAMP(3) NOT NULL,
+
+    CONSTRAINT "FactorNorm_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE UNIQUE INDEX "FactorNorm_examSessionId_factorId_key" ON "FactorNorm"("examSessionId", "factorId");
+
+-- AddForeignKey
+ALTER TABLE "FactorNorm" ADD CONSTRAINT "FactorNorm_examSessionId_fkey" FOREIGN KEY ("examSessionId") REFERENCES "ExamSession"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "FactorNorm" ADD CONSTRAINT "FactorNorm_factorId_fkey" FOREIGN KEY ("factorId") REFERENCES "Factor"("id") ON DELETE CASCADE ON UPDATE CASCADE;
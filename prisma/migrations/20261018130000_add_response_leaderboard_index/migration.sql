@@ -0,0 +1,2 @@
+-- CreateIndex
+CREATE INDEX "Response_examSessionId_totalScore_id_idx" ON "Response"("examSessionId", "totalScore" DESC, "id" DESC);
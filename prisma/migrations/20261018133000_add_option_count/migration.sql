@@ -0,0 +1,27 @@
+-- CreateTable
+CREATE TABLE "OptionCount" (
+    "id" SERIAL NOT NULL,
+    "examSessionId" INTEGER NOT NULL,
+    "questionId" INTEGER NOT NULL,
+    "optionId" INTEGER NOT NULL,
+    "count" INTEGER NOT NULL DEFAULT 0,
+
+    CONSTRAINT "OptionCount_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE UNIQUE INDEX "OptionCount_examSessionId_optionId_key" ON "OptionCount"("examSessionId", "optionId");
+
+-- AddForeignKey
+ALTER TABLE "OptionCount" ADD CONSTRAINT "OptionCount_examSessionId_fkey" FOREIGN KEY ("examSessionId") REFERENCES "ExamSession"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "OptionCount" ADD CONSTRAINT "OptionCount_optionId_fkey" FOREIGN KEY ("optionId") REFERENCES "Option"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- Backfill the counters from the answers given so far
+INSERT INTO "OptionCount" ("examSessionId", "questionId", "optionId", "count")
+SELECT r."examSessionId", o."questionId", o."id", COUNT(*)::integer
+FROM "Answer" AS a
+JOIN "Response" AS r ON r."id" = a."responseId"
+JOIN "Option" AS o ON o."id" = a."optionId"
+GROUP BY r."examSessionId", o."questionId", o."id";
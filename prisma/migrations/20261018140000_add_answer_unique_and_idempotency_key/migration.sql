@@ -0,0 +1,12 @@
+-- Remove duplicate answers to the same question, keeping the first one
+DELETE FROM "Answer" AS a
+USING "Answer" AS b
+WHERE a."responseId" = b."responseId"
+  AND a."questionId" = b."questionId"
+  AND a."id" > b."id";
+
+-- AlterTable
+ALTER TABLE "Answer" ADD COLUMN "idempotencyKey" TEXT;
+
+-- CreateIndex
+CREATE UNIQUE INDEX "Answer_responseId_questionId_key" ON "Answer"("responseId", "questionId");
@@ -0,0 +1,22 @@
+-- CreateTable
+CREATE TABLE "RevokedToken" (
+    "id" SERIAL NOT NULL,
+    "tokenId" TEXT NOT NULL,
+    "userId" INTEGER NOT NULL,
+    "expiresAt" TIMESTAMP(3) NOT NULL,
+    "creationDate" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "RevokedToken_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE UNIQUE INDEX "RevokedToken_tokenId_key" ON "RevokedToken"("tokenId");
+
+-- CreateIndex
+CREATE INDEX "RevokedToken_creationDate_idx" ON "RevokedToken"("creationDate");
+
+-- CreateIndex
+CREATE INDEX "RevokedToken_expiresAt_idx" ON "RevokedToken"("expiresAt");
+
+-- AddForeignKey
+ALTER TABLE "RevokedToken" ADD CONSTRAINT "RevokedToken_userId_fkey" FOREIGN KEY ("userId") REFERENCES "User"("id") ON DELETE CASCADE ON UPDATE CASCADE;
@@ -0,0 +1,2 @@
+-- AlterTable
+ALTER TABLE "ExamSession" ADD COLUMN     "scoresVersion" INTEGER NOT NULL DEFAULT 0;
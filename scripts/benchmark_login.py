@@ -0,0 +1,96 @@
+"""
+Times concurrent password checks: bcrypt called inline on the event loop, as
+/users/login did before the password pool, as the baseline, then through
+PasswordPool. A ticker coroutine measures how long the loop is stalled,
+which is how long every other request on the worker waits.
+
+    python -m scripts.benchmark_login [--concurrency 32] [--workers 4]
+
+No database is needed.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from fastapi import HTTPException
+from app import auth
+
+TICK_SECONDS = 0.005
+
+
+async def _ticker(stalls: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        stalls.append(time.perf_counter() - started - TICK_SECONDS)
+
+
+async def _time_logins(login, concurrency: int):
+    stalls = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(stalls, stop))
+    await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    outcomes = await asyncio.gather(
+        *(login() for _ in range(concurrency)), return_exceptions=True
+    )
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await ticker
+    for outcome in outcomes:
+        if isinstance(outcome, Exception) and not isinstance(outcome, HTTPException):
+            raise outcome
+    served = sum(outcome is True for outcome in outcomes)
+    rejected = sum(isinstance(outcome, HTTPException) for outcome in outcomes)
+    return elapsed, served, rejected, stalls
+
+
+def _report(name: str, elapsed: float, served: int, rejected: int, stalls: list):
+    ordered = sorted(stalls) or [0.0]
+    print(
+        f"{name:>7}  {elapsed:7.3f}s  {served / elapsed:7.1f} logins/s  "
+        f"rejected {rejected:4d}  "
+        f"loop stall p50 {statistics.median(ordered) * 1000:8.1f}ms  "
+        f"max {ordered[-1] * 1000:8.1f}ms"
+    )
+
+
+async def benchmark(concurrency: int, workers: int, max_pending: int):
+    hashed_password = auth.pwd_context.hash("benchmark-password")
+    print(f"{concurrency} concurrent logins, bcrypt verify")
+
+    async def inline_login():
+        # The coroutine yields once, like the request handler awaiting the
+        # user lookup, then verifies on the loop.
+        await asyncio.sleep(0)
+        return auth.pwd_context.verify("benchmark-password", hashed_password)
+
+    _report("INLINE", *await _time_logins(inline_login, concurrency))
+
+    pool = auth.PasswordPool(workers=workers, max_pending=max_pending)
+
+    async def pooled_login():
+        await asyncio.sleep(0)
+        return await pool.run(
+            "verify", auth.pwd_context.verify, "benchmark-password", hashed_password
+        )
+
+    _report("POOLED", *await _time_logins(pooled_login, concurrency))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark password verification.")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=auth.PASSWORD_POOL_WORKERS)
+    parser.add_argument(
+        "--max-pending", type=int, default=auth.PASSWORD_POOL_MAX_PENDING
+    )
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.concurrency, args.workers, args.max_pending))
+
+
+if __name__ == "__main__":
+    main()
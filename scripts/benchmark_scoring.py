@@ -0,0 +1,97 @@
+"""
+Times full scoring passes of an exam session: the legacy per-answer path as
+the baseline, then each scoring mode.
+
+    python -m scripts.benchmark_scoring SESSION_ID [--modes BATCH SQL] [--repeat 3]
+
+Every pass rewrites the session's scores, and the legacy path adds onto the
+stored factor values, so run it against a copy of the database, never
+production.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from app import crud, result, schemas
+
+
+async def _time_passes(score, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await score()
+        timings.append(time.perf_counter() - started)
+    return min(timings), statistics.median(timings)
+
+
+def _report(name: str, best: float, median: float, response_count: int, baseline):
+    speedup = f"{baseline / best:8.1f}x" if baseline and best else ""
+    print(
+        f"{name:>10}  best {best:8.3f}s  median {median:8.3f}s  "
+        f"{response_count / best if best else 0:10.0f} responses/s  {speedup}"
+    )
+
+
+async def benchmark(
+    session_id: int, modes, repeat: int, baseline_repeat: int, workers, chunk_size
+):
+    await crud.prisma.connect()
+    try:
+        exam_session = await crud.get_exam_session_by_id(session_id)
+        if exam_session is None:
+            raise SystemExit(f"ExamSession {session_id} not found")
+        response_count = await crud.count_responses_for_exam_session(session_id)
+        print(f"session {session_id}: {response_count} responses")
+
+        baseline = None
+        if baseline_repeat:
+            baseline, median = await _time_passes(
+                lambda: result.legacy_calculate_session_scores(session_id),
+                baseline_repeat,
+            )
+            _report("LEGACY", baseline, median, response_count, None)
+
+        for mode in modes:
+            best, median = await _time_passes(
+                lambda: result.calculate_session_scores(
+                    exam_session, mode=mode, workers=workers, chunk_size=chunk_size
+                ),
+                repeat,
+            )
+            _report(mode.value, best, median, response_count, baseline)
+    finally:
+        await crud.prisma.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark session scoring modes.")
+    parser.add_argument("session_id", type=int)
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        type=schemas.ScoringMode,
+        default=[
+            mode for mode in schemas.ScoringMode if mode != schemas.ScoringMode.FINALIZE
+        ],
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    # The legacy path makes a round trip per answer; 0 skips it.
+    parser.add_argument("--baseline-repeat", type=int, default=1)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--chunk-size", type=int)
+    args = parser.parse_args()
+    asyncio.run(
+        benchmark(
+            args.session_id,
+            args.modes,
+            args.repeat,
+            args.baseline_repeat,
+            args.workers,
+            args.chunk_size,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
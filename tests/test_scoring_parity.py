@@ -0,0 +1,339 @@
+import os
+import unittest
+import uuid
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+from app import crud, result, schemas
+
+
+async def _insert(sql: str, *args) -> int:
+    rows = await crud.prisma.query_raw(sql + ' RETURNING "id"', *args)
+    return rows[0]["id"]
+
+
+async def _create_user(tag: str, name: str) -> int:
+    unique = f"{name}-{tag}"
+    return await _insert(
+        """
+        INSERT INTO "User" ("username", "email", "password", "first_name",
+            "last_name", "phone_number", "identity_code")
+        VALUES ($1, $2, 'x', 'Test', 'User', $1, $1)
+        """,
+        unique,
+        f"{unique}@example.com",
+    )
+
+
+async def _create_question(
+    survey_id: int, question_type: str, order: int, correct_option=None, point=None
+) -> int:
+    return await _insert(
+        """
+        INSERT INTO "Question" ("surveyId", "questionText", "questionType",
+            "order", "correctOption", "point")
+        VALUES ($1, 'Question', $2::"QuestionType", $3, $4, $5)
+        """,
+        survey_id,
+        question_type,
+        order,
+        correct_option,
+        point,
+    )
+
+
+async def _create_option(question_id: int, order: int) -> int:
+    return await _insert(
+        """
+        INSERT INTO "Option" ("questionId", "optionText", "order")
+        VALUES ($1, 'Option', $2)
+        """,
+        question_id,
+        order,
+    )
+
+
+async def _create_factor_impact(
+    factor_id: int, option_id: int, impact: int, plus: bool
+):
+    await _insert(
+        """
+        INSERT INTO "FactorImpact" ("factorId", "optionId", "impact", "plus")
+        VALUES ($1, $2, $3, $4)
+        """,
+        factor_id,
+        option_id,
+        impact,
+        plus,
+    )
+
+
+async def _create_answer(
+    response_id: int, question_id: int, option_id=None, score=None
+):
+    await _insert(
+        """
+        INSERT INTO "Answer" ("responseId", "questionId", "optionId", "score")
+        VALUES ($1, $2, $3, $4)
+        """,
+        response_id,
+        question_id,
+        option_id,
+        score,
+    )
+
+
+async def create_fixture_session() -> int:
+    # One exam over two surveys: multiple choice with points, psychology
+    # questions feeding factors with and without a parameter, and a text
+    # answer scored by hand. Some responses skip a survey, one answers
+    # nothing, and one scores zero.
+    tag = uuid.uuid4().hex[:12]
+    author_id = await _create_user(tag, "author")
+    exam_id = await _insert(
+        """
+        INSERT INTO "Exam" ("title", "description", "authorId")
+        VALUES ('Parity', 'Scoring parity fixture', $1)
+        """,
+        author_id,
+    )
+
+    options = {}
+    factors = {}
+    questions = {}
+    for survey_order in range(2):
+        survey_id = await _insert(
+            """
+            INSERT INTO "Survey" ("title", "description", "authorId")
+            VALUES ('Parity', 'Scoring parity fixture', $1)
+            """,
+            author_id,
+        )
+        await _insert(
+            """
+            INSERT INTO "ExamSurvey" ("examId", "surveyId", "order")
+            VALUES ($1, $2, $3)
+            """,
+            exam_id,
+            survey_id,
+            survey_order,
+        )
+        parameter_id = await _insert(
+            """
+            INSERT INTO "Parameter" ("name", "surveyId") VALUES ('Parameter', $1)
+            """,
+            survey_id,
+        )
+        for factor_order, factor_parameter_id in enumerate(
+            [parameter_id, parameter_id, None]
+        ):
+            factors[survey_order, factor_order] = await _insert(
+                """
+                INSERT INTO "Factor" ("name", "surveyId", "parameterId")
+                VALUES ('Factor', $1, $2)
+                """,
+                survey_id,
+                factor_parameter_id,
+            )
+
+        questions[survey_order, "choice"] = await _create_question(
+            survey_id, "MULTIPLE_CHOICE", 0, correct_option=1, point=2.5
+        )
+        questions[survey_order, "psychology"] = await _create_question(
+            survey_id, "PSYCHOLOGY", 1
+        )
+        questions[survey_order, "text"] = await _create_question(
+            survey_id, "SHORT_TEXT", 2
+        )
+        for kind in ("choice", "psychology"):
+            for order in range(3):
+                options[survey_order, kind, order] = await _create_option(
+                    questions[survey_order, kind], order
+                )
+        for order in range(3):
+            option_id = options[survey_order, "psychology", order]
+            await _create_factor_impact(
+                factors[survey_order, order % 3], option_id, order + 1, True
+            )
+            await _create_factor_impact(
+                factors[survey_order, (order + 1) % 3], option_id, 2, order % 2 == 0
+            )
+
+    session_id = await _insert(
+        """
+        INSERT INTO "ExamSession" ("examId", "startTime", "timerOnQuestion")
+        VALUES ($1, now(), false)
+        """,
+        exam_id,
+    )
+    for response_order in range(7):
+        user_id = await _create_user(tag, f"user{response_order}")
+        response_id = await _insert(
+            """
+            INSERT INTO "Response" ("userId", "examSessionId") VALUES ($1, $2)
+            """,
+            user_id,
+            session_id,
+        )
+        if response_order == 6:
+            continue
+        for survey_order in range(2):
+            if (response_order + survey_order) % 4 == 3:
+                continue
+            await _create_answer(
+                response_id,
+                questions[survey_order, "choice"],
+                options[survey_order, "choice", response_order % 3],
+            )
+            psychology_order = (response_order + survey_order) % 3
+            await _create_answer(
+                response_id,
+                questions[survey_order, "psychology"],
+                options[survey_order, "psychology", psychology_order],
+            )
+            await _create_answer(
+                response_id,
+                questions[survey_order, "text"],
+                score=float(response_order % 2),
+            )
+    return session_id
+
+
+async def reset_scores(session_id: int):
+    # Back to the unscored fixture: multiple choice scores, totals, factor
+    # and parameter values cleared; hand scores on text answers kept.
+    await crud.prisma.execute_raw(
+        """
+        UPDATE "Answer" AS a SET "score" = NULL
+        FROM "Response" AS r, "Question" AS q
+        WHERE r."id" = a."responseId" AND r."examSessionId" = $1
+          AND q."id" = a."questionId" AND q."questionType" = 'MULTIPLE_CHOICE'
+        """,
+        session_id,
+    )
+    for table in ("FactorValue", "ParameterValue"):
+        await crud.prisma.execute_raw(
+            f"""
+            DELETE FROM "{table}" AS v USING "Response" AS r
+            WHERE r."id" = v."responseId" AND r."examSessionId" = $1
+            """,
+            session_id,
+        )
+    await crud.prisma.execute_raw(
+        'UPDATE "Response" SET "totalScore" = NULL WHERE "examSessionId" = $1',
+        session_id,
+    )
+
+
+async def snapshot_scores(session_id: int):
+    # Raw rows, zero values and None totals included.
+    answers = await crud.prisma.query_raw(
+        """
+        SELECT a."id", a."score" FROM "Answer" AS a
+        JOIN "Response" AS r ON r."id" = a."responseId"
+        WHERE r."examSessionId" = $1
+        """,
+        session_id,
+    )
+    responses = await crud.prisma.query_raw(
+        'SELECT "id", "totalScore" FROM "Response" WHERE "examSessionId" = $1',
+        session_id,
+    )
+    factor_values = await crud.prisma.query_raw(
+        """
+        SELECT v."responseId", v."factorId", v."value", f."parameterId"
+        FROM "FactorValue" AS v
+        JOIN "Response" AS r ON r."id" = v."responseId"
+        JOIN "Factor" AS f ON f."id" = v."factorId"
+        WHERE r."examSessionId" = $1
+        """,
+        session_id,
+    )
+    parameter_values = await crud.prisma.query_raw(
+        """
+        SELECT v."responseId", v."parameterId", v."value" FROM "ParameterValue" AS v
+        JOIN "Response" AS r ON r."id" = v."responseId"
+        WHERE r."examSessionId" = $1
+        """,
+        session_id,
+    )
+    return {
+        "answers": {row["id"]: row["score"] for row in answers},
+        "totals": {row["id"]: row["totalScore"] for row in responses},
+        "factors": {
+            (row["responseId"], row["factorId"]): row["value"] for row in factor_values
+        },
+        "factor_parameters": {
+            (row["responseId"], row["factorId"]): row["parameterId"]
+            for row in factor_values
+        },
+        "parameters": {
+            (row["responseId"], row["parameterId"]): row["value"]
+            for row in parameter_values
+        },
+    }
+
+
+def rollup_parameters(snapshot) -> dict:
+    # The legacy path predates ParameterValue; its factor rows are summed
+    # the way the new modes define parameter values.
+    parameters = {}
+    for (response_id, factor_id), value in snapshot["factors"].items():
+        parameter_id = snapshot["factor_parameters"][response_id, factor_id]
+        if parameter_id is not None:
+            parameters[response_id, parameter_id] = (
+                parameters.get((response_id, parameter_id), 0) + value
+            )
+    return parameters
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, "TEST_DATABASE_URL is not set")
+class ScoringParityTest(unittest.IsolatedAsyncioTestCase):
+    # Needs a migrated, disposable Postgres database; the fixture rows are
+    # left in place and tagged with unique names.
+
+    async def asyncSetUp(self):
+        await crud.prisma.connect()
+
+    async def asyncTearDown(self):
+        await crud.prisma.disconnect()
+
+    async def test_modes_match_legacy_path(self):
+        session_id = await create_fixture_session()
+        exam_session = await crud.get_exam_session_by_id(session_id)
+
+        await reset_scores(session_id)
+        await result.legacy_calculate_session_scores(session_id)
+        legacy = await snapshot_scores(session_id)
+
+        self.assertIn(None, legacy["totals"].values())
+        self.assertIn(0, legacy["factors"].values())
+        # The new modes write 0 where the legacy path left the total unset.
+        expected_totals = {
+            response_id: 0 if total_score is None else total_score
+            for response_id, total_score in legacy["totals"].items()
+        }
+
+        for mode in (
+            schemas.ScoringMode.BATCH,
+            schemas.ScoringMode.VECTORIZED,
+            schemas.ScoringMode.PARALLEL,
+            schemas.ScoringMode.SQL,
+        ):
+            with self.subTest(mode=mode.value):
+                await reset_scores(session_id)
+                await result.calculate_session_scores(
+                    exam_session, mode=mode, workers=2
+                )
+                scored = await snapshot_scores(session_id)
+
+                self.assertEqual(scored["answers"], legacy["answers"])
+                self.assertEqual(scored["totals"], expected_totals)
+                self.assertEqual(scored["factors"], legacy["factors"])
+                self.assertEqual(scored["parameters"], rollup_parameters(legacy))
+
+
+if __name__ == "__main__":
+    unittest.main()